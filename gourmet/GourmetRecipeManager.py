@@ -706,7 +706,8 @@ class ImporterExporter:
 
     def do_export (self, export_all=False):
         if export_all:
-            recs = self.rd.fetch_all(self.rd.recipe_table,deleted=False,sort_by=[('title',1)])
+            recs = self.rd.fetch_all(self.rd.recipe_table,deleted=False,sort_by=[('title',1)],
+                                     columns=self.rd.get_recipe_columns())
         else:
             recs = self.get_selected_recs_from_rec_tree()
         self.exportManager.offer_multiple_export(
@@ -1,8 +1,13 @@
+from collections import Counter, defaultdict
+import functools
+import hashlib
 import os.path
 from pathlib import Path
 import re
 import time
 import shutil
+import threading
+import weakref
 from typing import Mapping, Optional, List, Any, Tuple
 
 from gettext import gettext as _
@@ -115,8 +120,73 @@ def make_order_by (sort_by, table, count_by=None, join_tables=[]):
             ret.append(sqlalchemy.desc(col))
     return ret
 
+# Characters that make a REGEXP search more than a plain substring search.
+REGEXP_SPECIAL_CHARACTERS = frozenset('.^$*+?{}[]\\|()')
+
+@functools.lru_cache(maxsize=256)
+def compile_regexp (expr):
+    """Return a case-insensitive matcher for the REGEXP expression expr.
+
+    Plain strings without any special characters don't need the
+    regular expression engine at all: for those we return the
+    lowercased string, to be searched for as a substring.
+    """
+    if REGEXP_SPECIAL_CHARACTERS.isdisjoint(expr):
+        return expr.lower()
+    return re.compile(expr,re.IGNORECASE)
+
+def regexp (expr, item):
+    """Our implementation of SQL's REGEXP operator (for sqlite)."""
+    if not item:
+        return False
+    matcher = compile_regexp(expr)
+    if isinstance(matcher, str):
+        return matcher in item.lower()
+    return matcher.search(item) is not None
+
 class DBObject:
     pass
+
+# Columns of our full text search index. Besides the recipe's own
+# text columns, it holds all of a recipe's categories and the items
+# and keys of its ingredients (one per line).
+SEARCH_INDEX_COLUMNS = ['title','instructions','modifications','source',
+                        'cuisine','link','category','ingredient']
+
+SEARCH_INDEX_ROW_SQL = '''INSERT INTO recipe_search
+(rowid, title, instructions, modifications, source, cuisine, link, category, ingredient)
+SELECT id, title, instructions, modifications, source, cuisine, link,
+(SELECT group_concat(category, char(10)) FROM categories
+ WHERE categories.recipe_id = recipe.id),
+(SELECT group_concat(coalesce(item, '') || char(10) || coalesce(ingkey, ''), char(10))
+ FROM ingredients WHERE ingredients.recipe_id = recipe.id)
+FROM recipe'''
+
+# Triggers keeping the search index in sync. Each one rebuilds the
+# index row of every recipe touched by the change.
+SEARCH_INDEX_TRIGGERS = [
+    ('recipe_search_recipe_insert', 'AFTER INSERT ON recipe', ['new.id']),
+    ('recipe_search_recipe_update',
+     'AFTER UPDATE OF title, instructions, modifications, source, cuisine, link ON recipe',
+     ['new.id']),
+    ('recipe_search_recipe_delete', 'AFTER DELETE ON recipe', ['old.id']),
+    ('recipe_search_category_insert', 'AFTER INSERT ON categories', ['new.recipe_id']),
+    ('recipe_search_category_update', 'AFTER UPDATE ON categories',
+     ['old.recipe_id','new.recipe_id']),
+    ('recipe_search_category_delete', 'AFTER DELETE ON categories', ['old.recipe_id']),
+    ('recipe_search_ingredient_insert', 'AFTER INSERT ON ingredients', ['new.recipe_id']),
+    ('recipe_search_ingredient_update',
+     'AFTER UPDATE OF recipe_id, item, ingkey ON ingredients',
+     ['old.recipe_id','new.recipe_id']),
+    ('recipe_search_ingredient_delete', 'AFTER DELETE ON ingredients', ['old.recipe_id']),
+    ]
+# Image attributes of recipes, which views of many recipes should
+# leave out (see get_recipe_columns) and fetch with get_image
+# instead. Thumbnails are kept in the recipe table; full size images
+# live in our image store and the table only holds their hash (see
+# store_image).
+IMAGE_COLUMNS = ['image','thumb']
+
 # CHANGES SINCE PREVIOUS VERSIONS...
 # categories_table: id -> recipe_id, category_entry_id -> id
 # ingredients_table: ingredient_id -> id, id -> recipe_id
@@ -167,12 +237,48 @@ class RecData (Pluggable):
         self.modify_hooks = []
         self.delete_hooks = []
         self.add_ing_hooks = []
+        # Ingredients and categories loaded in bulk by prefetch(),
+        # keyed by recipe ID.
+        self._prefetched_ings = {}
+        self._prefetched_cats = {}
+        # Connections used by do_add_fast and do_add_many_fast, one
+        # for each thread adding rows (see get_fast_connection).
+        self._fast_connections = threading.local()
+        # The keylookup table and the set of ingkeys in use, loaded
+        # on demand for the KeyManager.
+        self._keylookup_index = None
+        self._ingkeys = None
+        # The set of units used by our ingredients, loaded on demand
+        # for the ingredient parser.
+        self._units = None
+        # Objects holding the contents of a table in memory (such as
+        # dbDic), keyed by table. We call their forget_cached method
+        # whenever we change the table.
+        self.table_caches = defaultdict(weakref.WeakSet)
+        # Set by setup_search_index if we have a full text index.
+        self.search_index = False
+        # Our image store: a directory next to our database file
+        # holding one file per image, named by its SHA-256 hash.
+        self.image_dir = os.path.splitext(
+            file or os.path.join(gglobals.gourmetdir,'recipes.db')
+            )[0] + '_images'
+        self.thumbnail_cache = image_utils.ThumbnailCache(
+            os.path.join(self.image_dir,'thumbnails'))
+        # Images stored for writes that haven't been committed yet:
+        # the hashes each thread stored (see store_image), how many
+        # uncommitted writes use each hash, and the images released
+        # in the meantime (see release_image).
+        self._thread_images = threading.local()
+        self._image_lock = threading.Lock()
+        self._uncommitted_images = Counter()
+        self._released_images = set()
         timer = TimeAction('initialize_connection + setup_tables',2)
         self.initialize_connection()
         Pluggable.__init__(self,[DatabasePlugin])
         self.setup_tables()
         self.metadata.create_all()
         self.update_version_info(gourmet.version.version)
+        self.setup_search_index()
         self._created = True
         timer.end()
 
@@ -188,11 +294,13 @@ class RecData (Pluggable):
         # End REGEXP workaround
 
         # Continue setting up connection...
+        self.from_default_db = False
         if self.filename:
             if not os.path.exists(self.filename):
                 print("First time? We're setting you up with yummy recipes.")
                 source_file = Path(__file__).parent.absolute() / 'default.db'
                 shutil.copyfile(source_file, self.filename)
+                self.from_default_db = True
             self.new_db = False
         else:
             self.new_db = True  # TODO: this bool can be refactored out.
@@ -209,12 +317,6 @@ class RecData (Pluggable):
             # function for every connection created and fixes problems
             # using regexp. Based on code found here:
             # http://stackoverflow.com/questions/8076126/have-an-sqlalchemy-sqlite-create-function-issue-with-datetime-representation
-            def regexp(expr, item):
-                if item:
-                    return re.search(expr,item,re.IGNORECASE) is not None
-                else:
-                    return False
-
             @event.listens_for(self.db, 'connect')
             def on_connect (dbapi_con, con_record):
                 dbapi_con.create_function('REGEXP',2,regexp)
@@ -305,7 +407,7 @@ class RecData (Pluggable):
     def setup_recipe_table (self):
         self.recipe_table = Table('recipe',self.metadata,
                                   Column('id',Integer(),**{'primary_key':True}),
-                                  Column('title',Text(),**{}),
+                                  Column('title',Text(),index=True),
                                   Column('instructions',Text(),**{}),
                                   Column('modifications',Text(),**{}),
                                   Column('cuisine',Text(),**{}),
@@ -323,13 +425,16 @@ class RecData (Pluggable):
                                   Column('servings',Float(),**{}),
                                   Column('yields',Float(),**{}),
                                   Column('yield_unit',String(length=32),**{}),
-                                  Column('image',LargeBinary(),**{}),
+                                  # SHA-256 hash of our image, which
+                                  # is kept in our image store (see
+                                  # store_image)
+                                  Column('image_hash',String(length=64),index=True),
                                   Column('thumb',LargeBinary(),**{}),
                                   Column('deleted',Boolean(),**{}),
                                   # A hash for uniquely identifying a recipe (based on title etc)
-                                  Column('recipe_hash',String(length=32),**{}),
+                                  Column('recipe_hash',String(length=32),index=True),
                                   # A hash for uniquely identifying a recipe (based on ingredients)
-                                  Column('ingredient_hash',String(length=32),**{}),
+                                  Column('ingredient_hash',String(length=32),index=True),
                                   Column('link',Text(),**{}), # A field for a URL -- we ought to know about URLs
                                   Column('last_modified',Integer(),**{}),
                                   ) # RECIPE_TABLE_DESC
@@ -340,7 +445,7 @@ class RecData (Pluggable):
     def setup_category_table (self):
         self.categories_table = Table('categories',self.metadata,
                                     Column('id',Integer(),primary_key=True),
-                                    Column('recipe_id',Integer,ForeignKey('recipe.id'),**{}), #recipe ID
+                                    Column('recipe_id',Integer,ForeignKey('recipe.id'),index=True), #recipe ID
                                     Column('category',Text(),**{}) # Category ID
                                     ) # CATEGORY_TABLE_DESC
         class Category (object): pass
@@ -349,13 +454,13 @@ class RecData (Pluggable):
     def setup_ingredient_table (self):
         self.ingredients_table = Table('ingredients',self.metadata,
                                        Column('id',Integer(),primary_key=True),
-                                       Column('recipe_id',Integer,ForeignKey('recipe.id'),**{}),
-                                       Column('refid',Integer,ForeignKey('recipe.id'),**{}),
+                                       Column('recipe_id',Integer,ForeignKey('recipe.id'),index=True),
+                                       Column('refid',Integer,ForeignKey('recipe.id'),index=True),
                                        Column('unit',Text(),**{}),
                                        Column('amount',Float(),**{}),
                                        Column('rangeamount',Float(),**{}),
                                        Column('item',Text(),**{}),
-                                       Column('ingkey',Text(),**{}),
+                                       Column('ingkey',Text(),index=True),
                                        Column('optional',Boolean(),**{}),
                                        #Integer so we can distinguish unset from False
                                        Column('shopoptional',Integer(),**{}),
@@ -370,9 +475,9 @@ class RecData (Pluggable):
         # Keylookup table - for speedy keylookup
         self.keylookup_table = Table('keylookup',self.metadata,
                                      Column('id',Integer(),primary_key=True),
-                                     Column('word',Text(),**{}),
-                                      Column('item',Text(),**{}),
-                                      Column('ingkey',Text(),**{}),
+                                     Column('word',Text(),index=True),
+                                      Column('item',Text(),index=True),
+                                      Column('ingkey',Text(),index=True),
                                       Column('count',Integer(),**{})
                                      ) # INGKEY_LOOKUP_TABLE_DESC
         class KeyLookup (object): pass
@@ -459,6 +564,110 @@ class RecData (Pluggable):
         self.setup_unitdict_table()
         self.setup_convtable_table()
 
+    def setup_search_index (self):
+        """Set up our full text search index, if our database can do it.
+
+        The index is an SQLite FTS5 table using the trigram tokenizer,
+        which (unlike the default tokenizer) matches arbitrary
+        substrings, so it can answer the same '%text%' searches we
+        would otherwise do with LIKE. Triggers keep it up to date.
+        Other databases, or SQLite builds without FTS5, keep searching
+        with LIKE.
+
+        Once our triggers exist, every change to our recipes,
+        categories and ingredients writes to the index, and fails on
+        an SQLite without FTS5 and trigrams. So each time we start we
+        check that our index answers a real search, and if it doesn't,
+        we drop our triggers to keep the database writable. If we then
+        find the index without its triggers on an SQLite that can use
+        it, it's out of date, and we build it again.
+
+        The index is built in a single transaction, so we never leave
+        an empty or half-built index behind.
+        """
+        if not self.url.startswith('sqlite'):
+            return
+        trigger_names = [name for name,event,ids in SEARCH_INDEX_TRIGGERS]
+        conn = self.db.raw_connection()
+        try:
+            cursor = conn.cursor()
+            tables = dict(cursor.execute(
+                "SELECT name, type FROM sqlite_master WHERE name = 'recipe_search' OR "
+                "(type = 'trigger' AND name IN (%s))"%','.join('?'*len(trigger_names)),
+                trigger_names
+                ).fetchall())
+            if 'recipe_search' in tables:
+                try:
+                    cursor.execute(
+                        """SELECT rowid FROM recipe_search WHERE recipe_search MATCH '"abc"' LIMIT 1"""
+                        ).fetchall()
+                except conn.Error:
+                    debug('Our full text index no longer works -- searching without it',0)
+                    cursor.execute('BEGIN')
+                    for name in trigger_names:
+                        cursor.execute('DROP TRIGGER IF EXISTS %s'%name)
+                    conn.commit()
+                    return
+                if len(tables) == len(trigger_names) + 1:
+                    self.search_index = True
+                    return
+                debug('Our full text index is out of date -- rebuilding it',0)
+            cursor.execute('BEGIN')
+            try:
+                cursor.execute('DROP TABLE IF EXISTS recipe_search')
+                cursor.execute(
+                    'CREATE VIRTUAL TABLE recipe_search USING fts5(%s, tokenize="trigram")'
+                    %', '.join(SEARCH_INDEX_COLUMNS))
+                for name,event,ids in SEARCH_INDEX_TRIGGERS:
+                    body = ''
+                    for id in ids:
+                        body += 'DELETE FROM recipe_search WHERE rowid = %s;\n'%id
+                        body += '%s WHERE recipe.id = %s;\n'%(SEARCH_INDEX_ROW_SQL,id)
+                    cursor.execute('DROP TRIGGER IF EXISTS %s'%name)
+                    cursor.execute('CREATE TRIGGER %s %s BEGIN\n%sEND'%(name,event,body))
+                cursor.execute(SEARCH_INDEX_ROW_SQL)
+            except conn.Error:
+                conn.rollback()
+                debug('No FTS5 support -- searching without a full text index',0)
+                return
+            conn.commit()
+            self.search_index = True
+        finally:
+            conn.close()
+
+    def get_search_index_criteria (self, crit):
+        """Return criteria using our full text index for search crit.
+
+        Return None if our index can't answer this search, in which
+        case we fall back to LIKE or REGEXP.
+        """
+        if not self.search_index or crit.get('operator','LIKE')!='LIKE':
+            return None
+        column = crit['column']
+        if column!='anywhere' and column not in SEARCH_INDEX_COLUMNS:
+            return None
+        search = crit['search']
+        if not isinstance(search, str) or not (
+            len(search)>2 and search[0]=='%' and search[-1]=='%'):
+            return None
+        text = search[1:-1]
+        # Trigrams can't match fewer than three characters, and
+        # wildcards in the middle of a search aren't substrings.
+        if len(text) < 3 or '%' in text or '_' in text:
+            return None
+        query = '"%s"'%text.replace('"','""')
+        if column!='anywhere':
+            query = '%s : %s'%(column,query)
+        search_table = sqlalchemy.table('recipe_search',sqlalchemy.column('rowid'))
+        return self.recipe_table.c.id.in_(
+            sqlalchemy.select(
+                [search_table.c.rowid],
+                sqlalchemy.literal_column('recipe_search').op('MATCH')(
+                    sqlalchemy.bindparam('search_index_query',query,unique=True)
+                    )
+                )
+            )
+
     def backup_db (self):
         """Make a backup copy of the DB -- this ensures experimental
         code won't permanently screw our users."""
@@ -469,12 +678,19 @@ class RecData (Pluggable):
         print('Making a backup copy of DB in ',backup_file_name)
         print('You can use it to restore if something ugly happens.')
         shutil.copy(self.filename,backup_file_name) # Make a backup...
+        details = _("A backup has been made in %s in case something goes wrong. If this upgrade fails, you can manually rename your backup file recipes.db to recover it for use with older Gourmet.")%backup_file_name
+        if os.path.exists(self.image_dir):
+            # ...of our images too (but not of thumbnails, which we
+            # can always make again).
+            shutil.copytree(self.image_dir,backup_file_name + '_images',
+                            ignore=shutil.ignore_patterns('thumbnails'))
+            details += ' ' + _("Your images have been backed up in %s.")%(backup_file_name + '_images')
         import gourmet.gtk_extras.dialog_extras as de
         de.show_message(
             title=_("Upgrading database"),
             label=_("Upgrading database"),
             sublabel=_("Depending on the size of your database, this may be an intensive process and may take  some time. Your data has been automatically backed up in case something goes wrong."),
-            expander=(_("Details"),_("A backup has been made in %s in case something goes wrong. If this upgrade fails, you can manually rename your backup file recipes.db to recover it for use with older Gourmet.")%backup_file_name),
+            expander=(_("Details"),details),
             message_type=Gtk.MessageType.INFO)
 
     def update_version_info (self, version_string):
@@ -511,6 +727,11 @@ class RecData (Pluggable):
             stored_info = self.fetch_one(self.info_table)
 
         ### Code for updates between versions...
+        # Images moved out of the recipe table after 0.17.5. This
+        # check is idempotent, so we make it every time, and we make
+        # it first, since the updates below expect our recipe table to
+        # have its current columns.
+        self.move_images_to_store()
         if not self.new_db:
             sv_text = "%s.%s.%s"%(stored_info.version_super,stored_info.version_major,stored_info.version_minor)
             #print 'STORED_INFO:',stored_info.version_super,stored_info.version_major,stored_info.version_minor
@@ -672,8 +893,15 @@ class RecData (Pluggable):
                 self.delete_by_criteria(self.keylookup_table,{})
                 # And update it in accord with current ingredients (less
                 # than an ideal decision, alas)
-                for ingredient in self.fetch_all(self.ingredients_table,deleted=False):
-                    self.add_ing_to_keydic(ingredient.item,ingredient.ingkey)
+                self.add_ings_to_keydic(Counter(
+                    (ingredient.item,ingredient.ingkey)
+                    for ingredient in self.fetch_all(self.ingredients_table,deleted=False)
+                    ))
+
+            # Indexes on our lookup columns were added after 0.17.5.
+            # Creating missing indexes is cheap and idempotent, so
+            # rather than tying this to a version we check every time.
+            self.create_missing_indexes()
 
             for plugin in self.plugins:
                 self.update_plugin_version(plugin,
@@ -695,6 +923,24 @@ class RecData (Pluggable):
                 id_col=None
                 )
 
+    def create_missing_indexes (self):
+        """Create any index defined on our tables that the database lacks.
+
+        metadata.create_all only creates indexes along with new
+        tables, so databases created by older versions of Gourmet
+        need their indexes added here.
+        """
+        inspector = sqlalchemy.inspect(self.db)
+        existing_tables = inspector.get_table_names()
+        for table in self.metadata.sorted_tables:
+            if not table.indexes or table.name not in existing_tables:
+                continue
+            existing = [i['name'] for i in inspector.get_indexes(table.name)]
+            for index in table.indexes:
+                if index.name not in existing:
+                    debug('Creating index %s'%index.name,1)
+                    index.create(self.db)
+
     def update_plugin_version (self, plugin, current_version=None):
         if current_version:
             current_super,current_major,current_minor = current_version
@@ -748,10 +994,20 @@ class RecData (Pluggable):
             t.end()
 
     # basic DB access functions
-    def fetch_all (self, table, sort_by=[], **criteria):
-        return table.select(*make_simple_select_arg(criteria,table),
-                            **{'order_by':make_order_by(sort_by,table)}
-                            ).execute().fetchall()
+    def fetch_all (self, table, sort_by=[], columns=None, **criteria):
+        """Fetch all rows of table matching criteria.
+
+        columns is an optional list of the column names to fetch; by
+        default we fetch them all.
+        """
+        if columns is None:
+            return table.select(*make_simple_select_arg(criteria,table),
+                                **{'order_by':make_order_by(sort_by,table)}
+                                ).execute().fetchall()
+        return sqlalchemy.select([getattr(table.c,c) for c in columns],
+                                 *make_simple_select_arg(criteria,table),
+                                 **{'order_by':make_order_by(sort_by,table)}
+                                 ).execute().fetchall()
 
     def fetch_one (self, table, **criteria):
         """Fetch one item from table and arguments"""
@@ -831,6 +1087,9 @@ class RecData (Pluggable):
         elif not isinstance(crit, dict):
             raise TypeError
         else:
+            search_index_criteria = self.get_search_index_criteria(crit)
+            if search_index_criteria is not None:
+                return search_index_criteria
             #join_crit = None # if we need to add an extra arg for a join
             if crit['column']=='category':
                 subtable = self.categories_table
@@ -872,13 +1131,20 @@ class RecData (Pluggable):
 
             return retval
 
-    def search_recipes (self, searches, sort_by=[]):
+    def search_recipes (self, searches, sort_by=[], columns=None):
         """Search recipes for columns of values.
 
         "category" and "ingredient" are handled magically
 
         sort_by is a list of tuples (column,1) [ASCENDING] or (column,-1) [DESCENDING]
+
+        columns is an optional list of the recipe columns to fetch --
+        see get_recipe_columns.
         """
+        if columns is None:
+            columns = [c for c in self.recipe_table.c]
+        else:
+            columns = [getattr(self.recipe_table.c,c) for c in columns]
         if 'rating' in [t[0] for t in sort_by]:
             i = [t[0] for t in sort_by].index('rating')
             d = (sort_by[i][1]==1 and -1 or 1)
@@ -886,17 +1152,217 @@ class RecData (Pluggable):
         criteria = self.get_criteria((searches,'and'))
         debug('backends.db.search_recipes - search criteria are %s'%searches,2)
         if 'category' in [s[0] for s in sort_by]:
-            return sqlalchemy.select([c for c in self.recipe_table.c],# + [self.categories_table.c.category],
+            return sqlalchemy.select(columns,# + [self.categories_table.c.category],
                                      criteria,distinct=True,
                                      from_obj=[sqlalchemy.outerjoin(self.recipe_table,self.categories_table)],
                                      order_by=make_order_by(sort_by,self.recipe_table,
                                                             join_tables=[self.categories_table])
                                      ).execute().fetchall()
         else:
-            return sqlalchemy.select([self.recipe_table],criteria,distinct=True,
+            return sqlalchemy.select(columns,criteria,distinct=True,
                                      order_by=make_order_by(sort_by,self.recipe_table,),
                                      ).execute().fetchall()
 
+    def get_recipe_columns (self, exclude=IMAGE_COLUMNS):
+        """Return the names of our recipe columns, less those in
+        exclude. By default we leave out the image columns, which
+        views of many recipes should only fetch for the rows they
+        show (see get_image).
+        """
+        return [c.name for c in self.recipe_table.c if c.name not in exclude]
+
+    def get_image (self, rec, column='image'):
+        """Return the image (or thumbnail, if column is 'thumb') for
+        rec, which is a recipe or a recipe ID.
+
+        We only go to the database if rec was fetched without the
+        column (or, for images, without the image_hash column).
+        """
+        if column=='image':
+            return self.load_image(self.get_image_hash(rec))
+        try:
+            return getattr(rec,column)
+        except AttributeError:
+            pass
+        rid = getattr(rec,'id',rec)
+        return sqlalchemy.select([getattr(self.recipe_table.c,column)],
+                                 self.recipe_table.c.id==rid
+                                 ).execute().scalar()
+
+    def get_thumbnail (self, rec, size, image=None):
+        """Return a pixbuf of the image of rec (a recipe or a recipe
+        ID) scaled down to size, or None if rec has no image.
+
+        Thumbnails are cached in memory and on disk (see
+        image_utils.ThumbnailCache). image is the image to scale, if
+        the caller already has it; otherwise we use our stored
+        thumbnail for small sizes and the full image for larger ones.
+        """
+        rid = getattr(rec,'id',rec)
+        if max(image_utils.ThumbnailCache.get_dimensions(size)) <= image_utils.LIST_THUMBSIZE:
+            column = 'thumb'
+        else:
+            column = 'image'
+        def get_image ():
+            return image or self.get_image(rec,column)
+        image_hash = self.get_image_hash(rec)
+        if not image_hash:
+            # Thumbnails without an image can't be cached by hash.
+            thumb = column=='thumb' and get_image()
+            return image_utils.bytes_to_pixbuf(thumb) if thumb else None
+        return self.thumbnail_cache.get_pixbuf(rid,image_hash,size,get_image)
+
+    def get_image_hash (self, rec):
+        """Return the hash of the image of rec (a recipe or a recipe
+        ID), or None if it has no image."""
+        return self.get_image(rec,'image_hash')
+
+    def fetch_images (self, ids, column='thumb'):
+        """Return a dictionary of {id:image} for the recipes with IDs
+        in ids that have an image (or thumbnail).
+        """
+        if column=='image':
+            return {rid:self.load_image(image_hash)
+                    for rid,image_hash in self.fetch_images(ids,'image_hash').items()}
+        col = getattr(self.recipe_table.c,column)
+        images = {}
+        ids = list(ids)
+        for n in range(0,len(ids),500):
+            for rid,image in sqlalchemy.select(
+                [self.recipe_table.c.id,col],
+                and_(self.recipe_table.c.id.in_(ids[n:n+500]),col!=None)
+                ).execute():
+                images[rid] = image
+        return images
+
+    # Image store. Images are kept out of the recipe table, in files
+    # named by the SHA-256 hash of their contents, so that identical
+    # images are only stored once. An image's reference count is the
+    # number of recipes whose image_hash points to it; once that
+    # drops to zero, release_image removes the file.
+
+    def get_image_path (self, image_hash):
+        return os.path.join(self.image_dir,image_hash[:2],image_hash)
+
+    def store_image (self, image):
+        """Add image (bytes) to our image store and return its hash.
+
+        The image stays in our store, even if it is released, until
+        this thread calls commit_images to say the write using it has
+        been committed.
+        """
+        image_hash = hashlib.sha256(image).hexdigest()
+        # Hold on to the image before looking for it, so that
+        # release_image can't remove it from under us.
+        with self._image_lock:
+            self._uncommitted_images[image_hash] += 1
+        if not hasattr(self._thread_images,'hashes'):
+            self._thread_images.hashes = []
+        self._thread_images.hashes.append(image_hash)
+        path = self.get_image_path(image_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path),exist_ok=True)
+            # Write to a temporary file first so that we never leave
+            # a partial image under a valid name.
+            tmp_path = path + '.tmp'
+            with open(tmp_path,'wb') as fi:
+                fi.write(image)
+            os.replace(tmp_path,path)
+        return image_hash
+
+    def load_image (self, image_hash):
+        """Return the image stored under image_hash, or None."""
+        if not image_hash:
+            return None
+        try:
+            with open(self.get_image_path(image_hash),'rb') as fi:
+                return fi.read()
+        except OSError:
+            debug('Image %s is missing from %s'%(image_hash,self.image_dir),0)
+            return None
+
+    def count_image_references (self, image_hash):
+        return sqlalchemy.select([func.count(self.recipe_table.c.id)],
+                                 self.recipe_table.c.image_hash==image_hash
+                                 ).execute().scalar()
+
+    def release_image (self, image_hash):
+        """Remove image_hash from our store if no recipe uses it.
+
+        If a write that hasn't been committed yet (a buffered import,
+        say) stored the same image, we wait for commit_images to
+        check again.
+        """
+        if not image_hash:
+            return
+        with self._image_lock:
+            self._released_images.add(image_hash)
+        self.purge_released_images()
+
+    def commit_images (self):
+        """Tell us that the writes this thread stored images for have
+        been committed, so that released images they don't use can go.
+        """
+        hashes = getattr(self._thread_images,'hashes',None)
+        if not hashes:
+            return
+        self._thread_images.hashes = []
+        with self._image_lock:
+            for image_hash in hashes:
+                self._uncommitted_images[image_hash] -= 1
+                if self._uncommitted_images[image_hash] <= 0:
+                    del self._uncommitted_images[image_hash]
+        self.purge_released_images()
+
+    def purge_released_images (self):
+        """Remove released images that no recipe uses and no
+        uncommitted write is holding on to."""
+        with self._image_lock:
+            for image_hash in list(self._released_images):
+                if image_hash in self._uncommitted_images:
+                    continue
+                self._released_images.discard(image_hash)
+                if not self.count_image_references(image_hash):
+                    try:
+                        os.remove(self.get_image_path(image_hash))
+                    except OSError:
+                        pass
+
+    def move_images_to_store (self):
+        """Move images out of the recipe table into our image store.
+
+        Older databases kept images in an image column of the recipe
+        table. We add the image_hash column if need be and move any
+        images we find over; this is idempotent, so it is cheap to
+        check every time. Older Gourmets won't find the images we
+        move, so we back up our database first.
+        """
+        columns = [c['name'] for c in sqlalchemy.inspect(self.db).get_columns('recipe')]
+        if 'image_hash' not in columns:
+            self.add_column_to_table(self.recipe_table,('image_hash',String(length=64),{}))
+        if 'image' not in columns:
+            return
+        ids = [r[0] for r in self.db.execute(
+            'SELECT id FROM recipe WHERE image IS NOT NULL')]
+        if not ids:
+            return
+        if not self.from_default_db:
+            # (A database we just copied from default.db has nothing
+            # worth backing up.)
+            self.backup_db()
+        print('Moving %s recipe images into %s'%(len(ids),self.image_dir))
+        with self.db.begin() as conn:
+            for rid in ids:
+                image = conn.execute(sqlalchemy.text('SELECT image FROM recipe WHERE id = :id'),
+                                     id=rid).scalar()
+                conn.execute(
+                    sqlalchemy.text('UPDATE recipe SET image_hash = :image_hash, image = NULL WHERE id = :id'),
+                    image_hash=image and self.store_image(image) or None,id=rid)
+        self.commit_images()
+        if self.url.startswith('sqlite'):
+            # Hand the space the images took back to the filesystem.
+            self.db.execute('VACUUM')
+
     def get_unique_values (self, colname,table=None,**criteria):
         """Get list of unique values for column in table."""
         if table is None: table=self.recipe_table
@@ -958,6 +1424,7 @@ class RecData (Pluggable):
         if len(delete_args) > 1:
             delete_args = [and_(*delete_args)]
         table.delete(*delete_args).execute()
+        self._forget_cached(table)
 
     def update_by_criteria (self, table, update_criteria, new_values_dic):
         try:
@@ -970,6 +1437,7 @@ class RecData (Pluggable):
                 del new_values_dic[k]
                 new_values_dic[str(k)] = v
             table.update(*make_simple_select_arg(update_criteria,table)).execute(**new_values_dic)
+            self._forget_cached(table)
         except:
             print('update_by_criteria error...')
             print('table:',table)
@@ -1143,7 +1611,12 @@ class RecData (Pluggable):
 
         Return modified recipe.
         """
+        # validate_recdic swaps any image for its hash; work on a copy
+        # so that the caller (e.g. an undo action) keeps the image.
+        dic = dic.copy()
         self.validate_recdic(dic)
+        if 'image_hash' in dic:
+            old_image_hash = self.get_image_hash(rec)
         debug('validating dictionary',3)
         if 'category' in dic:
             newcats = dic['category'].split(', ')
@@ -1158,6 +1631,11 @@ class RecData (Pluggable):
             del dic['category']
         debug('do modify rec',3)
         retval = self.do_modify_rec(rec,dic)
+        self.commit_images()
+        if 'image_hash' in dic and old_image_hash!=dic['image_hash']:
+            self.release_image(old_image_hash)
+        if 'image_hash' in dic or 'thumb' in dic:
+            self.thumbnail_cache.forget(rec.id)
         self.update_hashes(rec)
         return retval
 
@@ -1169,7 +1647,7 @@ class RecData (Pluggable):
             try:
                 img = image_utils.bytes_to_image(recdic['image'])
                 thumb = img.copy()
-                thumb.thumbnail((40, 40))
+                thumb.thumbnail((image_utils.LIST_THUMBSIZE,image_utils.LIST_THUMBSIZE))
                 recdic['thumb'] = image_utils.image_to_bytes(thumb)
             except:
                 del recdic['image']
@@ -1180,6 +1658,10 @@ class RecData (Pluggable):
                 """)
                 import traceback
                 traceback.print_stack()
+        if 'image' in recdic:
+            # The recipe table only holds a hash of our image.
+            image = recdic.pop('image')
+            recdic['image_hash'] = image and self.store_image(image) or None
         for k,v in list(recdic.items()):
             if isinstance(v, str):
                 recdic[k] = v.strip()
@@ -1259,6 +1741,37 @@ class RecData (Pluggable):
         If accept_ids is True, we accept recipes with IDs already
         set. These IDs need to have been reserved with the new_id()
         method.
+
+        If dic has no recipe_hash and ingredient_hash, we hash the
+        recipe once it's added. Callers adding ingredients afterwards
+        should hand us the hashes of the finished recipe (see
+        recipeIdentifier.hash_recipe_dicts).
+        """
+        cats = self.prepare_recdic(dic)
+        try:
+            ret = self.do_add_rec(dic)
+        except:
+            print('Problem adding recipe with dictionary...')
+            for k,v in list(dic.items()): print('KEY:',k,'of type',type(k),'VALUE:',v,'of type',type(v))
+            raise
+        else:
+            if isinstance(ret, int):
+                ID = ret
+                ret = self.get_rec(ID)
+            else:
+                ID = ret.id
+            self.commit_images()
+            for c in cats:
+                if c: self.do_add_cat({'recipe_id':ID,'category':c})
+            if not (dic.get('recipe_hash') and dic.get('ingredient_hash')):
+                self.update_hashes(ret)
+            return ret
+
+    def prepare_recdic (self, dic):
+        """Get a recipe dictionary ready to be added to the database.
+
+        The category string is removed from dic and returned as a
+        list of categories.
         """
         cats = []
         if 'category' in dic:
@@ -1277,22 +1790,7 @@ class RecData (Pluggable):
                     del dic['servings']
         if 'deleted' not in dic: dic['deleted']=False
         self.validate_recdic(dic)
-        try:
-            ret = self.do_add_rec(dic)
-        except:
-            print('Problem adding recipe with dictionary...')
-            for k,v in list(dic.items()): print('KEY:',k,'of type',type(k),'VALUE:',v,'of type',type(v))
-            raise
-        else:
-            if isinstance(ret, int):
-                ID = ret
-                ret = self.get_rec(ID)
-            else:
-                ID = ret.id
-            for c in cats:
-                if c: self.do_add_cat({'recipe_id':ID,'category':c})
-            self.update_hashes(ret)
-            return ret
+        return cats
 
     def add_ing_and_update_keydic (self, dic):
         if 'item' in dic and 'ingkey' in dic and dic['item'] and dic['ingkey']:
@@ -1324,6 +1822,7 @@ class RecData (Pluggable):
         except ValueError:
             for d in dics: self.coerce_types(self.ingredients_table,d)
             self.ingredients_table.insert().execute(*dics)
+        self._forget_cached(self.ingredients_table,added=dics)
 
     # Lower level DB access functions -- hopefully subclasses can
     # stick to implementing these
@@ -1348,18 +1847,97 @@ class RecData (Pluggable):
                     dic[k] = v
 
     def commit_fast_adds (self):
-        if hasattr(self,'extra_connection'):
-            self.extra_connection.commit()
+        """Commit the rows this thread has added with do_add_fast and
+        do_add_many_fast (and let go of the images they use; see
+        commit_images)."""
+        conn = getattr(self._fast_connections,'connection',None)
+        if conn is not None:
+            conn.commit()
+        self.commit_images()
+
+    def get_fast_connection (self):
+        """Return the connection do_add_fast and do_add_many_fast use
+        in this thread.
+
+        sqlite connections can't be shared between threads, so each
+        thread adding rows (an importer, say) gets its own.
+        """
+        conn = getattr(self._fast_connections,'connection',None)
+        if conn is None:
+            conn = self._fast_connections.connection = self.db.connect().connection
+        return conn
+
+    def begin_fast_adds (self):
+        """Open a transaction for do_add_fast and do_add_many_fast in
+        this thread.
+
+        Return False if our backend can't do fast adds. We hold the
+        write lock until commit_fast_adds is called, so anyone adding
+        a lot of rows should commit them in batches.
+        """
+        if not self.url.startswith('sqlite'):
+            return False
+        conn = self.get_fast_connection()
+        if not conn.in_transaction:
+            conn.execute('BEGIN IMMEDIATE')
+        return True
+
+    def reserve_ids (self, n):
+        """Reserve n consecutive recipe IDs for fast adds and return
+        the first of them.
+
+        Like new_id, we hold on to our IDs with a deleted placeholder
+        recipe, here a single one with the last of our IDs, so that
+        whoever adds a recipe after us gets an ID after ours. Recipes
+        using that ID have to be added with replace=True, and the
+        placeholder deleted if the ID doesn't get used.
+
+        This commits this thread's fast adds. Return None if our
+        backend can't do fast adds.
+        """
+        if not self.begin_fast_adds():
+            return None
+        conn = self.get_fast_connection()
+        max_id = conn.execute('SELECT max(id) FROM recipe').fetchone()[0]
+        first = (max_id or 0) + 1
+        conn.execute('INSERT INTO recipe (id, deleted) VALUES (?, 1)',(first+n-1,))
+        self.commit_fast_adds()
+        self._forget_cached(self.recipe_table)
+        return first
+
+    def do_add_many_fast (self, table, dics, replace=False):
+        '''Add a list of rows with a single executemany -- return None
+
+        The dictionaries don't need to share keys: missing columns
+        are added as NULL. If replace is True, our rows replace any
+        rows that have the same primary key.
+        '''
+        if not dics: return
+        if not self.url.startswith('sqlite'):
+            for d in dics: self.do_add(table,d)
+            return
+        columns = {}
+        for d in dics:
+            columns.update(dict.fromkeys(d))
+        columns = list(columns)
+        SQL = (replace and 'INSERT OR REPLACE INTO ' or 'INSERT INTO ') + table.name
+        SQL += '('+', '.join(columns) + ')'
+        SQL += ' VALUES (' + ", ".join(['?']*len(columns)) + ')'
+        self.get_fast_connection().executemany(
+            SQL,
+            [[d.get(c) for c in columns] for d in dics]
+            )
+        self._forget_cached(table,added=None if replace else dics)
 
     def do_add_fast (self, table, dic):
         '''Add fast -- return None'''
-        if not hasattr(self,'extra_connection'):
-            self.extra_connection = self.db.connect().connection
+        conn = self.get_fast_connection()
         try:
             tname = table.name
             SQL = 'INSERT INTO ' + tname + '('+', '.join(list(dic.keys())) + ')'
             SQL += ' VALUES (' +  ", ".join(['?']*len(dic)) + ')'
-            self.extra_connection.execute(SQL,list(dic.values()))
+            conn.execute(SQL,list(dic.values()))
+            self._forget_cached(table,added=[dic])
         except:
             return self.do_add(table,dic)
 
@@ -1372,6 +1950,7 @@ class RecData (Pluggable):
             print('Had to coerce types',table,dic)
             self.coerce_types(table,dic)
             result_proxy = insert_statement.execute(**dic)
+        self._forget_cached(table,added=[dic])
         return result_proxy
 
     def do_add_and_return_item (self, table, dic, id_prop='id'):
@@ -1441,8 +2020,86 @@ class RecData (Pluggable):
         else:
             qr = table.update().execute(**d)
             select = table.select()
+        self._forget_cached(table)
         return select.execute().fetchone()
 
+    def prefetch (self, recipe_ids, with_ings=True, with_cats=True):
+        """Load ingredients and/or categories for many recipes at once.
+
+        recipe_ids is a list of IDs (or recipe objects). Afterwards,
+        get_ings and get_cats answer for these recipes from memory
+        rather than with a query per recipe. Prefetched data is
+        dropped whenever ingredients or categories change, or when
+        clear_prefetched is called.
+
+        We return the IDs of the recipes we loaded something new for,
+        so callers can clear just what they prefetched when they're
+        done with it.
+        """
+        ids = [getattr(r,'id',r) for r in recipe_ids]
+        new_ids = [i for i in ids
+                   if (with_ings and i not in self._prefetched_ings)
+                   or (with_cats and i not in self._prefetched_cats)]
+        if with_ings:
+            ings = self._fetch_by_recipe_ids(
+                self.ingredients_table, ids,
+                self.ingredients_table.c.deleted==False)
+            self._prefetched_ings.update(ings)
+        if with_cats:
+            cats = self._fetch_by_recipe_ids(self.categories_table, ids)
+            self._prefetched_cats.update(
+                (rid,[c.category for c in rows]) for rid,rows in cats.items()
+                )
+        return new_ids
+
+    def _fetch_by_recipe_ids (self, table, ids, *criteria):
+        """Return a dictionary of recipe ID -> rows of table."""
+        rows_by_id = dict((rid,[]) for rid in ids)
+        # Keep our IN (...) clauses below SQLite's limit on host
+        # parameters.
+        chunk_size = 500
+        for start in range(0,len(ids),chunk_size):
+            chunk = ids[start:start+chunk_size]
+            rows = table.select(and_(table.c.recipe_id.in_(chunk),*criteria),
+                                order_by=table.c.id).execute().fetchall()
+            for row in rows:
+                rows_by_id[row.recipe_id].append(row)
+        return rows_by_id
+
+    def clear_prefetched (self, recipe_ids=None):
+        """Drop the ingredients and categories prefetch loaded for
+        recipe_ids, or for every recipe if recipe_ids is None."""
+        if recipe_ids is None:
+            self._prefetched_ings.clear()
+            self._prefetched_cats.clear()
+            return
+        for i in recipe_ids:
+            self._prefetched_ings.pop(i,None)
+            self._prefetched_cats.pop(i,None)
+
+    def _forget_cached (self, table, added=None):
+        """Forget what we've cached from table, which has changed.
+
+        If the change only added rows, added is the list of their
+        dictionaries: our sets of ingredient keys and units then take
+        in the new values, rather than being read again.
+        """
+        if table is self.ingredients_table:
+            self._prefetched_ings.clear()
+            if added is None:
+                self._ingkeys = None
+                self._units = None
+            else:
+                for values,col in [(self._ingkeys,'ingkey'),(self._units,'unit')]:
+                    if values is not None:
+                        values.update(d[col] for d in added if d.get(col) is not None)
+        elif table is self.categories_table:
+            self._prefetched_cats.clear()
+        elif table is self.keylookup_table:
+            self._keylookup_index = None
+        for cache in list(self.table_caches.get(table,())):
+            cache.forget_cached()
+
     def get_ings (self, rec):
         """Handed rec, return a list of ingredients.
 
@@ -1451,11 +2108,16 @@ class RecData (Pluggable):
             id=rec.id
         else:
             id=rec
+        if id in self._prefetched_ings:
+            return list(self._prefetched_ings[id])
         return self.fetch_all(self.ingredients_table,recipe_id=id,deleted=False)
 
     def get_cats (self, rec):
-        svw = self.fetch_all(self.categories_table,recipe_id=rec.id)
-        cats =  [c.category or '' for c in svw]
+        if rec.id in self._prefetched_cats:
+            cats = [c or '' for c in self._prefetched_cats[rec.id]]
+        else:
+            svw = self.fetch_all(self.categories_table,recipe_id=rec.id)
+            cats =  [c.category or '' for c in svw]
         # hackery...
         while '' in cats:
             cats.remove('')
@@ -1509,7 +2171,10 @@ class RecData (Pluggable):
         if not isinstance(rec, int):
             rec = rec.id
         debug('deleting recipe ID %s'%rec,0)
+        image_hash = self.get_image_hash(rec)
         self.delete_by_criteria(self.recipe_table,{'id':rec})
+        self.release_image(image_hash)
+        self.thumbnail_cache.forget(rec)
         self.delete_by_criteria(self.categories_table,{'recipe_id':rec})
         self.delete_by_criteria(self.ingredients_table,{'recipe_id':rec})
         debug('deleted recipe ID %s'%rec,0)
@@ -1720,39 +2385,136 @@ class RecData (Pluggable):
         else:
             key = str(key)
 
-        row = self.fetch_one(self.keylookup_table, item=item, ingkey=key)
-        if row:
-            self.do_modify(self.keylookup_table,row,{'count':row.count+1})
-        else:
-            self.do_add(self.keylookup_table,{'item':item,'ingkey':key,'count':1})
+        self._change_keydic_count('item',item,key,1)
         # The below code should move to a plugin for users who care about ingkeys...
         for w in item.split():
-            w = w.casefold()
-            row = self.fetch_one(self.keylookup_table,word=str(w),ingkey=str(key))
-            if row:
-                self.do_modify(self.keylookup_table,row,{'count':row.count+1})
-            else:
-                self.do_add(self.keylookup_table,{'word':str(w),'ingkey':str(key),'count':1})
+            self._change_keydic_count('word',w.casefold(),key,1)
+
+    @pluggable_method
+    def add_ings_to_keydic (self, pairs):
+        """Add many items and keys to our keydic at once.
+
+        pairs is a dictionary {(item, key): n} -- a
+        collections.Counter, say -- of items and keys to add n times
+        each. We read and write the keylookup table in a few batches
+        rather than a few queries per ingredient, as
+        add_ing_to_keydic does.
+        """
+        changes = defaultdict(int)
+        for (item,key),n in pairs.items():
+            if not item or not key: continue
+            if isinstance(item, bytes): item = item.decode('utf-8','replace')
+            if isinstance(key, bytes): key = key.decode('utf-8','replace')
+            item,key = str(item),str(key)
+            changes[('item',item,key)] += n
+            for w in item.split():
+                changes[('word',w.casefold(),key)] += n
+        if changes:
+            self._change_keydic_counts(changes)
 
     def remove_ing_from_keydic (self, item, key):
         #print 'remove ',item,key,'to keydic'
-        row = self.fetch_one(self.keylookup_table,item=item,ingkey=key)
-        if row:
-            new_count = row.count - 1
-            if new_count:
-                self.do_modify(self.keylookup_table,row,{'count':new_count})
-            else:
-                self.delete_by_criteria(self.keylookup_table,{'item':item,'ingkey':key})
+        self._change_keydic_count('item',item,key,-1)
         for word in item.split():
-            word = word.lower()
-            row = self.fetch_one(self.keylookup_table, item=item, ingkey=key)
-            if row:
-                new_count = row.count - 1
-                if new_count:
-                    self.do_modify(self.keylookup_table, row, {'count':new_count})
+            self._change_keydic_count('word',word.casefold(),key,-1)
+
+    def _change_keydic_count (self, column, value, key, change):
+        """Change the count for value (an item or a word) and key in
+        the keylookup table, adding or deleting the row as necessary.
+
+        We write to keylookup_table directly so that we can update our
+        in-memory index rather than throwing it away.
+        """
+        table = self.keylookup_table
+        row = self.fetch_one(table,**{column:value,'ingkey':key})
+        count = (row and row.count or 0) + change
+        if row and count > 0:
+            table.update(table.c.id==row.id).execute(count=count)
+        elif row:
+            table.delete(table.c.id==row.id).execute()
+        elif count > 0:
+            table.insert().execute(**{column:value,'ingkey':key,'count':count})
+        if self._keylookup_index is not None:
+            counts = self._keylookup_index[column][value]
+            if count > 0:
+                counts[key] = count
+            else:
+                counts.pop(key,None)
+                if not counts: del self._keylookup_index[column][value]
+
+    def _change_keydic_counts (self, changes):
+        """Change many counts in the keylookup table at once.
+
+        changes is a dictionary {(column, value, key): change}; see
+        _change_keydic_count.
+        """
+        table = self.keylookup_table
+        rows = {}
+        keys = list(set(key for column,value,key in changes))
+        for n in range(0,len(keys),500):
+            for row in self.fetch_all(table,ingkey=('in',keys[n:n+500])):
+                for column in ('item','word'):
+                    k = (column,getattr(row,column),row.ingkey)
+                    if k in changes and k not in rows:
+                        rows[k] = row
+        updates,deletes,inserts = [],[],[]
+        for k,change in changes.items():
+            column,value,key = k
+            row = rows.get(k)
+            count = (row and row.count or 0) + change
+            if row and count > 0:
+                updates.append({'row_id':row.id,'new_count':count})
+            elif row:
+                deletes.append(row.id)
+            elif count > 0:
+                inserts.append({'item':None,'word':None,column:value,
+                                'ingkey':key,'count':count})
+            if self._keylookup_index is not None:
+                counts = self._keylookup_index[column][value]
+                if count > 0:
+                    counts[key] = count
                 else:
-                    self.delete_by_criteria(self.keylookup_table,{'word':word,
-                                                                  'ingkey':key})
+                    counts.pop(key,None)
+                    if not counts: del self._keylookup_index[column][value]
+        if updates:
+            table.update(table.c.id==sqlalchemy.bindparam('row_id')).values(
+                count=sqlalchemy.bindparam('new_count')).execute(updates)
+        for n in range(0,len(deletes),500):
+            table.delete(table.c.id.in_(deletes[n:n+500])).execute()
+        if inserts:
+            table.insert().execute(inserts)
+
+    def get_keylookup_index (self):
+        """Return our keylookup table as a dictionary of the form
+        {'item':{item:{ingkey:count}}, 'word':{word:{ingkey:count}}}
+
+        The table is read once; add_ing_to_keydic and
+        remove_ing_from_keydic keep the index up to date after that.
+        """
+        if self._keylookup_index is None:
+            index = {'item':defaultdict(dict),'word':defaultdict(dict)}
+            table = self.keylookup_table
+            for word,item,ingkey,count in sqlalchemy.select(
+                [table.c.word,table.c.item,table.c.ingkey,table.c.count],
+                order_by=table.c.id).execute():
+                for column,value in [('item',item),('word',word)]:
+                    if value:
+                        counts = index[column][value]
+                        counts[ingkey] = counts.get(ingkey,0) + (count or 0)
+            self._keylookup_index = index
+        return self._keylookup_index
+
+    def get_ingkeys (self):
+        """Return the set of ingkeys used by our ingredients."""
+        if self._ingkeys is None:
+            self._ingkeys = set(self.get_unique_values('ingkey',self.ingredients_table))
+        return self._ingkeys
+
+    def get_units (self):
+        """Return the set of units used by our ingredients."""
+        if self._units is None:
+            self._units = set(self.get_unique_values('unit',self.ingredients_table))
+        return self._units
 
     def ing_shopper (self, view):
         return DatabaseShopper(self.ingview_to_lst(view))
@@ -1764,6 +2526,8 @@ class RecData (Pluggable):
         for k in keys:
             if k=='category':
                 v = ", ".join(self.get_cats(obj))
+            elif k in IMAGE_COLUMNS:
+                v = self.get_image(obj,k)
             else:
                 v=getattr(obj,k)
             orig_dic[k]=v
@@ -1914,44 +2678,23 @@ class RecipeManager:
         """Handed a string, we hand back a dictionary representing a parsed ingredient (sans recipe ID)"""
         #if conv:
         #    print 'parse_ingredient: conv argument is now ignored'
-        debug('ingredient_parser handed: %s'%s,0)
-        # Strip whitespace and bullets...
-        d={}
+        debug('ingredient_parser handed: %s'%s,5)
         if isinstance(s, bytes):
             s = s.decode('utf8')
-        s = s.strip(
-                '\u2022\u2023\u2043\u204C\u204D\u2219\u25C9\u25D8\u25E6\u2619\u2765\u2767\u29BE\u29BF\n\t #*+-')
-        option_m = re.match(r'\s*optional:?\s*',s,re.IGNORECASE)
-        if option_m:
-            s = s[option_m.end():]
-            d['optional']=True
-        debug('ingredient_parser handed: "%s"'%s,1)
-        m=convert.ING_MATCHER.match(s)
-        if m:
-            debug('ingredient parser successfully parsed %s'%s,1)
-            a,u,i=(m.group(convert.ING_MATCHER_AMT_GROUP),
-                   m.group(convert.ING_MATCHER_UNIT_GROUP),
-                   m.group(convert.ING_MATCHER_ITEM_GROUP))
-            if a:
-                asplit = convert.RANGE_MATCHER.split(a)
-                if len(asplit)==2:
-                    d['amount']=convert.frac_to_float(asplit[0].strip())
-                    d['rangeamount']=convert.frac_to_float(asplit[1].strip())
-                else:
-                    d['amount']=convert.frac_to_float(a.strip())
+        matched,fields,u,i = convert.split_ingredient(s)
+        d = dict(fields)
+        if matched:
             if u:
                 conv = convert.get_converter()
                 if conv and u.strip() in conv.unit_dict:
                     # Don't convert units to our units!
                     d['unit']=u.strip()
+                elif u.strip() in self.rd.get_units():
+                    # this unit has been used before
+                    d['unit']=u
                 else:
-                    # has this unit been used
-                    prev_uses = self.rd.fetch_all(self.rd.ingredients_table,unit=u.strip())
-                    if prev_uses:
-                        d['unit']=u
-                    else:
-                        # otherwise, unit is not a unit
-                        i = u + ' ' + i
+                    # otherwise, unit is not a unit
+                    i = u + ' ' + i
             if i:
                 optmatch = re.search(r'\s+\(?[Oo]ptional\)?',i)
                 if optmatch:
@@ -1959,13 +2702,18 @@ class RecipeManager:
                     i = i[0:optmatch.start()] + i[optmatch.end():]
                 d['item']=i.strip()
                 if get_key: d['ingkey']=self.km.get_key(i.strip())
-            debug('ingredient_parser returning: %s'%d,0)
+            debug('ingredient_parser returning: %s'%d,5)
             return d
         else:
-            debug("Unable to parse %s"%s,0)
-            d['item'] = s
+            debug("Unable to parse %s"%s,5)
+            d['item'] = i
             return d
 
+    def parse_ingredients (self, lines, get_key=True):
+        """Handed a list of strings, we hand back a list of
+        dictionaries as parse_ingredient does, one per string."""
+        return [self.parse_ingredient(l,get_key=get_key) for l in lines]
+
     ingredient_parser = parse_ingredient
 
     def ing_search (self, ing, keyed=None, recipe_table=None, use_regexp=True, exact=False):
@@ -2058,38 +2806,58 @@ class DatabaseConverter(convert.Converter):
 
 class dbDic:
     def __init__ (self, keyprop, valprop, view, db):
-        """Create a dictionary interface to a database table."""
+        """Create a dictionary interface to a database table.
+
+        We load the whole table into memory the first time we're
+        asked for anything and write changes through to the
+        database. If the table is changed behind our back, the
+        database tells us (see RecData.table_caches) and we reload.
+        """
         self.vw = view
         self.kp = keyprop
         self.vp = valprop
         self.db = db
-        self.just_got = {}
+        self.cache = None
+        self.writing = False
+        self.db.table_caches[self.vw].add(self)
+
+    def forget_cached (self):
+        if not self.writing:
+            self.cache = None
+
+    def load (self):
+        if self.cache is None:
+            self.cache = {}
+            for k,v in sqlalchemy.select([getattr(self.vw.c,self.kp),
+                                          getattr(self.vw.c,self.vp)]).execute():
+                # Like fetch_one, we go with the first row for a key.
+                self.cache.setdefault(k,v)
+        return self.cache
 
     def has_key (self, k):
-        try:
-            self.just_got = {k:self.__getitem__(k)}
-            return True
-        except:
-            try:
-                self.__getitem__(k)
-                return True
-            except:
-                return False
+        return k in self.load()
+
+    __contains__ = has_key
 
     def __setitem__ (self, k, v):
         store_v = v
-        row = self.db.fetch_one(self.vw,**{self.kp:k})
-        if row:
-            self.db.do_modify(self.vw, row, {self.vp:store_v},id_col=self.kp)
-        else:
-            self.db.do_add(self.vw,{self.kp:k,self.vp:store_v})
+        self.writing = True
+        try:
+            if k in self.load():
+                self.db.update_by_criteria(self.vw,{self.kp:k},{self.vp:store_v})
+            else:
+                self.db.do_add(self.vw,{self.kp:k,self.vp:store_v})
+        finally:
+            self.writing = False
+        self.cache[k] = store_v
         self.db.changed=True
         return v
 
     def __getitem__ (self, k):
-        if k in self.just_got: return self.just_got[k]
-        v = getattr(self.db.fetch_one(self.vw,**{self.kp:k}),self.vp)
-        return v
+        return self.load()[k]
+
+    def __len__ (self):
+        return len(self.load())
 
     def __repr__ (self):
         retstr = "<dbDic> {"
@@ -2118,34 +2886,17 @@ class dbDic:
                 k = str(k)
             dics.append({self.kp:k,self.vp:store_v})
         self.vw.insert().execute(*dics)
+        for cache in list(self.db.table_caches[self.vw]):
+            cache.forget_cached()
 
     def keys (self):
-        ret = []
-        for i in self.db.fetch_all(self.vw):
-            ret.append(getattr(i,self.kp))
-        return ret
+        return list(self.load().keys())
 
     def values (self):
-        ret = []
-        for i in self.db.fetch_all(self.vw):
-            val = getattr(i,self.vp)
-            ret.append(val)
-        return ret
+        return list(self.load().values())
 
     def items (self):
-        ret = []
-        for i in self.db.fetch_all(self.vw):
-            try:
-                key = getattr(i,self.kp)
-                val = getattr(i,self.vp)
-            except:
-                print('TRYING TO GET',self.kp,self.vp,'from',self.vw)
-                print('ERROR!!!')
-                import traceback; traceback.print_exc()
-                print('IGNORING')
-                continue
-            ret.append((key,val))
-        return ret
+        return list(self.load().items())
 
 # TODO:
 # fetch_one -> use whatever syntax sqlalchemy uses throughout
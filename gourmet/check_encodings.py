@@ -1,3 +1,6 @@
+import codecs
+import io
+import os
 from typing import Dict
 from gi.repository import Gtk
 from .gdebug import debug
@@ -5,6 +8,45 @@ from .gtk_extras import dialog_extras as de
 from gettext import gettext as _
 from .prefs import Prefs
 
+# We guess a file's encoding from a sample of it: SAMPLE_SIZE bytes
+# from its start, plus SAMPLE_CHUNKS chunks of CHUNK_SIZE bytes from
+# further in.
+SAMPLE_SIZE = 64 * 1024
+SAMPLE_CHUNKS = 4
+CHUNK_SIZE = 16 * 1024
+
+# Byte order marks, and the codecs they tell us to use. UTF-32's must
+# come before UTF-16's, which they start with.
+BOMS = [(codecs.BOM_UTF8, 'utf_8_sig'),
+        (codecs.BOM_UTF32_LE, 'utf_32'),
+        (codecs.BOM_UTF32_BE, 'utf_32'),
+        (codecs.BOM_UTF16_LE, 'utf_16'),
+        (codecs.BOM_UTF16_BE, 'utf_16'),
+        ]
+
+# The encodings we've settled on for files we've read, by
+# (filename, modification time, size), so that we only have to guess
+# (or ask) once per file.
+encoding_cache = {}
+
+# Whether getEncoding can ask the user. Processes without a GUI (such
+# as our importers' worker processes) turn this off.
+ask_user = True
+
+
+class EncodingUnknown(Exception):
+    """Raised by getEncoding when we'd have to ask the user to
+    choose an encoding, but can't (see ask_user)."""
+
+
+def decode_as_latin_1(error):
+    """Decode bytes our codec can't as Latin-1, which can decode
+    anything (see StreamFile)."""
+    return error.object[error.start:error.end].decode('latin_1'), error.end
+
+
+codecs.register_error('gourmet-latin-1', decode_as_latin_1)
+
 
 class CheckEncoding:
     """A class to read a file and guess the correct text encoding."""
@@ -24,15 +66,18 @@ class CheckEncoding:
                      'utf_16_be', 'utf_16_le', 'utf_7', 'utf_8']
 
     def __init__(self, file, encodings=None):
-        if Prefs.instance().get('utf-16', False):
-            self.encodings.extend(['utf_16', 'utf_16_le', 'utf_16_be'])
-        if encodings is not None:
-            self.encodings = encodings
+        self.set_encodings(encodings)
         if isinstance(file, str):
             file = open(file, 'rb')
         self.txt = file.read()
         file.close()
 
+    def set_encodings(self, encodings=None):
+        if Prefs.instance().get('utf-16', False):
+            self.encodings = self.encodings + ['utf_16', 'utf_16_le', 'utf_16_be']
+        if encodings is not None:
+            self.encodings = encodings
+
     def test_encodings(self):
         """Move through self.encodings one at a time and return the first
         encoding that decodes our text cleanly. We return a tuple (encoding,decoded_text)"""
@@ -66,20 +111,186 @@ class CheckEncoding:
         return self.possible_encodings
 
 class GetFile(CheckEncoding):
-    """Handed a filename, return a list of lines."""
-    def __init__(self, file: str, encodings=None):
-        super().__init__(file, encodings)
+    """Handed a filename (or a binary file object), return a list of lines.
+
+    Rather than decoding the whole file with every encoding we know,
+    we guess the encoding from a sample of the file (see
+    guess_encoding), and then decode the file once.
+    """
+    def __init__(self, file, encodings=None):
+        self.set_encodings(encodings)
+        cache_key = get_cache_key(file)
+        if isinstance(file, str):
+            file = open(file, 'rb')
+        with file:
+            if file.seekable():
+                sample = read_sample(file)
+                file.seek(0)
+                self.txt = file.read()
+            else:
+                self.txt = file.read()
+                sample = sample_bytes(self.txt)
+        encoding = encoding_cache.get(cache_key) or self.guess_encoding(sample)
+        text = None
+        if encoding:
+            try:
+                text = self.txt.decode(encoding)
+            except (UnicodeDecodeError, LookupError):
+                debug('Our sample of %s misled us about its encoding'%file, 0)
+        if text is None:
+            encoding, text = self.choose_encoding()
+        self.txt = None
+        if cache_key:
+            encoding_cache[cache_key] = encoding
+        self.enc = encoding
+        self.lines = text.splitlines()
+        debug('reading file %s as encoding %s'%(file, self.enc))
+
+    def guess_encoding(self, sample):
+        """Guess our encoding from sample, a list of chunks of our
+        file (the first being its start).
+
+        Return the encoding, or None if we can't tell. If our sample
+        could be in several of our encodings, we ask the user.
+        """
+        for bom, encoding in BOMS:
+            if sample[0].startswith(bom):
+                return encoding
+        if all(chunk.isascii() for chunk in sample):
+            # If there's anything but ASCII in the rest of the file,
+            # decoding it will fail, and we'll look at all of it.
+            return 'ascii'
+        if ('utf-8' in self.encodings or 'utf_8' in self.encodings) and is_utf8(sample):
+            return 'utf-8'
+        self.txt, txt = b'\n'.join(sample), self.txt
+        try:
+            encs = self.test_all_encodings(self.encodings)
+        finally:
+            self.txt = txt
+        if len(encs) > 1:
+            return getEncoding(encodings=encs)
+        elif encs:
+            return list(encs.keys())[0]
+
+    def choose_encoding(self):
+        """Decode our whole text with every encoding we know, asking
+        the user to choose if there's more than one way to read it.
+
+        Return a tuple (encoding, decoded_text).
+        """
         encs: Dict[str, str] = self.get_encodings()
         if encs:
             if len(list(encs.keys())) > 1:
                 encoding = getEncoding(encodings=encs)
             else:
                 encoding = list(encs.keys())[0]
-            self.enc = encoding
-            self.lines = encs[self.enc].splitlines()
-            debug('reading file %s as encoding %s'%(file, self.enc))
+            return encoding, encs[encoding]
+        else:
+            raise Exception("Cannot decode file")
+
+
+class StreamFile(GetFile):
+    """Handed a filename (or a binary file object), read it a line at
+    a time, without holding the whole file in memory.
+
+    We guess the encoding from a sample of the file, as GetFile does,
+    but can't go back and look at the whole file if the guess turns
+    out wrong part way through. So we read a file whose sample is
+    plain ASCII as UTF-8, and read any bytes our encoding can't decode
+    as Latin-1.
+    """
+    def __init__(self, file, encodings=None):
+        self.set_encodings(encodings)
+        cache_key = get_cache_key(file)
+        if isinstance(file, str):
+            file = open(file, 'rb')
+        self.size = None
+        if file.seekable():
+            sample = read_sample(file)
+            self.size = file.seek(0, os.SEEK_END)
+            file.seek(0)
         else:
-            raise Exception("Cannot decode file %s" % file)
+            file = io.BufferedReader(file, SAMPLE_SIZE)
+            sample = [file.peek(SAMPLE_SIZE)[:SAMPLE_SIZE]]
+        self.file = file
+        encoding = encoding_cache.get(cache_key) or self.guess_encoding(sample)
+        if encoding in (None, 'ascii'):
+            encoding = 'utf-8'
+        if cache_key:
+            encoding_cache[cache_key] = encoding
+        self.enc = encoding
+        debug('streaming file %s as encoding %s'%(file, self.enc))
+
+    def __iter__(self):
+        with io.TextIOWrapper(self.file, self.enc, errors='gourmet-latin-1') as text:
+            for line in text:
+                # Split lines just as str.splitlines does for GetFile.
+                yield from line.splitlines()
+
+    def get_progress(self):
+        """Return how far through our file we are, as a fraction, or
+        -1 if we can't tell."""
+        if not self.size or self.file.closed:
+            return -1
+        return self.file.tell() / self.size
+
+
+def get_cache_key(file):
+    """Return the key for file in encoding_cache, or None if file
+    isn't a filename."""
+    if isinstance(file, str):
+        st = os.stat(file)
+        return os.path.abspath(file), st.st_mtime_ns, st.st_size
+
+
+def sample_chunks(size):
+    """Return the (start, length) of each chunk we sample from a file
+    of size bytes, after the first SAMPLE_SIZE."""
+    if size <= SAMPLE_SIZE:
+        return []
+    elif size <= SAMPLE_SIZE + CHUNK_SIZE * SAMPLE_CHUNKS:
+        return [(SAMPLE_SIZE, size - SAMPLE_SIZE)]
+    step = (size - SAMPLE_SIZE - CHUNK_SIZE) // SAMPLE_CHUNKS
+    return [(SAMPLE_SIZE + step * n, CHUNK_SIZE)
+            for n in range(1, SAMPLE_CHUNKS + 1)]
+
+
+def read_sample(file):
+    """Return a sample of seekable binary file object file, as a list
+    of chunks, the first being its start."""
+    sample = [file.read(SAMPLE_SIZE)]
+    for start, length in sample_chunks(file.seek(0, os.SEEK_END)):
+        file.seek(start)
+        sample.append(file.read(length))
+    return sample
+
+
+def sample_bytes(txt):
+    """Return a sample of bytes txt, as read_sample would of a file."""
+    return [txt[:SAMPLE_SIZE]] + [txt[start:start + length]
+                                  for start, length in sample_chunks(len(txt))]
+
+
+def is_utf8(sample):
+    """Return True if sample (see read_sample) is valid UTF-8.
+
+    Chunks from the middle of a file can start and end part way
+    through a character, which we allow.
+    """
+    for n, chunk in enumerate(sample):
+        if n:
+            # Skip the tail of a character we've started in.
+            skip = 0
+            while skip < 3 and skip < len(chunk) and 0x80 <= chunk[skip] < 0xc0:
+                skip += 1
+            chunk = chunk[skip:]
+        try:
+            # Without final=True, the decoder doesn't mind a
+            # character cut off at the end.
+            codecs.getincrementaldecoder('utf-8')().decode(chunk)
+        except UnicodeDecodeError:
+            return False
+    return True
 
 
 def get_file(file: str, encodings=None):
@@ -241,6 +452,8 @@ class EncodingDialog(de.OptionDialog):
 
 
 def getEncoding(*args, **kwargs):
+    if not ask_user:
+        raise EncodingUnknown()
     dialog = EncodingDialog(*args, **kwargs)
     result = dialog.run()
     if (not result) and dialog.encodings:
@@ -1,4 +1,4 @@
-import re, locale, math
+import re, locale, math, functools
 import collections.abc
 from typing import Optional
 from .defaults.defaults import lang as defaults
@@ -68,6 +68,11 @@ class PossiblyCaseInsensitiveDictionary(collections.abc.MutableMapping):
         self.__mapping[norm] = value
 
 
+# adjust_unit caches its results for amounts rounded to this many
+# decimal places.
+ADJUST_UNIT_PRECISION = 6
+ADJUST_UNIT_CACHE_SIZE = 4096
+
 class Converter:
 
     __single = None
@@ -125,6 +130,9 @@ class Converter:
         self.add_time_table()
         self.build_converter_dictionary()
         self.build_converter_dictionary(self.v2m_table,density=True)
+        self.create_unit_group_table()
+        self.adjust_unit_cache = functools.lru_cache(maxsize=ADJUST_UNIT_CACHE_SIZE)(
+            self._adjust_unit)
 
     def add_time_table (self):
         for u,conv in list(self.unit_to_seconds.items()):
@@ -139,6 +147,38 @@ class Converter:
     def create_vol_to_mass_table (self):
         self.v2m_table = defaults.VOL_TO_MASS_TABLE.copy()
 
+    def create_unit_group_table (self):
+        """Precompute what adjust_unit and readability_score need for
+        each unit: the units of its group we can convert to (with
+        their conversion factors) and its readability range."""
+        self.unit_group_table = {}
+        for ugroup,units in defaults.UNIT_GROUPS.items():
+            for u,rng in units:
+                self.unit_group_table[(u,ugroup)] = [
+                    (u2,conv) for u2,conv in
+                    [(u2,self.converter(u,u2)) for u2,rng2 in units]
+                    if conv
+                    ]
+        self.readability_ranges = {}
+        for u,(ugroup,n) in defaults.unit_group_lookup.items():
+            self.readability_ranges[u] = defaults.UNIT_GROUPS[ugroup][n][1]
+        for unit,u in self.unit_dict.items():
+            if u in defaults.unit_group_lookup:
+                self.readability_ranges[unit] = self.readability_ranges[u]
+            else:
+                self.readability_ranges.pop(unit,None)
+
+    def get_group_conversions (self, u, ugroup):
+        """Return a list of (unit, conversion factor) for the units
+        in ugroup we can convert u to."""
+        if (u,ugroup) not in self.unit_group_table:
+            self.unit_group_table[(u,ugroup)] = [
+                (u2,conv) for u2,conv in
+                [(u2,self.converter(u,u2)) for u2,rng in defaults.UNIT_GROUPS[ugroup]]
+                if conv
+                ]
+        return self.unit_group_table[(u,ugroup)]
+
     def create_cross_unit_table (self):
         self.cross_unit_table = defaults.CROSS_UNIT_TABLE.copy()
 
@@ -161,52 +201,58 @@ class Converter:
             for v in variations:
                 self.unit_dict[v] = key
 
+    def build_unit_graph (self, table):
+        """Return a dictionary mapping each unit in table to a
+        dictionary of the units it converts to directly and the
+        factors to convert by."""
+        graph = collections.defaultdict(dict)
+        for k,v in list(table.items()):
+            if len(k)!=2: continue
+            u1,u2 = k
+            graph[u1][u2] = float(v)
+            graph[u2][u1] = float(1) / float(v)
+        return graph
+
+    def expand_unit (self, graph, u):
+        """Return a dictionary of every unit we can reach from u in
+        graph, along with the factor to convert u to it."""
+        factors = {u:1.0}
+        to_expand = collections.deque([u])
+        while to_expand:
+            itm = to_expand.popleft()
+            for k,v in graph[itm].items():
+                if k not in factors:
+                    factors[k] = factors[itm] * v
+                    to_expand.append(k)
+        return factors
+
     def build_converter_dictionary (self, table=None, density=False):
-        # first, make a list of all units in our dictionaries
+        """Add the conversions we can derive from table to table.
+
+        Afterwards, table has an entry for any two units it can
+        convert between, so that a conversion is a single lookup.
+
+        If density is True, table is a table of volume to mass
+        conversions (for a density of 1), which we expand using the
+        simple conversions in our conv_table.
+        """
         if not density:
-            convert = self.convert_simple
+            if not table:
+                table=self.conv_table
+            graph = self.build_unit_graph(table)
+            # self.conversions[u1][u2] is the number of u2 in a u1.
+            self.conversions = {u:self.expand_unit(graph,u) for u in graph}
+            for u1,factors in self.conversions.items():
+                for u2,factor in factors.items():
+                    if u1!=u2 and (u1,u2) not in table and (u2,u1) not in table:
+                        table[(u1,u2)] = factor
         else:
-            def convert (u1,u2):
-                # Ignore anything that doesn't need density
-                if self.convert_simple(u1,u2): return None
-                return self.convert_w_density(u1,u2,density=1)
-        units = []
-        if not table:
-            table=self.conv_table
-        #else:
-            #print "We were handed a table: ",table
-        for u1,u2 in [x for x in list(table.keys()) if len(x)==2]:
-            if u1 not in units: units.append(u1)
-            if u2 not in units: units.append(u2)
-        #print 'done looping through list'
-        for u in units:
-            #print 'grabbing possible conversions for ',u
-            debug('unit=%s'%u)
-            d=self.possible_conversions(u,dict=table)
-            to_expand = list(d.keys())
-            # keep a list of what we've expanded
-            expanded = []
-            while len(to_expand) >= 1:
-                itm = to_expand.pop()
-                if itm not in expanded:
-                    #debug('Expanding %s'%itm)
-                    factor = convert(itm,u)
-                    #debug('There are %s %s in a %s'%(factor,u,itm))
-                    d2 = self.possible_conversions(itm)
-                    if factor:
-                        for k,v in list(d2.items()):
-                            if not convert(u,k):
-                                #debug('and there are %s %s in a %s'%(v,itm,k))
-                                conversion = float(v) * float(factor)
-                                # If we're doing density, we want to
-                                # make sure we always have our tuples
-                                # (volume,density)
-                                if density and itm not in [key[0] for key in list(table.keys())]:
-                                    table[(u,k)]=float(1)/conversion
-                                else: table[(k,u)]= conversion
-                            if k not in expanded and k not in to_expand and k != itm and k != u:
-                                to_expand.append(k)
-                    expanded.append(itm)
+            # Our tables always have (volume,mass) tuples.
+            for (v,m),factor in [x for x in list(table.items()) if len(x[0])==2]:
+                for vol,vol_factor in self.conversions.get(v,{v:1.0}).items():
+                    for mass,mass_factor in self.conversions.get(m,{m:1.0}).items():
+                        if (vol,mass) not in table and (mass,vol) not in table:
+                            table[(vol,mass)] = (float(factor) * mass_factor) / vol_factor
 
     def convert_simple (self, u1, u2, item=None):
         if u1 == u2:
@@ -285,7 +331,7 @@ class Converter:
         debug('using density data')
         return self.convert_w_density(u1,u2,item=item,density=density)
 
-    def get_conversions (self, u, item=None, density=None):
+    def get_conversions_table (self, item=None, density=None):
         dct = None
         if item or density:
             dct = self.conv_table.copy()
@@ -293,29 +339,27 @@ class Converter:
                 dct.update(self.conv_dict_for_item(item))
             elif density:
                 dct.update(self.conv_dict_for_item(mult=density))
-        return self.possible_conversions(u, dct)
+        return dct
+
+    def get_conversions (self, u, item=None, density=None):
+        return self.possible_conversions(u, self.get_conversions_table(item,density))
 
     def get_all_conversions (self, u, item=None, density=None):
-        dict = self.get_conversions(u, item, density)
-        expanded = []
-        conversions = list(dict.keys())
-        lst = conversions[0:] # make another copy to chew up
-        while len(lst) >= 1:
-            itm = lst.pop()
-            if not itm in conversions:
-                conversions.append(itm)
-            if not itm in expanded:
-                d = self.get_conversions(u,itm,density)
-                lst.extend(list(d.keys()))
-                expanded.append(itm)
-        return conversions
+        if item or density:
+            graph = self.build_unit_graph(self.get_conversions_table(item,density))
+            return [k for k in self.expand_unit(graph,u) if k != u]
+        else:
+            return list(self.possible_conversions(u).keys())
 
     def possible_conversions(self, u, dict=0):
         """Return a dictionary of everything that unit u can convert to
         The keys are what it can convert to and the values are the conversion
         factor."""
         if (not dict):
-            dict=self.conv_table
+            # Our conv_table holds every conversion we know of (see
+            # build_converter_dictionary), so we just look them up.
+            return {k:self.convert_simple(k,u)
+                    for k in self.conversions.get(u,{}) if k != u}
         ret = {}
         entries = list(dict.items())
         for item in entries:
@@ -327,6 +371,23 @@ class Converter:
                 ret[i1] = float(item[1])
         return ret
 
+    def get_readability_range (self, unit):
+        """Return the (min, max) readable amounts for unit, or None if
+        unit is not in a unit group."""
+        try:
+            u = self.unit_dict[unit]
+        except KeyError:
+            debug("KeyError looking up unit",1)
+            u = unit
+        try:
+            ugroup,n = defaults.unit_group_lookup[u]
+        except KeyError:
+            debug('Key Error for %s in \nunit_group_lookup: %s'%(unit,defaults.unit_group_lookup),
+                  0)
+            return None
+        else:
+            return defaults.UNIT_GROUPS[ugroup][n][1]
+
     def readability_score (self,amt,unit=None):
         """We rate the readability of a number and unit
 
@@ -363,30 +424,20 @@ class Converter:
             # if we are beyond the min or max for our group, we take
             # a substantial readability hit (this is worse than anything
             # else)
-            try:
-                u = self.unit_dict[unit]
-            except KeyError:
-                debug("KeyError looking up unit",1)
-                u = unit
-            try:
-                ugroup,n = defaults.unit_group_lookup[u]
-            except KeyError:
-                debug('Key Error for %s in \nunit_group_lookup: %s'%(unit,defaults.unit_group_lookup),
-                      0)
-                #raise
-                return -10
-            else:
-                u,rng = defaults.UNIT_GROUPS[ugroup][n]
-                mn,mx = rng
-                debug('Readability range for %s = %s:%s'%(u,mn,mx),8)
-                if mn and amt and  amt < mn:
-                    readability += -2
-                    # we add a penalty proportional to the undersizedness
-                    if (mn-amt): readability += -(2 * (mn - amt))/amt
-                if mx and amt > mx:
-                    readability += -2
-                    # now we get clever and add a penalty proportional to the oversizedness
-                    if (amt-mx): readability += - ((amt - mx)/float(mx))*2
+            rng = self.readability_ranges.get(unit)
+            if rng is None:
+                rng = self.get_readability_range(unit)
+                if rng is None:
+                    return -10
+            mn,mx = rng
+            if mn and amt and  amt < mn:
+                readability += -2
+                # we add a penalty proportional to the undersizedness
+                if (mn-amt): readability += -(2 * (mn - amt))/amt
+            if mx and amt > mx:
+                readability += -2
+                # now we get clever and add a penalty proportional to the oversizedness
+                if (amt-mx): readability += - ((amt - mx)/float(mx))*2
         else:
             # otherwise, we'll make some assumptions about numbers
             # we don't like things over a thousand and we really don't
@@ -430,21 +481,40 @@ class Converter:
                              preference, to avoid changing the unit if unnecessary.
         Here we do our best to provide readable units, so that the user is presented
         with 1/2 cup rather than 8 tablespoons, for example.
+
+        Results are cached by rounded amount, so that displaying the
+        same amounts over and over again is cheap.
         """
         if not amt: return amt,unit
+        try:
+            key = round(amt,ADJUST_UNIT_PRECISION)
+        except TypeError:
+            return amt,unit
+        if not key:
+            # Too small to tell from 0 at our precision; leave it be.
+            return amt,unit
+        factor,ret_unit = self.adjust_unit_cache(key,unit,favor_current_unit,
+                                                 tuple(preferred_unit_groups))
+        if factor == 1:
+            return amt,ret_unit
+        return amt * factor,ret_unit
+
+    def _adjust_unit (self, amt, unit, favor_current_unit, preferred_unit_groups):
+        """Return the conversion factor and unit adjust_unit should
+        use for amt and unit."""
         try:
             u = self.unit_dict[unit]
             ugroup,n = defaults.unit_group_lookup[u]
         except KeyError:
-            return amt,unit
+            return 1,unit
         else:
-            units=defaults.UNIT_GROUPS[ugroup]
+            orig_amt = amt
             if preferred_unit_groups:
                 if ugroup not in preferred_unit_groups:
                     for ug in preferred_unit_groups:
                         conv = self.converter(u,defaults.UNIT_GROUPS[ug][0][0])
                         if conv:
-                            units = defaults.UNIT_GROUPS[ug]
+                            ugroup = ug
                             amt = conv * amt
                             u = unit = defaults.UNIT_GROUPS[ug][0][0]
                             break
@@ -455,14 +525,9 @@ class Converter:
             ret_amt = amt
             ret_unit = unit
             ret_distance = 0
-            n1 = 0
-            for u2,rng in units:
-                conv = self.converter(u,u2)
-                if not conv:
-                    continue
+            for n1,(u2,conv) in enumerate(self.get_group_conversions(u,ugroup)):
                 new_amt = conv * amt
                 readability = self.readability_score(new_amt,u2)
-                debug('%s %s, Readability = %s'%(new_amt,u2,readability),6)
                 use_us = False
                 if readability > ret_readability:
                     use_us = True
@@ -473,11 +538,10 @@ class Converter:
                     ret_distance = abs(n-n1)
                     ret_unit = u2
                     ret_readability = readability
-                n1 += 1
-            debug('adjust unit called with %s %s, returning %s %s (R:%s)'%(amt,unit,ret_amt,ret_unit,
+            debug('adjust unit called with %s %s, returning %s %s (R:%s)'%(orig_amt,unit,ret_amt,ret_unit,
                                                                            ret_readability),
                   3)
-            return ret_amt,ret_unit
+            return ret_amt / orig_amt,ret_unit
 
     def use_reasonable_unit (self, amt1, u1, amt2, u2, conv):
         """Given the conversion factor and the amounts,
@@ -856,6 +920,42 @@ ING_MATCHER_AMT_GROUP = 'amount'
 ING_MATCHER_UNIT_GROUP = 'unit'
 ING_MATCHER_ITEM_GROUP = 'item'
 
+# Bullets and other characters we strip from ingredient lines.
+INGREDIENT_LINE_STRIP = '\u2022\u2023\u2043\u204C\u204D\u2219\u25C9\u25D8\u25E6\u2619\u2765\u2767\u29BE\u29BF\n\t #*+-'
+
+@functools.lru_cache(maxsize=1024)
+def split_ingredient (s):
+    """Split ingredient line s into its parts.
+
+    We return a tuple (matched, fields, unit, item). fields is a
+    tuple of (key, value) pairs for 'optional', 'amount' and
+    'rangeamount'. If matched is False, s doesn't look like an
+    ingredient, and item is the whole line, stripped of bullets.
+
+    The same lines come up over and over again (1 tsp. salt), so we
+    cache our results.
+    """
+    fields = []
+    s = s.strip(INGREDIENT_LINE_STRIP)
+    option_m = re.match(r'\s*optional:?\s*',s,re.IGNORECASE)
+    if option_m:
+        s = s[option_m.end():]
+        fields.append(('optional',True))
+    m = ING_MATCHER.match(s)
+    if not m:
+        return False,tuple(fields),None,s
+    a,u,i = (m.group(ING_MATCHER_AMT_GROUP),
+             m.group(ING_MATCHER_UNIT_GROUP),
+             m.group(ING_MATCHER_ITEM_GROUP))
+    if a:
+        asplit = RANGE_MATCHER.split(a)
+        if len(asplit)==2:
+            fields.append(('amount',frac_to_float(asplit[0].strip())))
+            fields.append(('rangeamount',frac_to_float(asplit[1].strip())))
+        else:
+            fields.append(('amount',frac_to_float(a.strip())))
+    return True,tuple(fields),u,i
+
 def convert_fractions_to_ascii (s):
     """Convert all unicode-like fractions in string S with their ASCII equivalents"""
     for nums,uni in list(NUM_TO_FRACTIONS.items()):
@@ -918,7 +1018,7 @@ def float_to_frac (n, d=[2,3,4,5,6,8,10,16],approx=0.01,fractions=FRACTIONS_NORM
             for div in d:
                 f = fractify(rem,div,approx=approx,fractions=fractions)
                 if f==1:
-                    i = int(i) + 1
+                    i = int(n) + 1
                     return "%s.00" % i
                 if f:
                     return " ".join([i,f]).strip()
@@ -77,8 +77,11 @@ class exporter (SuspendableThread, Pluggable):
         self.write_head()
         for task in self.order:
             if task=='image':
-                if self._grab_attr_(self.r,'image'):
-                    self.write_image(self.r.image)
+                # Recipes from the index are fetched without their
+                # images, so ask the database for it.
+                image = self.rd.get_image(self.r)
+                if image:
+                    self.write_image(image)
             if task=='attr':
                 self._write_attrs_()
 
@@ -534,14 +537,17 @@ class ExporterMultirec (SuspendableThread, Pluggable):
             return ret
 
     def append_referenced_recipes (self):
-        for r in self.recipes[:]:
-            reffed = self.rd.db.execute(
-                'select * from ingredients where recipe_id=%s and refid is not null' % r.id
-                )
-            for ref in reffed:
-                rec = self.rd.get_rec(ref.refid)
-                if rec is not None and not rec in self.recipes:
-                    self.recipes.append(rec)
+        ids = set(r.id for r in self.recipes)
+        refids = []
+        for r in self.recipes:
+            for ing in self.rd.get_ings(r):
+                if ing.refid and ing.refid not in ids and ing.refid not in refids:
+                    refids.append(ing.refid)
+        if refids:
+            reffed = self.rd.fetch_all(self.rd.recipe_table,id=('in',refids),
+                                       columns=self.rd.get_recipe_columns())
+            self.prefetched_ids.extend(self.rd.prefetch(reffed))
+            self.recipes.extend(reffed)
 
     @pluggable_method
     def do_run (self):
@@ -564,26 +570,34 @@ class ExporterMultirec (SuspendableThread, Pluggable):
         self.suspended = False
         self.terminated = False
         first = True
-        self.append_referenced_recipes()
-        for r in self.recipes:
-            self.check_for_sleep()
-            msg = _("Exported %(number)s of %(total)s recipes")%{'number':self.rcount,'total':self.rlen}
-            self.emit('progress',float(self.rcount)/float(self.rlen), msg)
-            fn=None
-            if create_multi_file:
-                fn = self.generate_filename(r, self.ext, add_id=True)
-                self.ofi = open(fn, 'w', encoding=self.DEFAULT_ENCODING)
-            if self.padding and not first:
-                self.ofi.write(self.padding)
-            e=self.exporter(out=self.ofi, r=r, rd=self.rd, **self.exporter_kwargs)
-            self.connect_subthread(e)
-            e.do_run()
-            self.recipe_hook(r,fn,e)
-            if create_multi_file:
-                self.ofi.close()
-            self.rcount += 1
-            first = False
-        self.write_footer()
+        # Load ingredients and categories for everything we're about
+        # to export up front rather than querying once per recipe.
+        # We drop just what we loaded when we're done, however we
+        # finish.
+        self.prefetched_ids = self.rd.prefetch(self.recipes)
+        try:
+            self.append_referenced_recipes()
+            for r in self.recipes:
+                self.check_for_sleep()
+                msg = _("Exported %(number)s of %(total)s recipes")%{'number':self.rcount,'total':self.rlen}
+                self.emit('progress',float(self.rcount)/float(self.rlen), msg)
+                fn=None
+                if create_multi_file:
+                    fn = self.generate_filename(r, self.ext, add_id=True)
+                    self.ofi = open(fn, 'w', encoding=self.DEFAULT_ENCODING)
+                if self.padding and not first:
+                    self.ofi.write(self.padding)
+                e=self.exporter(out=self.ofi, r=r, rd=self.rd, **self.exporter_kwargs)
+                self.connect_subthread(e)
+                e.do_run()
+                self.recipe_hook(r,fn,e)
+                if create_multi_file:
+                    self.ofi.close()
+                self.rcount += 1
+                first = False
+            self.write_footer()
+        finally:
+            self.rd.clear_prefetched(self.prefetched_ids)
         if create_one_file:
             self.ofi.close()
         self.timer.end()
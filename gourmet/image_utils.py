@@ -1,8 +1,10 @@
-from collections import defaultdict
+from collections import OrderedDict
 from enum import Enum
 import io
+import os
 from pathlib import Path
-from typing import Dict, List, Optional
+import shutil
+from typing import Callable, List, Optional, Tuple, Union
 from urllib.parse import unquote, urlparse
 
 from gi.repository import GdkPixbuf, Gio, GLib, Gtk
@@ -11,6 +13,7 @@ from PIL import Image, UnidentifiedImageError
 import requests
 
 MAX_THUMBSIZE = 10000000  # The maximum size, in bytes, of thumbnails we allow
+LIST_THUMBSIZE = 40  # The size of the thumbnails kept in the recipe table
 
 
 class ThumbnailSize(Enum):
@@ -18,21 +21,37 @@ class ThumbnailSize(Enum):
     LARGE = (256, 256)
 
 
-def cached(func):
-    """A decorator to keep previously created thumbnails.
+class LRUDict(OrderedDict):
+    """A dictionary that forgets its least recently used items once it
+    holds more than maxsize of them."""
 
-    This may be memory intensive. If it impedes usability, due to increased
-    memory usage, it should be removed.
-    """
-    thumbnails: Dict[str, Dict[ThumbnailSize, Image.Image]] = defaultdict(dict)
+    def __init__(self, maxsize: int):
+        super().__init__()
+        self.maxsize = maxsize
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        self.move_to_end(key)
+        return value
+
+    def __setitem__(self, key, value):
+        super().__setitem__(key, value)
+        self.move_to_end(key)
+        while len(self) > self.maxsize:
+            self.popitem(last=False)
+
+
+def cached(func):
+    """A decorator to keep the most recently created thumbnails."""
+    thumbnails = LRUDict(100)
 
     def wrapper(path, size=ThumbnailSize.LARGE):
-        if path in thumbnails and size in thumbnails[path]:
-            return thumbnails[path][size]
+        if (path, size) in thumbnails:
+            return thumbnails[(path, size)]
 
         image = func(path, size)
 
-        thumbnails[path][size] = image
+        thumbnails[(path, size)] = image
         return image
 
     return wrapper
@@ -112,6 +131,143 @@ def image_to_pixbuf(image: Image.Image) -> Pixbuf:
                                           rowstride * image.size[0])
 
 
+class ThumbnailCache:
+    """Decoded, pre-scaled recipe thumbnails.
+
+    Thumbnails are keyed by recipe ID, image hash and size, where size is
+    the largest side in pixels or a ThumbnailSize. The most recently used
+    are kept in memory as pixbufs. Thumbnails larger than LIST_THUMBSIZE
+    (which the recipe table already holds) are also saved in directory, if
+    we have one, so that they survive restarts. Once those files take up
+    more than max_disk_size bytes, we delete the least recently used.
+    """
+
+    def __init__(self, directory: Optional[str] = None, maxsize: int = 1000,
+                 max_disk_size: int = 50 * 1024 * 1024):
+        self.directory = directory
+        self.pixbufs = LRUDict(maxsize)
+        self.max_disk_size = max_disk_size
+        self.disk_size: Optional[int] = None  # Counted on our first write
+
+    @staticmethod
+    def get_dimensions(size: Union[int, ThumbnailSize]) -> Tuple[int, int]:
+        if isinstance(size, ThumbnailSize):
+            return size.value
+        return (size, size)
+
+    def get_path(self, rec_id: int, image_hash: str,
+                 size: Union[int, ThumbnailSize]) -> Optional[str]:
+        width, height = self.get_dimensions(size)
+        if not self.directory or max(width, height) <= LIST_THUMBSIZE:
+            return None
+        return os.path.join(self.directory, str(rec_id),
+                            f'{image_hash}-{width}x{height}.jpg')
+
+    def __contains__(self, key) -> bool:
+        if key in self.pixbufs:
+            return True
+        path = self.get_path(*key)
+        return bool(path) and os.path.exists(path)
+
+    def get_bytes(self, rec_id: int, image_hash: str,
+                  size: Union[int, ThumbnailSize],
+                  get_image: Callable[[], Optional[bytes]]) -> Optional[bytes]:
+        """Return our thumbnail as JPEG data.
+
+        get_image is only called, to fetch the image to scale down, if we
+        do not have the thumbnail on disk yet.
+        """
+        path = self.get_path(rec_id, image_hash, size)
+        if path and os.path.exists(path):
+            with open(path, 'rb') as fi:
+                data = fi.read()
+            # Mark our thumbnail as used, whether or not the file system
+            # keeps access times itself.
+            os.utime(path)
+            return data
+        raw = get_image()
+        if not raw:
+            return None
+        try:
+            image = bytes_to_image(raw)
+            image.thumbnail(self.get_dimensions(size))
+            data = image_to_bytes(image)
+        except (UnidentifiedImageError, OSError):
+            return None
+        if path:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'wb') as fi:
+                fi.write(data)
+            os.replace(path + '.tmp', path)
+            self.add_to_disk_size(len(data))
+        return data
+
+    def get_files(self) -> List[Tuple[str, os.stat_result]]:
+        """Return the paths and stats of the thumbnails in directory."""
+        files = []
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                try:
+                    files.append((path, os.stat(path)))
+                except OSError:
+                    pass
+        return files
+
+    def add_to_disk_size(self, size: int):
+        """Count size bytes we've written to directory, and evict the
+        least recently used thumbnails if we're over max_disk_size."""
+        if self.disk_size is None:
+            self.disk_size = sum(st.st_size for path, st in self.get_files())
+        else:
+            self.disk_size += size
+        if self.disk_size > self.max_disk_size:
+            self.evict()
+
+    def evict(self):
+        """Delete the least recently used thumbnails in directory until
+        we're down to three quarters of max_disk_size, so that we don't
+        have to evict again on every write."""
+        files = sorted(self.get_files(), key=lambda f: f[1].st_atime)
+        self.disk_size = sum(st.st_size for path, st in files)
+        target = self.max_disk_size * 3 // 4
+        for path, st in files:
+            if self.disk_size <= target:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            self.disk_size -= st.st_size
+            try:
+                # Drop the recipe's directory if that was its last one.
+                os.rmdir(os.path.dirname(path))
+            except OSError:
+                pass
+
+    def get_pixbuf(self, rec_id: int, image_hash: str,
+                   size: Union[int, ThumbnailSize],
+                   get_image: Callable[[], Optional[bytes]]) -> Optional[Pixbuf]:
+        key = (rec_id, image_hash, size)
+        if key in self.pixbufs:
+            return self.pixbufs[key]
+        data = self.get_bytes(rec_id, image_hash, size, get_image)
+        if data is None:
+            return None
+        pixbuf = bytes_to_pixbuf(data)
+        self.pixbufs[key] = pixbuf
+        return pixbuf
+
+    def forget(self, rec_id: int):
+        """Drop all thumbnails of the recipe with ID rec_id."""
+        for key in [k for k in self.pixbufs if k[0] == rec_id]:
+            del self.pixbufs[key]
+        if self.directory:
+            shutil.rmtree(os.path.join(self.directory, str(rec_id)),
+                          ignore_errors=True)
+            self.disk_size = None
+
+
 class ImageBrowser(Gtk.Dialog):
     def __init__(self, parent: Gtk.Window, uris: List[str]):
         Gtk.Dialog.__init__(self, title="Choose an image",
@@ -408,8 +408,8 @@ def import_url (url, rd, progress=None, add_webpage_source=True, threaded=False,
                                threaded=threaded,
                                interactive=interactive)
     elif header=='application/zip':
-        import zip_importer
-        return zip_importer.zipfile_to_filelist(sock,progress,os.path.splitext(url.split('/')[-1])[0])
+        from gourmet.plugins.import_export.archive_plugin.archive_importer import ArchiveImporter
+        return ArchiveImporter(sock,os.path.splitext(url.split('/')[-1])[0])
     else:
         fn = os.path.join(tempfile.tempdir,url.split('/')[-1])
         while os.path.exists(fn):
@@ -555,9 +555,8 @@ class WebPageImporter (importer.Importer):
 
             # Ingredients in blocks
             if k == 'ingredient_block':
-                for l in v.split('\n'):
+                for dic in self.rd.parse_ingredients(v.split('\n')):
                     if self.prog: self.prog(-1,_('Processing ingredients.'))
-                    dic=self.rd.parse_ingredient(l,conv=self.conv)
                     if dic:
                         self.start_ing(**dic)
                         self.commit_ing()
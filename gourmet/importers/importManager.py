@@ -1,15 +1,26 @@
 from typing import Any, List, Optional, Tuple
 
+import concurrent.futures
 from fnmatch import fnmatch
 from gettext import gettext as _
 from gi.repository import Gtk
+import importlib
+import multiprocessing
+import os
 import tempfile
+import traceback
 from urllib.parse import urlparse
 
-import gourmet.plugin_loader as plugin_loader
+import gourmet.gglobals as gglobals
+from gourmet import check_encodings
+# gourmet.plugin has to come before gourmet.plugin_loader, which it
+# needs fully loaded: our worker processes import us first thing.
 from gourmet.plugin import ImporterPlugin, ImportManagerPlugin
+import gourmet.plugin_loader as plugin_loader
 import gourmet.gtk_extras.dialog_extras as de
+from gourmet.recipeManager import get_recipe_manager
 from gourmet.threadManager import get_thread_manager, get_thread_manager_gui, NotThreadSafe
+from . import importer
 from .webextras import URLReader
 
 
@@ -134,31 +145,21 @@ class ImportManager (plugin_loader.Pluggable):
         registered plugins.
 
         Return a list of importers (mostly useful for testing purposes)
+
+        If we have several files to import and more than one CPU, we
+        parse them in worker processes (see ParallelImporter), unless
+        the parallel_import preference is turned off.
         """
-        importers = []
-        while filenames:
-            fn = filenames.pop()
-            fallback = None
-            found_plugin = False
-            for plugin in self.importer_plugins:
-                for pattern in plugin.patterns:
-                    if fnmatch(fn.upper(),pattern.upper()):
-                        result = plugin.test_file(fn)
-                        if result==-1: # FALLBACK
-                            fallback = plugin
-                        elif result:
-                            importers.append((fn,plugin))
-                            found_plugin = True
-                        else:
-                            print('File ',fn,'appeared to match ',plugin,'but failed test.')
-                        break
-                if found_plugin: break
-            if not found_plugin:
-                if fallback:
-                    importers.append((fn,fallback))
-                else:
-                    print('Warning, no plugin found for file ',fn)
+        importers = self.find_plugins(filenames)
         ret_importers = [] # a list of importer instances to return
+        parallel = [(fn,p) for fn,p in importers if p.parse_in_worker]
+        if (len(parallel) > 1 and (os.cpu_count() or 1) > 1
+            and self.prefs.get('parallel_import',True)):
+            importers = [(fn,p) for fn,p in importers if not p.parse_in_worker]
+            parallel_importer = ParallelImporter(parallel,self.importer_plugins)
+            self.setup_notification_message(parallel_importer)
+            self.setup_thread(parallel_importer,_('Import'))
+            ret_importers.append(parallel_importer)
         for fn,importer_plugin in importers:
             print('Doing import for ',fn,importer_plugin)
             ret_importers.append(
@@ -167,8 +168,53 @@ class ImportManager (plugin_loader.Pluggable):
         print('import_filenames returns',ret_importers)
         return ret_importers
 
+    def find_plugins (self, filenames: List[str]) -> List[Tuple[str, Any]]:
+        """Return a list of (filename, importer plugin) tuples for
+        the files in filenames we have a plugin for."""
+        importers = []
+        while filenames:
+            fn = filenames.pop()
+            plugin = self.find_plugin(fn)
+            if plugin:
+                importers.append((fn,plugin))
+            else:
+                print('Warning, no plugin found for file ',fn)
+        return importers
+
+    def find_plugin (self, fn: str, head: Optional[bytes] = None):
+        """Return the importer plugin for file fn, or None.
+
+        If head is given, fn is only a name: head is the start of the
+        file, which we test plugins on with test_stream rather than
+        test_file (see ArchiveImporter).
+        """
+        fallback = None
+        for plugin in self.importer_plugins:
+            for pattern in plugin.patterns:
+                if fnmatch(fn.upper(),pattern.upper()):
+                    if head is None:
+                        result = plugin.test_file(fn)
+                    else:
+                        result = plugin.test_stream(fn,head)
+                    if result==-1: # FALLBACK
+                        fallback = plugin
+                    elif result:
+                        return plugin
+                    else:
+                        print('File ',fn,'appeared to match ',plugin,'but failed test.')
+                    break
+        return fallback
+
     def do_import(self, importer_plugin: Any,
-                  method: str, *method_args: Tuple[str]):
+                  method: str, *method_args: Tuple[str],
+                  is_tempfile: bool = False):
+        """Import with the importer importer_plugin.method(*method_args)
+        returns.
+
+        If is_tempfile is True, the file we're importing
+        (method_args[0]) is a temporary copy, which the importer
+        removes once it's done with it.
+        """
         try:
             importer = getattr(importer_plugin, method)(*method_args)
             self.setup_notification_message(importer)
@@ -176,6 +222,8 @@ class ImportManager (plugin_loader.Pluggable):
             # recurse with new filelist...
             return self.import_filenames(ifl.filelist)
         else:
+            if is_tempfile:
+                importer.tempfiles.append(method_args[0])
             if hasattr(importer, 'pre_run'):
                 importer.pre_run()
             if isinstance(importer, NotThreadSafe):
@@ -305,8 +353,241 @@ class ImportManager (plugin_loader.Pluggable):
             self.plugins.remove(plugin)
 
 def get_import_manager ():
+    if worker_import_manager is not None:
+        return worker_import_manager
     return ImportManager.instance()
 
+class WorkerImportManager:
+
+    """Stands in for our ImportManager in worker processes, which
+    have no GUI to make one with.
+
+    It knows the importer plugins our parent hands us (see
+    init_worker), which is all archive importers need to find the
+    importers for their files.
+    """
+
+    def __init__ (self):
+        self.extensions_by_mimetype = {}
+        self.plugins_by_name = {}
+        self.plugins = []
+        self.importer_plugins = []
+
+    register_plugin = ImportManager.register_plugin
+    learn_mimetype_extension_mappings = ImportManager.learn_mimetype_extension_mappings
+    find_plugin = ImportManager.find_plugin
+
+class ParentPlugin:
+
+    """Stands in, in a worker process, for one of our parent's
+    importer plugins that can't parse files in a worker.
+
+    Archive importers hand the files we match back to our parent,
+    which picks the plugin to import them with itself.
+    """
+
+    parse_in_worker = False
+
+    def __init__ (self, name, patterns):
+        self.name = name
+        self.patterns = patterns
+
+    def test_file (self, filename):
+        # We can't really tell, so we're a fallback option.
+        return -1
+
+    def test_stream (self, name, head):
+        return -1
+
+# Our import manager, if we're a worker process (see init_worker).
+worker_import_manager = None
+# The importer plugins our worker processes have loaded, by module and
+# class name (see get_worker_plugin).
+worker_plugins = {}
+
+def get_worker_context ():
+    """Return the multiprocessing context to start our workers with.
+
+    Our workers are never forked from us directly: a fork would copy
+    our threads' locks and database connections in whatever state
+    they're in. Where we can, we fork them from a forkserver that has
+    already imported us, which saves each worker the imports a spawned
+    process would have to do.
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        context = multiprocessing.get_context('forkserver')
+        context.set_forkserver_preload([__name__])
+        return context
+    return multiprocessing.get_context('spawn')
+
+def init_worker (gourmetdir, plugin_classes, parent_plugins):
+    """Set up a worker process to import into the database in
+    gourmetdir with the importer plugin classes plugin_classes (see
+    get_worker_plugin). parent_plugins is a list of the (name,
+    patterns) of the plugins only our parent can use (see
+    ParentPlugin)."""
+    global worker_import_manager
+    # We're a fresh process, so we have to find the database our
+    # parent is importing into.
+    gglobals.gourmetdir = gourmetdir
+    # We can't show dialogs, so files we'd have to ask about go back
+    # to our parent (see parse_file).
+    check_encodings.ask_user = False
+    worker_import_manager = WorkerImportManager()
+    for plugin_class in plugin_classes:
+        get_worker_plugin(plugin_class)
+    for name,patterns in parent_plugins:
+        worker_import_manager.importer_plugins.append(ParentPlugin(name,patterns))
+
+def get_worker_plugin (plugin_class):
+    """Return an instance of the importer plugin class plugin_class,
+    a (module name, class name) tuple. We run in a worker process.
+
+    We're handed names rather than the plugins themselves, which we'd
+    have to pickle. Our parent's sys.path comes with us, so we can
+    import plugins from the same places it did.
+    """
+    if plugin_class not in worker_plugins:
+        module,name = plugin_class
+        plugin = getattr(importlib.import_module(module),name)()
+        plugin.activate(get_import_manager())
+        worker_plugins[plugin_class] = plugin
+    return worker_plugins[plugin_class]
+
+def get_plugin_class (plugin):
+    """Return the name get_worker_plugin knows plugin's class by."""
+    return type(plugin).__module__,type(plugin).__name__
+
+def parse_file (fn, plugin_class):
+    """Parse file fn with the importer plugin class plugin_class (see
+    get_worker_plugin), without writing anything to the database. We
+    run in a worker process.
+
+    Return a tuple (recs, filelist, tempfiles): recs is a list of
+    recipes as collected by Importer.collect_recs; filelist is a list
+    of files we still have to import, or None; tempfiles is a list of
+    temporary copies of files only our parent can import, which it
+    should remove once it has. (Archives can contain files we can't
+    parse here; see Importer.serial_files.) If we can't parse fn here
+    at all -- its importer isn't thread safe, or we'd have to ask the
+    user about its encoding -- recs is None and our parent has to
+    import fn itself.
+    """
+    plugin = get_worker_plugin(plugin_class)
+    try:
+        file_importer = plugin.get_importer(fn)
+    except ImportFileList as ifl:
+        return [],ifl.filelist,[]
+    if isinstance(file_importer,NotThreadSafe):
+        return None,None,[]
+    recs = file_importer.collect_recs()
+    try:
+        if hasattr(file_importer,'pre_run'):
+            file_importer.pre_run()
+        file_importer.do_run()
+    except check_encodings.EncodingUnknown:
+        file_importer.remove_tempfiles()
+        for sfn in file_importer.serial_tempfiles:
+            os.remove(sfn)
+        return None,None,[]
+    file_importer.remove_tempfiles()
+    tempfiles = file_importer.serial_tempfiles
+    filelist = [sfn for sfn,p in file_importer.serial_files
+                if sfn not in tempfiles]
+    return recs,filelist or None,tempfiles
+
+class ParallelImporter (importer.Importer):
+
+    """Import a list of files, parsing them in a pool of worker
+    processes.
+
+    Our workers hand us the recipes they parse as plain dictionaries,
+    which we write to the database from our own thread in batches
+    (see Importer.bulk_commit).
+    """
+
+    bulk_commit = True
+
+    def __init__ (self, files, plugins=(), processes=None):
+        """files is a list of (filename, importer plugin) tuples.
+
+        plugins is a list of any other importer plugins we might
+        need for files we find in archives.
+
+        processes is the number of worker processes to run (by
+        default, one per CPU).
+        """
+        self.files = files
+        self.plugins = list(plugins) + [p for fn,p in files]
+        self.processes = processes
+        importer.Importer.__init__(self,name='Parallel Importer')
+
+    def do_run (self):
+        plugins = dict((p.name,p) for p in self.plugins if p.parse_in_worker)
+        pool = concurrent.futures.ProcessPoolExecutor(
+            self.processes,
+            mp_context=get_worker_context(),
+            initializer=init_worker,
+            # Archives can hold files of any type, so our workers
+            # need to know about all our plugins.
+            initargs=(gglobals.gourmetdir,
+                      [get_plugin_class(p) for p in plugins.values()],
+                      [(p.name,p.patterns) for p in self.plugins
+                       if p.name not in plugins])
+            )
+        pending = {}
+        def submit (files):
+            for fn,plugin in files:
+                if plugins.get(plugin.name) is plugin:
+                    pending[pool.submit(parse_file,fn,get_plugin_class(plugin))] = fn,plugin
+                else:
+                    self.serial_files.append((fn,plugin))
+        try:
+            submit(self.files)
+            done = 0
+            while pending:
+                finished,unfinished = concurrent.futures.wait(
+                    pending,timeout=0.5,
+                    return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                self.check_for_sleep()
+                for future in finished:
+                    fn,plugin = pending.pop(future)
+                    done += 1
+                    try:
+                        recs,filelist,tempfiles = future.result()
+                    except Exception:
+                        print('Unable to import',fn)
+                        traceback.print_exc()
+                        continue
+                    if recs is None:
+                        self.serial_files.append((fn,plugin))
+                        continue
+                    if filelist:
+                        submit(get_import_manager().find_plugins(filelist))
+                    if tempfiles:
+                        for tfn,tplugin in get_import_manager().find_plugins(list(tempfiles)):
+                            self.serial_files.append((tfn,tplugin))
+                            self.serial_tempfiles.append(tfn)
+                        for tfn in tempfiles:
+                            if tfn not in self.serial_tempfiles:
+                                os.remove(tfn)
+                    self.add_collected_recs(recs)
+                    total = done + len(pending)
+                    self.emit('progress',float(done)/total,
+                              _('Imported %s of %s files.')%(done,total))
+        finally:
+            # If we've been stopped, our workers finish the files
+            # they're on, but don't start any others.
+            pool.shutdown(wait=False,cancel_futures=True)
+        importer.Importer.do_run(self)
+        importer.Importer._run_cleanup_(self)
+
+    def post_run (self):
+        for fn,plugin in self.serial_files:
+            get_import_manager().do_import(plugin,'get_importer',fn,
+                                           is_tempfile=fn in self.serial_tempfiles)
+
 if __name__ == '__main__':
     im = ImportManager.instance()
     im.offer_import()
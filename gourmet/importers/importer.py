@@ -1,3 +1,5 @@
+from collections import Counter, deque
+import io
 import re
 import time
 import os
@@ -6,7 +8,7 @@ import gettext
 from gettext import gettext as _
 import xml.sax.saxutils
 
-from gourmet import convert, image_utils
+from gourmet import convert, image_utils, recipeIdentifier
 from gourmet.gdebug import debug, TimeAction, print_timer_info
 import gourmet.gglobals
 import gourmet.gtk_extras.dialog_extras as de
@@ -41,6 +43,12 @@ class Importer (SuspendableThread):
     self.rec and then commits that dictionary with commit_rec(). Similarly, ingredients are built
     as self.ing and then committed with commit_ing()."""
 
+    # Importers for large files can turn on bulk_commit to buffer
+    # recipes in memory and write them bulk_batch_size at a time with
+    # executemany, committing each batch as it's written.
+    bulk_commit = False
+    bulk_batch_size = 500
+
     def __init__ (self,
                   rd = None, # OBSOLETE
                   total=0,
@@ -72,6 +80,33 @@ class Importer (SuspendableThread):
         self.rd_orig_ing_hooks = self.rd.add_ing_hooks
         self.added_recs=[]
         self.added_ings=[]
+        self.bulk_next_id = None
+        self.bulk_last_id = None
+        self.bulk_reserved_ids = set()
+        self.bulk_recs = []
+        self.bulk_cats = []
+        self.bulk_ings = []
+        self.bulk_ids = []
+        # If collected_recs is a list, commit_rec adds recipes to it
+        # instead of writing them (see collect_recs).
+        self.collected_recs = None
+        # Files we find we have to import with another importer, one
+        # at a time in the main thread (say, files in an archive that
+        # need an interactive importer). A list of (filename, importer
+        # plugin) tuples, which our post_run should import. Those of
+        # the files that are temporary copies (out of an archive, say)
+        # are listed in serial_tempfiles too; their importers remove
+        # them when they're done (see ImportManager.do_import).
+        self.serial_files = []
+        self.serial_tempfiles = []
+        # Temporary files we're importing from, which we remove when
+        # we're done (see remove_tempfiles).
+        self.tempfiles = []
+        # Work we put off until our recipes are in the database (see
+        # run_post_import): the (item, key) pairs to add to the
+        # keydic, and the ingredients to hand to add_ing_hooks.
+        self.pending_keydic = Counter()
+        self.pending_hook_ings = deque()
         #self.rd_orig_hooks = self.rd.add_hooks
         self.rd.add_ing_hooks = []
         #self.rd.add_hooks = []
@@ -97,11 +132,20 @@ class Importer (SuspendableThread):
                                    name=name)
     # end __init__
 
+    def run (self):
+        try:
+            SuspendableThread.run(self)
+        finally:
+            # Keep whatever we imported before being stopped, just as
+            # we would have without bulk_commit, and finish the work
+            # we put off for it.
+            self.finish_bulk_commit()
+            self.run_post_import()
+            self.remove_tempfiles()
+
     def do_run (self):
-        debug('Running ing hooks',0)
-        for i in self.added_ings:
-            for h in self.rd_orig_ing_hooks:
-                h(i)
+        self.finish_bulk_commit()
+        self.run_post_import()
         #debug('Running rec hooks',0)
         #for r in self._added_recs:
         #    for h in self.rd_orig_hooks:
@@ -110,6 +154,15 @@ class Importer (SuspendableThread):
         #self.rd.add_hooks = self.rd_orig_hooks
         #print_timer_info()
 
+    def remove_tempfiles (self):
+        """Remove the temporary files we've been importing from."""
+        for fn in self.tempfiles:
+            try:
+                os.remove(fn)
+            except OSError:
+                pass
+        self.tempfiles = []
+
     def _run_cleanup_ (self):
         if self.do_conversion:
             # if we have something to convert
@@ -234,44 +287,239 @@ class Importer (SuspendableThread):
                     print('Deleting "image"')
                     del self.rec['image']
                     del self.rec['thumb']
+        if self.collected_recs is not None:
+            self.collected_recs.append((self.rec,self.added_ings,remembered_rating))
+            self.added_ings = []
+        else:
+            rid = self.add_rec_and_ings()
+            if remembered_rating: self.rating_converter.add(rid,remembered_rating)
+        tt.end()
+        self.check_for_sleep()
+        timeaction.end()
+        self.rec_timer.end()
+        self.count += 1
+        if self.total:
+            self.emit(
+                'progress',
+                float(self.count)/self.total,
+                _("Imported %s of %s recipes.")%(self.count,self.total)
+                )
+
+    def add_rec_and_ings (self):
+        """Write self.rec and self.added_ings to the database and
+        return the ID of our new recipe."""
         ## if we have an ID, we need to remember it for the converter
         if 'id' in self.rec:
             id_to_convert = self.rec['id']
         else:
             id_to_convert = None
-        if id_to_convert:
-            if self.rec['id'] in self.id_converter:
-                self.rec['id']=self.id_converter[self.rec['id']]
-                r = self.rd.add_rec(self.rec,accept_ids=True) # See doc on add_rec
+        if self.bulk_commit and self.begin_bulk_commit():
+            rid = self.buffer_rec(id_to_convert)
+        else:
+            # We hash our recipe from our dictionaries, rather than
+            # reading it back out of the database once it's added.
+            for i in self.added_ings: self.rd.validate_ingdic(i)
+            self.rec['recipe_hash'],self.rec['ingredient_hash'] = \
+                recipeIdentifier.hash_recipe_dicts(self.rec,self.added_ings,self.conv)
+            if id_to_convert:
+                if self.rec['id'] in self.id_converter:
+                    self.rec['id']=self.id_converter[self.rec['id']]
+                    r = self.rd.add_rec(self.rec,accept_ids=True) # See doc on add_rec
+                else:
+                    del self.rec['id']
+                    r =  self.rd.add_rec(self.rec)
+                    self.id_converter[id_to_convert] = r.id
             else:
-                del self.rec['id']
-                r =  self.rd.add_rec(self.rec)
-                self.id_converter[id_to_convert] = r.id
+                r = self.rd.add_rec(self.rec)
+            # Add ingredients...
+            for i in self.added_ings:
+                if 'id' in i:
+                    print('WARNING: Ingredient has ID set -- ignoring value')
+                    del i['id']
+                i['recipe_id'] = r.id
+            self.rd.add_ings(self.added_ings)
+            self.defer_post_import(self.added_ings)
+            self.added_ings = []
+            self.added_recs.append(r)
+            rid = r.id
+        return rid
+
+    def collect_recs (self):
+        """Have commit_rec collect recipes instead of writing them to
+        the database, and return the list it collects them in.
+
+        Each recipe is a tuple (recipe, ingredients, rating) of the
+        dictionaries commit_rec would have written, plus a rating we
+        couldn't convert (or None). Recipe and reference IDs are
+        left as the file gave them to us; see add_collected_recs.
+        """
+        self.collected_recs = []
+        return self.collected_recs
+
+    def add_collected_recs (self, recs):
+        """Write recipes collected by another importer's collect_recs
+        to the database."""
+        # The IDs recipes use to refer to each other only mean
+        # something within the file they came from.
+        self.id_converter = {}
+        for rec,ings,rating in recs:
+            self.check_for_sleep()
+            self.rec = rec
+            for i in ings:
+                if i.get('refid') is not None:
+                    i['refid'] = self.get_ref_id(i['refid'])
+            self.added_ings = ings
+            rid = self.add_rec_and_ings()
+            if rating: self.rating_converter.add(rid,rating)
+
+    # Bulk commits
+
+    def begin_bulk_commit (self):
+        """Reserve IDs for our bulk commit if we haven't yet.
+
+        Return False if our database can't do bulk commits, in which
+        case we go back to adding recipes one at a time.
+        """
+        if self.bulk_next_id is None:
+            if not self.reserve_bulk_ids():
+                self.bulk_commit = False
+                return False
+        return True
+
+    def reserve_bulk_ids (self):
+        """Reserve the IDs of our next bulk_batch_size recipes.
+
+        Return False if our database can't do bulk commits.
+        """
+        self.bulk_next_id = self.rd.reserve_ids(self.bulk_batch_size)
+        if self.bulk_next_id is None:
+            return False
+        self.bulk_last_id = self.bulk_next_id + self.bulk_batch_size - 1
+        return True
+
+    def new_bulk_id (self):
+        # We hand out the IDs we've reserved ourselves, so that our
+        # recipes and the ingredients referring to them can be
+        # written in batches.
+        if self.bulk_next_id > self.bulk_last_id:
+            self.reserve_bulk_ids()
+        rid = self.bulk_next_id
+        self.bulk_next_id += 1
+        return rid
+
+    def buffer_rec (self, id_to_convert):
+        """Buffer self.rec and self.added_ings for the next flush.
+
+        Return the ID our recipe will have.
+        """
+        rid = self.id_converter.get(id_to_convert)
+        if rid in self.bulk_reserved_ids:
+            self.bulk_reserved_ids.remove(rid)
         else:
-            r = self.rd.add_rec(self.rec)
-        # Add ingredients...
+            rid = self.new_bulk_id()
+            if id_to_convert and id_to_convert not in self.id_converter:
+                self.id_converter[id_to_convert] = rid
+        self.rec['id'] = rid
+        for c in self.rd.prepare_recdic(self.rec):
+            if c: self.bulk_cats.append({'recipe_id':rid,'category':c})
         for i in self.added_ings:
             if 'id' in i:
                 print('WARNING: Ingredient has ID set -- ignoring value')
                 del i['id']
-            i['recipe_id'] = r.id
-        self.rd.add_ings(self.added_ings)
+            i['recipe_id'] = rid
+            self.rd.validate_ingdic(i)
+        self.rec['recipe_hash'],self.rec['ingredient_hash'] = \
+            recipeIdentifier.hash_recipe_dicts(self.rec,self.added_ings,self.conv)
+        self.bulk_recs.append(self.rec)
+        self.bulk_ings.extend(self.added_ings)
+        self.defer_post_import(self.added_ings)
         self.added_ings = []
-        # Update hash-keys...
-        self.rd.update_hashes(r)
+        if len(self.bulk_recs) >= self.bulk_batch_size:
+            self.flush_bulk_commit()
+        return rid
+
+    def flush_bulk_commit (self):
+        """Write our buffered recipes to the database and commit them."""
+        tt = TimeAction('importer.flush_bulk_commit',5)
+        self.rd.begin_fast_adds()
+        # Categories and ingredients go in before their recipes so
+        # that the search index is built once per recipe. Recipes
+        # replace the placeholder reserve_ids leaves for our last ID.
+        self.rd.do_add_many_fast(self.rd.categories_table,self.bulk_cats)
+        self.rd.do_add_many_fast(self.rd.ingredients_table,self.bulk_ings)
+        self.rd.do_add_many_fast(self.rd.recipe_table,self.bulk_recs,replace=True)
+        self.rd.commit_fast_adds()
+        self.bulk_ids.extend([r['id'] for r in self.bulk_recs])
+        self.bulk_recs = []
+        self.bulk_cats = []
+        self.bulk_ings = []
         tt.end()
-        self.added_recs.append(r)
-        if remembered_rating: self.rating_converter.add(r.id,remembered_rating)
-        self.check_for_sleep()
-        timeaction.end()
-        self.rec_timer.end()
-        self.count += 1
-        if self.total:
-            self.emit(
-                'progress',
-                float(self.count)/self.total,
-                _("Imported %s of %s recipes.")%(self.count,self.total)
-                )
+
+    def finish_bulk_commit (self):
+        """Flush and commit everything we have buffered, and add the
+        new recipes to added_recs.
+        """
+        if self.bulk_next_id is None:
+            return
+        if self.bulk_reserved_ids:
+            # Recipes that were referenced but never imported get the
+            # same placeholder new_id() would have given them.
+            reserved = sorted(self.bulk_reserved_ids)
+            self.rd.begin_fast_adds()
+            self.rd.do_add_many_fast(self.rd.recipe_table,
+                                     [{'id':rid,'deleted':True} for rid in reserved],
+                                     replace=True)
+            self.rd.new_ids.extend(reserved)
+            self.bulk_reserved_ids = set()
+        self.flush_bulk_commit()
+        if self.bulk_next_id <= self.bulk_last_id:
+            # We didn't use our last reserved ID, so its placeholder
+            # is still there.
+            self.rd.delete_by_criteria(self.rd.recipe_table,{'id':self.bulk_last_id})
+        self.bulk_next_id = None
+        self.bulk_last_id = None
+        ids,self.bulk_ids = self.bulk_ids,[]
+        recs = {}
+        for n in range(0,len(ids),self.bulk_batch_size):
+            for r in self.rd.fetch_all(self.rd.recipe_table,
+                                       id=('in',ids[n:n+self.bulk_batch_size])):
+                recs[r.id] = r
+        self.added_recs.extend([recs[rid] for rid in ids])
+
+    # Post-import work
+
+    def defer_post_import (self, ings):
+        """Remember the work we have to do for ingredient dictionaries
+        ings, which we've added (or are about to add) to the database,
+        until run_post_import."""
+        for i in ings:
+            if i.get('item') and i.get('ingkey') and not i.get('deleted'):
+                self.pending_keydic[(i['item'],i['ingkey'])] += 1
+        if self.rd_orig_ing_hooks:
+            self.pending_hook_ings.extend(ings)
+
+    def run_post_import (self):
+        """Do the work we've put off while importing, all at once:
+        add our ingredients to the keydic, and run the add_ing_hooks
+        our database had when we started.
+
+        We're called once our recipes are committed (including when
+        an import is stopped part way through). Whatever we finish is
+        forgotten, so if we're interrupted, calling us again picks up
+        where we left off.
+        """
+        if self.pending_keydic:
+            tt = TimeAction('importer.run_post_import - keydic',5)
+            self.rd.add_ings_to_keydic(self.pending_keydic)
+            self.pending_keydic = Counter()
+            tt.end()
+        if self.pending_hook_ings:
+            debug('Running ing hooks',0)
+            while self.pending_hook_ings:
+                i = self.pending_hook_ings[0]
+                for h in self.rd_orig_ing_hooks:
+                    h(i)
+                self.pending_hook_ings.popleft()
 
     def parse_yields (self, str):
         '''Parse number and field.'''
@@ -380,11 +628,24 @@ class Importer (SuspendableThread):
         self.ing['amount'],self.ing['rangeamount']=parse_range(amount)
         timeaction.end()
 
+    def get_ref_id (self, id):
+        """Return the database ID of the recipe our file calls id,
+        reserving one if we haven't seen the recipe yet."""
+        if id not in self.id_converter:
+            if self.bulk_commit and self.begin_bulk_commit():
+                self.id_converter[id]=self.new_bulk_id()
+                self.bulk_reserved_ids.add(self.id_converter[id])
+            else:
+                self.id_converter[id]=self.rd.new_id()
+        return self.id_converter[id]
+
     def add_ref (self, id):
         timeaction = TimeAction('importer.add_ref',10)
-        if id not in self.id_converter:
-            self.id_converter[id]=self.rd.new_id()
-        self.ing['refid']=self.id_converter[id]
+        if self.collected_recs is not None:
+            # Whoever writes our recipes converts our IDs.
+            self.ing['refid']=id
+        else:
+            self.ing['refid']=self.get_ref_id(id)
         self.ing['unit']='recipe'
         timeaction.end()
 
@@ -478,6 +739,11 @@ class Tester:
             else:
                 ofi.seek(0)
 
+    def test_head (self, head):
+        """Test the first bytes of a file, head, as we would the file.
+        """
+        return self.test(io.StringIO(head.decode('latin1')))
+
 class RatingConverter:
 
     """A class to handle converting ratings from strings to integers.
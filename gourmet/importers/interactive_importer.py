@@ -85,9 +85,10 @@ class ConvenientImporter (importer.Importer):
 
         By default, there is one ingredient per line of text."""
         txt=txt.strip()
-        for i in txt.split(break_at):
-            if (i.strip()):
-                self.add_ing_from_text(i.strip())
+        lines = [i.strip() for i in txt.split(break_at) if i.strip()]
+        for parsed_dict in get_recipe_manager().parse_ingredients(lines):
+            self.ing = parsed_dict
+            self.commit_ing()
 
 class InteractiveImporter (ConvenientImporter, NotThreadSafe):
 
@@ -13,6 +13,11 @@ class TextImporter (importer.Importer):
                  }
 
     end_of_paragraph_length = 60
+    # If stream_lines is True, we read our file a line at a time as we
+    # import it (see check_encodings.StreamFile), rather than reading
+    # it all in first. Subclasses whose handle_line only ever looks at
+    # the line it's handed can set this.
+    stream_lines = False
 
     def __init__ (self, filename, conv=None):
         self.fn = filename
@@ -22,6 +27,10 @@ class TextImporter (importer.Importer):
         importer.Importer.__init__(self,conv=conv)
 
     def pre_run (self):
+        if self.stream_lines:
+            self.lines = check_encodings.StreamFile(self.fn)
+            self.total_lines = None
+            return
         self.lines = check_encodings.get_file(self.fn)
         self.total_lines = len(self.lines)
         print('we have ',self.total_lines,'lines in file',self.fn)
@@ -29,10 +38,12 @@ class TextImporter (importer.Importer):
     def do_run (self):
         if not hasattr(self,'lines'):
             raise Exception("pre_run has not been run!")
-        for n in range(self.total_lines):
-            l=self.lines[n]
+        for n,l in enumerate(self.lines):
             if n % 15 == 0:
-                prog = float(n)/float(self.total_lines)
+                if self.total_lines:
+                    prog = float(n)/float(self.total_lines)
+                else:
+                    prog = self.lines.get_progress()
                 msg = _("Imported %s recipes.")%(len(self.added_recs))
                 self.emit('progress',prog,msg)
             self.handle_line(l)
@@ -18,13 +18,15 @@ class rezconf_constants (mealmaster_importer.mmf_constants):
             self.unit_convr[v]=k
 
 rzc = rezconf_constants()
-rzc_start_pattern=r"^(?i)([m=-][m=-][m=-][m=-][m=-]+)-*\s*(rezkonv).*"
+rzc_start_pattern=r"(?i)^([m=-][m=-][m=-][m=-][m=-]+)-*\s*(rezkonv).*"
 
 class rezkonv_importer (mealmaster_importer.mmf_importer):
     # with long German words, you can end up with short lines in the middle
     # of a block of text, so we'll shorten the length at which we assume
     # a short line means the end of a paragraph.
     end_paragraph_length = 45
+    marker_chars = '=mM-'
+    variation_chars = 'VvHhNnTt'
 
     def compile_regexps (self):
         """Compile our regular expressions for the rezkonv format.
@@ -55,6 +57,7 @@ class rezkonv_importer (mealmaster_importer.mmf_importer):
             attrmatch += "%s|"%re.escape(k)
         attrmatch=r"%s):\s*(.*)\s*$"%attrmatch[0:-1]
         self.attr_matcher = re.compile(attrmatch)
+        self.compile_dispatch()
         testtimer.end()
 
     def is_ingredient (self, l):
@@ -1,15 +1,25 @@
-import xml.sax, xml.sax.saxutils, re, sys
+import xml.sax, xml.sax.saxutils, re, sys, os, io
+from gettext import gettext as _
 from . import importer
 from gourmet.gdebug import TimeAction
 from gourmet.recipeManager import get_recipe_manager # for getting out database...
 from gourmet.threadManager import SuspendableThread
 
+# How much of a file we hand our parser at a time.
+PARSE_CHUNK_SIZE = 64 * 1024
+
 def unquoteattr (str):
     return xml.sax.saxutils.unescape(str).replace("_"," ")
 
 class RecHandler (xml.sax.ContentHandler, importer.Importer):
+    bulk_commit = True
+
     def __init__ (self, total=None, conv=None, parent_thread=None):
-        self.elbuf = ""
+        # We collect the text of an element a piece at a time in
+        # elbuf_parts -- adding to a string over and over takes
+        # forever for big elements such as images. Subclasses read
+        # and reset the text as elbuf.
+        self.elbuf_parts = []
         xml.sax.ContentHandler.__init__(self)
         importer.Importer.__init__(self,total=total,
                                    do_markup=False, conv=conv)
@@ -21,7 +31,17 @@ class RecHandler (xml.sax.ContentHandler, importer.Importer):
         self.emit = parent_thread.emit
 
     def characters (self, ch):
-        self.elbuf += ch
+        self.elbuf_parts.append(ch)
+
+    @property
+    def elbuf (self):
+        if len(self.elbuf_parts) > 1:
+            self.elbuf_parts = [''.join(self.elbuf_parts)]
+        return self.elbuf_parts and self.elbuf_parts[0] or ''
+
+    @elbuf.setter
+    def elbuf (self, txt):
+        self.elbuf_parts = txt and [txt] or []
 
 class Converter (importer.Importer):
     def __init__ (self, filename, recHandler, recMarker=None,
@@ -35,9 +55,9 @@ class Converter (importer.Importer):
 
         recHandler - our recHandler class.
 
-        recMarker - a string that identifies a recipe, so we can
-        quickly count total recipes and update users as to progress)
-        and our recHandler class.
+        recMarker - a string that identifies a recipe. (We used to
+        count recipes with this to show our progress; now we go by how
+        much of the file we've read.)
 
         We expect subclasses effectively to call as as we are with
         their own recHandlers.
@@ -54,26 +74,51 @@ class Converter (importer.Importer):
         importer.Importer.__init__(self,name=name)
 
     def do_run (self):
-        # count the recipes in the file
-        t = TimeAction("rxml_to_metakit.run counting lines",0)
+        # We feed the file to our parser a chunk at a time, so we can
+        # tell how far along we are from how much we've read, rather
+        # than counting recipes in a pass of our own first.
+        t = TimeAction('xml_importer.Converter.do_run parsing',0)
         if isinstance(self.fn, str):
-            # Latin-1 can decode any bytes, letting us open ASCII-compatible
-            # text files and sniff their contents - e.g. for XML tags -
-            # without worrying about their real text encoding.
-            f = open(self.fn, 'r', encoding='latin1')
+            f = open(self.fn, 'rb')
         else:
-            f=self.fn
-        recs = 0
-        for l in f.readlines():
-            if l.find(self.recMarker) >= 0: recs += 1
-            if recs % 5 == 0: self.check_for_sleep()
-        f.close()
+            f = self.fn
+        try:
+            size = os.fstat(f.fileno()).st_size
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            # A stream (say, from an archive): we can't tell how big
+            # it is, so our progress bar just pulses.
+            size = None
+        parser = xml.sax.make_parser()
+        parser.setContentHandler(self.rh)
+        parser.setErrorHandler(xml.sax.ErrorHandler())
+        done = 0
+        with f:
+            while True:
+                chunk = f.read(PARSE_CHUNK_SIZE)
+                if not chunk: break
+                parser.feed(chunk)
+                done += len(chunk)
+                self.check_for_sleep()
+                self.emit('progress',
+                          size and float(done)/size or -1,
+                          _("Imported %s recipes.")%self.rh.count)
+            parser.close()
         t.end()
-        self.rh.total=recs
-        self.parse = xml.sax.parse(self.fn, self.rh)
+        # Our RecHandler is the one doing the importing.
+        importer.Importer.do_run(self.rh)
         self.added_ings = self.rh.added_ings
         self.added_recs = self.rh.added_recs
         importer.Importer._run_cleanup_(self.rh)
 
+    def finish_bulk_commit (self):
+        # Our RecHandler is the one doing the importing.
+        self.rh.finish_bulk_commit()
+
+    def run_post_import (self):
+        self.rh.run_post_import()
+
+    def collect_recs (self):
+        return self.rh.collect_recs()
+
 
 
@@ -100,10 +100,10 @@ class KeyManager:
         return nwlst
 
     def get_key_fast(self, s) -> str:
-        srch = self.rm.fetch_all(self.rm.keylookup_table, item=s,
-                                 sort_by=[('count', 1)])
-        if srch:
-            return srch[-1].ingkey
+        counts = self.rm.get_keylookup_index()['item'].get(s)
+        if counts:
+            # The most common key, preferring the newest on ties.
+            return sorted(counts, key=counts.get)[-1]
         else:
             s = self._snip_notes(s)
             return self.generate_key(s)
@@ -126,7 +126,8 @@ class KeyManager:
         """Given a key, return a sorted list of potential matching known keys.
 
         By using some heuristics to find spelling variations, look up the
-        database for similar entries.
+        database for similar entries. The lookups are done in the
+        in-memory index returned by get_keylookup_index.
 
         These are then sorted according to their matching score.
 
@@ -136,6 +137,8 @@ class KeyManager:
         """
         txt = txt.casefold()
         retvals = defaultdict(float)
+        index = self.rm.get_keylookup_index()
+        ingkeys = self.rm.get_ingkeys()
 
         # First look for matches for our full text (or full text +/- s)
         main_txts = [txt]
@@ -148,14 +151,12 @@ class KeyManager:
         # By doing so, it establishes a baseline for the accuracy of t
         # being a useful keyword.
         for t in main_txts:
-            entry = self.rm.fetch_one(self.rm.ingredients_table, ingkey=t)
-
-            if entry is not None:
+            if t in ingkeys:
                 retvals[t] = 0.9
 
-            exact = self.rm.fetch_all(self.rm.keylookup_table, item=t)
-            for o in exact:
-                retvals[o.ingkey] += (float(o.count) / len(exact)) * 2
+            exact = index['item'].get(t, {})
+            for ingkey, count in exact.items():
+                retvals[ingkey] += (float(count) / len(exact)) * 2
 
         # Part II -- look up individual words
         words = self.word_splitter.split(txt)
@@ -177,9 +178,9 @@ class KeyManager:
         for word in words:
             if not word:
                 return
-            srch = self.rm.fetch_all(self.rm.keylookup_table, word=word)
-            total_count = sum([m.count for m in srch])
-            for match in srch:
+            srch = index['word'].get(word, {})
+            total_count = sum(srch.values())
+            for ik, count in srch.items():
                 # We have a lovely ratio.
                 #
                 # count      1
@@ -190,10 +191,9 @@ class KeyManager:
                 # resulted in this key, matches is the number of keys
                 # that match this word in all, and words is the number
                 # of words we're dealing with.
-                ik = match.ingkey
                 words_in_key = len(ik.split())
                 wordcount = words_in_key if words_in_key > nwords else nwords
-                retvals[ik] += (match.count / total_count) * (1 / wordcount)
+                retvals[ik] += (count / total_count) * (1 / wordcount)
 
                 # Add some probability if our word shows up in the key
                 if word in ik:
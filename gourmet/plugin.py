@@ -28,6 +28,9 @@
 # RecEditorPlugin - given an instance of the recipe editor.
 # DatabasePlugin - given an instance of the base database class.
 
+import os
+import shutil
+import tempfile
 from gi.repository import GObject, Gtk
 from gourmet import Undo
 from . import plugin_loader
@@ -83,6 +86,9 @@ class ImporterPlugin (StandardPlugin):
     name = None # The name of our importer
     patterns = [] # Glob patterns to match this filetype
     mimetypes = [] # mimetypes associated with this filetype
+    # Can our importers parse files in a worker process? Importers
+    # that need the GUI (such as interactive importers) can't.
+    parse_in_worker = True
 
     def activate (self, pluggable):
         pluggable.register_plugin(self)
@@ -113,6 +119,50 @@ class ImporterPlugin (StandardPlugin):
         tempfilename = self.importManager.get_tempfilename(url,data,content_type)
         return self.get_importer(tempfilename)
 
+    def test_stream (self, name, head):
+        '''Test whether a file named name, whose first bytes are head,
+        is importable by this plugin. We use this for files we read
+        out of archives without extracting them.
+
+        By default, we write head to a temporary file and hand it to
+        test_file. Plugins that can do better should.
+        '''
+        tempfilename = write_tempfile(name,head)
+        try:
+            return self.test_file(tempfilename)
+        finally:
+            os.remove(tempfilename)
+
+    def get_stream_importer (self, stream, name):
+        '''Return an importer for the file named name we're reading
+        from binary file object stream.
+
+        By default, we copy the file to a temporary file and hand it
+        to get_importer; the importer removes it once it's done (see
+        Importer.remove_tempfiles). Plugins whose importers can read
+        from a file object should hand them stream instead.
+        '''
+        tempfilename = write_tempfile(name,stream)
+        try:
+            file_importer = self.get_importer(tempfilename)
+        except:
+            os.remove(tempfilename)
+            raise
+        file_importer.tempfiles.append(tempfilename)
+        return file_importer
+
+def write_tempfile (name, data):
+    """Write data (bytes or a binary file object) to a temporary file
+    with the same extension as name, and return the filename.
+    """
+    fd,tempfilename = tempfile.mkstemp(os.path.splitext(name)[1])
+    with os.fdopen(fd,'wb') as fout:
+        if isinstance(data,bytes):
+            fout.write(data)
+        else:
+            shutil.copyfileobj(data,fout)
+    return tempfilename
+
 
 
 
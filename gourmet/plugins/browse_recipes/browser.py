@@ -2,12 +2,11 @@ import os.path
 
 from gettext import gettext as _
 from gi.repository import GdkPixbuf, GObject, Gtk
-from sqlalchemy.sql import and_, not_
+from sqlalchemy.sql import and_, not_, select
 
 import gourmet.convert as convert
 from gourmet.gglobals import DEFAULT_ATTR_ORDER, REC_ATTR_DIC
 from gourmet.gtk_extras.ratingWidget import star_generator
-from gourmet.image_utils import bytes_to_pixbuf
 
 from .icon_helpers import (attr_to_icon, get_recipe_image, get_time_slice,
                            ICON_SIZE, scale_pb)
@@ -73,13 +72,12 @@ class RecipeBrowserView(Gtk.IconView):
             tbl = self.rd.recipe_table.join(self.rd.categories_table)
             col = self.rd.categories_table.c.category
             if hasattr(self, 'category_images'):
-                stment = and_(col == val, self.rd.recipe_table.c.image != None,
-                              self.rd.recipe_table.c.image != bytes(),
+                stment = and_(col == val, self.rd.recipe_table.c.image_hash != None,
                               not_(self.rd.recipe_table.c.title.in_(self.category_images)))
             else:
-                stment = and_(col == val, self.rd.recipe_table.c.image != None,
-                              self.rd.recipe_table.c.image != bytes())
-            result = tbl.select(stment,limit=1).execute().fetchone()
+                stment = and_(col == val, self.rd.recipe_table.c.image_hash != None)
+            result = select([self.rd.recipe_table.c.id,self.rd.recipe_table.c.title],
+                            stment,from_obj=[tbl],limit=1).execute().fetchone()
             if not hasattr(self, 'category_images'):
                 self.category_images = []
             if result:
@@ -91,11 +89,12 @@ class RecipeBrowserView(Gtk.IconView):
         else:
             tbl = self.rd.recipe_table
             col = getattr(self.rd.recipe_table.c, attr)
-            stment = and_(col == val, self.rd.recipe_table.c.image != None,
-                          self.rd.recipe_table.c.image != bytes())
-            result = tbl.select(stment,limit=1).execute().fetchone()
-        if result and result.thumb:
-            return scale_pb(bytes_to_pixbuf(result.image))
+            stment = and_(col == val, self.rd.recipe_table.c.image_hash != None)
+            result = select([self.rd.recipe_table.c.id],
+                            stment,from_obj=[tbl],limit=1).execute().fetchone()
+        thumbnail = result and self.rd.get_thumbnail(result.id,ICON_SIZE)
+        if thumbnail:
+            return scale_pb(thumbnail)
         else:
             return self.get_base_icon(attr) or self.get_base_icon('category')
 
@@ -143,8 +142,9 @@ class RecipeBrowserView(Gtk.IconView):
                 searches.append({'column':attr,'search':val,'operator':'='})
             else:
                 searches.append({'column':attr,'search':val})
-        for recipe in self.rd.search_recipes(searches):
-            pb = get_recipe_image(recipe)
+        for recipe in self.rd.search_recipes(searches,
+                                             columns=self.rd.get_recipe_columns()):
+            pb = get_recipe_image(recipe,self.rd.get_thumbnail(recipe,ICON_SIZE))
             m.append((str(recipe.id),recipe.title,pb,None))
 
     def set_path (self, path):
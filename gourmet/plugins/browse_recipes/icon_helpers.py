@@ -3,7 +3,7 @@ import os.path
 from gi.repository import GdkPixbuf, Gtk
 from PIL import Image, ImageDraw
 
-from gourmet.image_utils import bytes_to_pixbuf, image_to_pixbuf
+from gourmet.image_utils import image_to_pixbuf
 from gourmet.gtk_extras.ratingWidget import star_generator
 
 curdir = os.path.split(__file__)[0]
@@ -48,9 +48,9 @@ attr_to_icon = {
     'preptime':scale_pb(preptime_image),
     }
 
-def get_recipe_image (rec):
-    if rec.image:
-        pb = scale_pb(bytes_to_pixbuf(rec.image))
+def get_recipe_image (rec, thumbnail):
+    if thumbnail:
+        pb = scale_pb(thumbnail)
     else:
         pb = generic_recipe_image.copy()
     big_side = ((pb.get_property('height') > pb.get_property('width') and pb.get_property('height')) or pb.get_property('width'))
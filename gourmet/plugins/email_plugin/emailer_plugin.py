@@ -31,7 +31,8 @@ class EmailRecipePlugin (MainPlugin, UIPlugin):
     def get_selected_recs (self):
         recs = self.rg.get_selected_recs_from_rec_tree()
         if not recs:
-            recs = self.rd.fetch_all(self.rd.recipe_table, deleted=False, sort_by=[('title',1)])
+            recs = self.rd.fetch_all(self.rd.recipe_table, deleted=False, sort_by=[('title',1)],
+                                     columns=self.rd.get_recipe_columns())
         return recs
 
     def email_selected (self, *args):
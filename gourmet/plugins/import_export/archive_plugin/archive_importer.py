@@ -0,0 +1,99 @@
+from gettext import gettext as _
+from gourmet.importers import importer
+from gourmet.importers.importManager import get_import_manager
+from gourmet.plugin import write_tempfile
+from gourmet.gdebug import debug
+from .zip_readers import archive_members, sniff
+
+class ArchiveImporter (importer.Importer):
+
+    """Import the files in an archive (a zip file, tarball or
+    gzipped file).
+
+    We read each file straight out of the archive and hand it to the
+    importer for its type, which we pick by the file's name and first
+    few bytes (see ImportManager.find_plugin). Member importers run
+    one at a time inside our own thread, so we never extract the
+    archive or hold more than one of its files open.
+    """
+
+    def __init__ (self, archive, name='zipfile', import_manager=None):
+        """archive is the filename of our archive, or a binary file
+        object to read it from.
+
+        name is the name of the archive, for messages and for naming
+        a gzipped file's single member.
+        """
+        self.archive = archive
+        self.archive_name = name
+        self.import_manager = import_manager or get_import_manager()
+        # The importer for the file we're reading now.
+        self.member_importer = None
+        importer.Importer.__init__(self,name='Archive Importer')
+
+    def do_run (self):
+        n = 0
+        for name,member in archive_members(self.archive,self.archive_name):
+            self.check_for_sleep()
+            head,member = sniff(member)
+            plugin = self.import_manager.find_plugin(name,head)
+            if not plugin:
+                print('Warning, no plugin found for file ',name,'in archive')
+                continue
+            if not plugin.parse_in_worker:
+                # Interactive importers need the GUI, so we leave
+                # these to post_run.
+                tempfilename = write_tempfile(name,member)
+                self.serial_files.append((tempfilename,plugin))
+                self.serial_tempfiles.append(tempfilename)
+                continue
+            debug('Importing %s from archive with %s'%(name,plugin.name),1)
+            self.import_member(plugin.get_stream_importer(member,name))
+            n += 1
+            self.emit('progress',-1,_('Imported %s files from archive.')%n)
+        importer.Importer.do_run(self)
+
+    def import_member (self, member_importer):
+        """Run member_importer, which reads one file of our archive,
+        inside our thread."""
+        self.member_importer = member_importer
+        member_importer.connect(
+            'progress',
+            lambda st,perc,txt: self.emit('progress',perc,txt)
+            )
+        if self.collected_recs is not None:
+            recs = member_importer.collect_recs()
+        try:
+            if hasattr(member_importer,'pre_run'):
+                member_importer.pre_run()
+            member_importer.do_run()
+        finally:
+            # Keep whatever our member imported if we're stopped.
+            member_importer.finish_bulk_commit()
+            member_importer.run_post_import()
+            member_importer.remove_tempfiles()
+            self.member_importer = None
+        if self.collected_recs is not None:
+            self.collected_recs.extend(recs)
+        self.added_recs.extend(member_importer.added_recs)
+        self.added_ings.extend(member_importer.added_ings)
+        # An archive within our archive may have files for post_run.
+        self.serial_files.extend(member_importer.serial_files)
+        self.serial_tempfiles.extend(member_importer.serial_tempfiles)
+
+    def post_run (self):
+        for fn,plugin in self.serial_files:
+            self.import_manager.do_import(plugin,'get_importer',fn,
+                                          is_tempfile=fn in self.serial_tempfiles)
+
+    def terminate (self):
+        importer.Importer.terminate(self)
+        if self.member_importer: self.member_importer.terminate()
+
+    def suspend (self):
+        importer.Importer.suspend(self)
+        if self.member_importer: self.member_importer.suspend()
+
+    def resume (self):
+        importer.Importer.resume(self)
+        if self.member_importer: self.member_importer.resume()
@@ -1,6 +1,5 @@
 from gourmet.plugin import ImporterPlugin
-from gourmet.importers.importManager import ImportFileList
-from .zip_readers import archive_to_filelist
+from .archive_importer import ArchiveImporter
 from gettext import gettext as _
 import fnmatch
 
@@ -20,8 +19,12 @@ class ArchiveImporterPlugin (ImporterPlugin):
         for p in self.patterns:
             if fnmatch.fnmatch(filename.lower(),p.lower()): return True
 
+    def test_stream (self, name, head):
+        return self.test_file(name)
+
     def get_importer (self, filename):
-        flist = archive_to_filelist(filename)
-        print('Filelist=',flist)
-        ifl = ImportFileList(flist)
-        raise ifl
+        return ArchiveImporter(filename,import_manager=self.importManager)
+
+    def get_stream_importer (self, stream, name):
+        # An archive within an archive.
+        return ArchiveImporter(stream,name,import_manager=self.importManager)
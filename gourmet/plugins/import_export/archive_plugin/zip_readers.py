@@ -1,80 +1,99 @@
-import zipfile, io, tempfile, os, os.path
+import zipfile, tempfile, os, os.path, shutil, io
 import tarfile, gzip
-from gourmet.importers.webextras import read_socket_w_progress
-from gourmet.importers.importer import add_to_fn
 from gourmet.gdebug import debug
 
-# This is simply a convenience. We read a zipfile, and then hand out a
-# list of files which we can use to import from using our other
-# importers.
+# This is simply a convenience. We read a zipfile, and then hand out
+# its members one at a time as file objects, which our other importers
+# can read from directly. Nothing is extracted to disk, and we only
+# ever hold one member open.
 #
-# We will also conveniently handle tarballs
+# We will also conveniently handle tarballs and gzipped files.
 
-def archive_to_filelist (fi, progress=None, name='zipfile'):
-    if tarfile.is_tarfile(fi):
-        debug('tarball_to_filelist',0)
-        return tarball_to_filelist(fi,progress,name)
-    else:
-        try:
-            ifi = gzip.open(fi,'r')
-            # we move forward a byte to trigger an error if this
-            # is not a gzip file (hackish, I know)
-            ifi.seek(1)
-            ifi.seek(0)
-            ifi.name = os.path.splitext(fi)[0]
-            debug('returning ungzipped file %s'%ifi,0)
-            return [ifi]
-        except IOError:
-            return zipfile_to_filelist(fi,progress,name)
+# How much of each member we read to guess its file type.
+SNIFF_SIZE = 4096
 
-def zipfile_to_filelist (fi, progress=None, name="zipfile"):
-    """Take our zipfile and return a list of files.
+def archive_members (fi, name='zipfile'):
+    """Yield a tuple (name, file) for each member of archive fi.
 
-    We're quite liberal in what we allow fi to be.  If fi is a string,
-    we open it as a filename.  if fi is a file object, we handle it,
-    even if it's an icky file object that needs some messy
-    manipulation to work (i.e. a urllib.urlopen() object).
+    fi can be a filename or a binary file object, which need not be
+    seekable. Each file is a binary file object we read straight from
+    the archive; it is only good until we yield the next member.
     """
-    # handle filename
     if isinstance(fi, str):
+        name = fi
         fi = open(fi, 'rb')
-    # handle unseekable
-    elif not hasattr(fi,'seek'):
-        # slurp up the file into a StringIO so we can seek within it
-        debug('Slurping up file into StringIO',1)
-        tmpfi=io.StringIO(read_socket_w_progress(fi,progress,_('Loading zip archive')))
+    try:
+        if not fi.seekable():
+            # Zip files keep their table of contents at the end, so we
+            # have to be able to seek. We spool the stream to a
+            # temporary file, rather than into memory.
+            debug('Spooling unseekable archive to a temporary file',1)
+            spooled = tempfile.TemporaryFile()
+            shutil.copyfileobj(fi, spooled)
+            fi.close()
+            fi = spooled
+            fi.seek(0)
+        magic = fi.read(4)
+        fi.seek(0)
+        if magic.startswith(b'PK'):
+            yield from zipfile_members(fi)
+        elif magic.startswith(b'\x1f\x8b') and not is_tarball(fi):
+            debug('returning ungzipped file %s'%name,0)
+            yield os.path.splitext(os.path.basename(name))[0], gzip.GzipFile(fileobj=fi)
+        else:
+            yield from tarball_members(fi)
+    finally:
         fi.close()
-        fi = tmpfi
-    # and now we actually do our work...
-    debug('ZipFile(fi)',1)
-    zf=zipfile.ZipFile(fi)
-    flist=[]
-    fbase = os.path.join(tempfile.tempdir, name)
-    while os.path.exists(fbase):
-        fbase=add_to_fn(fbase)
-    os.mkdir(fbase)
-    nlist = zf.namelist()
-    totlen=float(len(nlist))
-    for i,n in enumerate(nlist):
-        debug('Unzipping item %s'%i,1)
-        if progress: progress(float(i)/totlen,_("Unzipping zip archive"))
-        fn = os.path.join(fbase,n)
-        ifi=open(fn,'wb')
-        ifi.write(zf.read(n))
-        ifi.close()
-        flist.append(fn)
-    zf.close()
-    debug('zipfile returning filelist %s'%flist,1)
-    return flist
 
-def tarball_to_filelist (fi, progress=None, name="zipfile"):
-    tb = tarfile.TarFile.open(fi,mode='r')
-    fi_info = next(tb)
-    filist = []
-    while fi_info:
-        fi = tb.extractfile(fi_info)
-        if fi: filist.append(fi)
-        fi_info = next(tb)
-    debug('tarball_to_filelist returning %s'%filist,0)
-    return filist
+def is_tarball (fi):
+    """Return True if seekable file object fi is a (possibly
+    compressed) tarball, leaving fi at the start."""
+    try:
+        with tarfile.open(fileobj=fi, mode='r:*') as tb:
+            return tb.next() is not None
+    except tarfile.TarError:
+        return False
+    finally:
+        fi.seek(0)
 
+def zipfile_members (fi):
+    zf = zipfile.ZipFile(fi)
+    try:
+        for info in zf.infolist():
+            if info.is_dir(): continue
+            debug('Reading zip member %s'%info.filename,1)
+            with zf.open(info) as member:
+                yield info.filename, member
+    finally:
+        zf.close()
+
+def tarball_members (fi):
+    # Stream mode reads the tarball front to back without seeking.
+    tb = tarfile.open(fileobj=fi, mode='r|*')
+    try:
+        for info in tb:
+            if not info.isfile(): continue
+            debug('Reading tar member %s'%info.name,1)
+            member = tb.extractfile(info)
+            try:
+                yield info.name, member
+            finally:
+                member.close()
+    finally:
+        tb.close()
+
+def sniff (member):
+    """Return (head, file), where head is up to SNIFF_SIZE bytes from
+    the start of member, for guessing its type, and file reads member
+    from the start, head included."""
+    fi = MemberReader(member, SNIFF_SIZE)
+    return fi.peek(SNIFF_SIZE)[:SNIFF_SIZE], fi
+
+class MemberReader (io.BufferedReader):
+
+    """A file in an archive. We read members front to back (tarfile
+    can't even tell us whether it could seek in a streamed tarball),
+    so we never seek."""
+
+    def seekable (self):
+        return False
@@ -46,7 +46,7 @@ class GxmlImportTester:
         self.is_markup_valid(sauce)
         self.is_markup_valid(rice)
         assert '<i>well' in sauce.instructions, 'value was %s'%sauce.instructions
-        assert sauce.image
+        assert self.rm.get_image(sauce)
         assert sauce.thumb
 
     def is_markup_valid (self, rec):
@@ -67,6 +67,12 @@ class GourmetXML2Plugin (ImporterPlugin):
     def get_importer (self, filename):
         return gxml2_importer.Converter(filename)
 
+    def test_stream (self, name, head):
+        return Tester('.*<gourmetDoc[> ]').test_head(head)
+
+    def get_stream_importer (self, stream, name):
+        return gxml2_importer.Converter(stream)
+
 
 class GourmetXMLPlugin (ImporterPlugin):
 
@@ -80,6 +86,12 @@ class GourmetXMLPlugin (ImporterPlugin):
     def get_importer (self, filename):
         return gxml_importer.Converter(filename)
 
+    def test_stream (self, name, head):
+        return Tester('.*<recipeDoc[> ]').test_head(head)
+
+    def get_stream_importer (self, stream, name):
+        return gxml_importer.Converter(stream)
+
     def get_import_tests (self):
         '''Return an alist with files to check and tester functions
         that will be run to test the imported recipes. The function
@@ -15,3 +15,9 @@ class KrecipeImporterPlugin (ImporterPlugin):
 
     def get_importer (self, filename):
         return krecipe_importer.Converter(filename)
+
+    def test_stream (self, name, head):
+        return Tester('.*<krecipes.*[> ]').test_head(head)
+
+    def get_stream_importer (self, stream, name):
+        return krecipe_importer.Converter(stream)
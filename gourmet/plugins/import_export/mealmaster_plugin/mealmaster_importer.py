@@ -44,7 +44,7 @@ class mmf_constants:
             self.unit_convr[v]=k
 
 mmf=mmf_constants()
-mm_start_pattern=r"^(?i)([m-][m-][m-][m-][m-])-*.*(recipe|meal-?master).*"
+mm_start_pattern=r"(?i)^([m-][m-][m-][m-][m-])-*.*(recipe|meal-?master).*"
 
 class mmf_importer (plaintext_importer.TextImporter):
 
@@ -78,7 +78,13 @@ class mmf_importer (plaintext_importer.TextImporter):
     by hand with some frequency.
     """
 
+    bulk_commit = True
+    stream_lines = True
     committed = False
+    # The characters that start our recipe start and end lines and our
+    # group headings, and our variation lines (see compile_dispatch).
+    marker_chars = 'mM-'
+    variation_chars = 'VvHhNn'
 
     def __init__ (self,filename='Data/mealmaster.mmf',
                   prog=None, source=None,threaded=True,
@@ -134,8 +140,27 @@ class mmf_importer (plaintext_importer.TextImporter):
             attrmatch += "%s|"%re.escape(k)
         attrmatch=r"%s):\s*(.*)\s*$"%attrmatch[0:-1]
         self.attr_matcher = re.compile(attrmatch)
+        self.compile_dispatch()
         testtimer.end()
 
+    def compile_dispatch (self):
+        """Work out which characters each kind of line can start with.
+
+        Most lines can only match one or two of our regexps, which we
+        can tell from their first non-blank character, so handle_line
+        only tries those.
+        """
+        self.marker_starts = frozenset(self.marker_chars)
+        self.attr_starts = frozenset(k[0] for k in self.mmf.recattrs)
+        self.variation_starts = frozenset(self.variation_chars)
+        number_starts = set(convert.UNICODE_FRACTIONS)
+        number_starts.update(',./-' + convert.SLASH)
+        for w in convert.all_number_words:
+            number_starts.update((w[0].lower(),w[0].upper()))
+        # Amounts can also start with any digit, which is_ingredient
+        # checks for itself.
+        self.number_starts = frozenset(number_starts)
+
     def handle_line (self,l):
 
         """Handle an individual line of a mealmaster file.
@@ -150,44 +175,45 @@ class mmf_importer (plaintext_importer.TextImporter):
         we're following, more or less, the specs laid out here
         <http://phprecipebook.sourceforge.net/docs/MM_SPEC.DOC>"""
 
-        testtimer =TimeAction('mealmaster_importer.handle_line',10)
-        debug("start handle_line",10)
-        #gt.gtk_update()
-        if self.start_matcher.match(l):
-            debug("recipe start %s"%l,4)
-            if 'Windows Gourmet' in l:
-                self.unit_length = 15
-            self.new_rec()
-            self.last_line_was = 'new_rec'
-            self.in_variation = False
-            return
-        if self.end_matcher.match(l):
-            debug("recipe end %s"%l,4)
-            self.commit_rec()
-            self.last_line_was = 'end_rec'
-            return
-        groupm = self.group_matcher.match(l)
-        if groupm:
-            debug("new group %s"%l,4)
-            self.handle_group(groupm)
-            self.last_line_was = 'group'
-            return
-        attrm = self.attr_matcher.match(l)
-        if attrm:
-            debug('Found attribute in %s'%l,4)
-            attr,val = attrm.groups()
-            debug("Writing attribute, %s=%s"%(attr,val),4)
-            self.rec[self.mmf.recattrs[attr]]=val.strip()
-            self.last_line_was = 'attr'
-            return
-        if not self.instr and self.blank_matcher.match(l):
-            debug('ignoring blank line before instructions',4)
-            self.last_line_was = 'blank'
-            return
-        if self.variation_matcher.match(l):
+        first = l.lstrip()[:1]
+        if first in self.marker_starts:
+            if self.start_matcher.match(l):
+                debug("recipe start %s"%l,4)
+                if 'Windows Gourmet' in l:
+                    self.unit_length = 15
+                self.new_rec()
+                self.last_line_was = 'new_rec'
+                self.in_variation = False
+                return
+            if self.end_matcher.match(l):
+                debug("recipe end %s"%l,4)
+                self.commit_rec()
+                self.last_line_was = 'end_rec'
+                return
+            groupm = self.group_matcher.match(l)
+            if groupm:
+                debug("new group %s"%l,4)
+                self.handle_group(groupm)
+                self.last_line_was = 'group'
+                return
+        if first in self.attr_starts:
+            attrm = self.attr_matcher.match(l)
+            if attrm:
+                debug('Found attribute in %s'%l,4)
+                attr,val = attrm.groups()
+                debug("Writing attribute, %s=%s"%(attr,val),4)
+                self.rec[self.mmf.recattrs[attr]]=val.strip()
+                self.last_line_was = 'attr'
+                return
+        if not first:
+            if not self.instr:
+                debug('ignoring blank line before instructions',4)
+                self.last_line_was = 'blank'
+                return
+        elif first in self.variation_starts and self.variation_matcher.match(l):
             debug('in variation',4)
             self.in_variation = True
-        if self.is_ingredient(l) and not self.in_variation:
+        if not self.in_variation and self.is_ingredient(l):
             debug('in ingredient',4)
             contm = self.ing_cont_matcher.match(l)
             if contm:
@@ -223,7 +249,6 @@ class mmf_importer (plaintext_importer.TextImporter):
             else:
                 setattr(self,add_to,
                         l.strip() + "\n")
-        testtimer.end()
 
     def is_ingredient (self, l):
         """Return true if the line looks like an ingredient.
@@ -233,12 +258,11 @@ class mmf_importer (plaintext_importer.TextImporter):
         columns more appropriately.  For now, we'll assume that a
         field that starts with at least 5 blanks (the specs suggest 7)
         or a field that begins with a numeric value is an ingredient"""
-        testtimer = TimeAction('mealmaster_importer.is_ingredient',10)
-        if self.ing_num_matcher.match(l):
-            testtimer.end()
+        first = l.lstrip()[:1]
+        if ((first.isdecimal() or first in self.number_starts)
+            and self.ing_num_matcher.match(l)):
             return True
-        if len(l) >= 7 and self.blank_matcher.match(l[0:5]):
-            testtimer.end()
+        if len(l) >= 7 and l[0:5].isspace():
             return True
 
     def new_rec (self):
@@ -303,8 +327,13 @@ class mmf_importer (plaintext_importer.TextImporter):
         """Find fields in an ingredient line."""
         testtimer = TimeAction('mealmaster_importer.find_ing_fields',10)
         all_ings = [i[0] for i in self.ingrs]
-        fields = find_fields(all_ings)
-        fields_is_numfield = fields_match(all_ings,fields,self.amt_field_matcher)
+        # We work out our columns from bitmaps of where each line has
+        # something other than a space, and something that can't be
+        # part of an amount, rather than rescanning the lines.
+        fields = find_fields(all_ings,
+                             bitmaps=[char_bitmap(s,NOT_SPACE) for s in all_ings])
+        fields_is_numfield = fields_match(all_ings,fields,self.amt_field_matcher,
+                                          bitmaps=[char_bitmap(s,NOT_AMOUNT) for s in all_ings])
         #fields = [[r,field_match(all_ings,r,self.amt_field_matcher)] for r in find_fields(all_ings)]
         aindex,afield = self.find_amt_field(fields,fields_is_numfield)
         if aindex != None:
@@ -399,7 +428,7 @@ class mmf_importer (plaintext_importer.TextImporter):
                 amt,u,i = get_fields(s,(afield,ufield,ifield))
                 debug("""amt:%(amt)s
                 u:%(u)s
-                i:%(i)s"""%locals(),0)
+                i:%(i)s"""%locals(),6)
                 # sanity check...
                 if not amt.strip() and not u.strip():
                     if not i: continue
@@ -415,7 +444,7 @@ class mmf_importer (plaintext_importer.TextImporter):
                         debug("""After sanity check
                         amt:%(amt)s
                         u:%(u)s
-                        i:%(i)s"""%locals(),0)
+                        i:%(i)s"""%locals(),6)
                 if amt.strip() or u.strip() or i.strip():
                     self.start_ing()
                     if amt:
@@ -447,28 +476,62 @@ def split_fields (strings, char=" "):
     fields=find_fields(strings,char)
     testtimer.end()
 
-def fields_match (strings, fields, matcher):
-    testtimer = TimeAction('mealmaster_importer.fields_match',10)
+class CharClass (dict):
+    """A table for str.translate which maps characters for which
+    test(character) is true to '1', and all others to '0' (see
+    char_bitmap)."""
+
+    def __init__ (self, test):
+        self.test = test
+
+    def __missing__ (self, ordinal):
+        self[ordinal] = bit = self.test(chr(ordinal)) and '1' or '0'
+        return bit
+
+NOT_SPACE = CharClass(lambda ch: ch != ' ')
+# Characters besides digits and spaces that can be part of an amount
+# (see mmf_importer.amt_field_matcher), which may be spelled out.
+AMOUNT_CHARS = set(convert.UNICODE_FRACTIONS)
+AMOUNT_CHARS.update(',./-' + convert.SLASH)
+AMOUNT_CHARS.update(''.join(convert.all_number_words))
+NOT_AMOUNT = CharClass(
+    lambda ch: not (ch.isdecimal() or ch.isspace() or ch in AMOUNT_CHARS)
+    )
+
+def char_bitmap (string, char_class):
+    """Return a bitmap of string: an int with bit n set if character
+    n of string is in char_class (a CharClass)."""
+    return int(string.translate(char_class)[::-1] or '0',2)
+
+def bit_positions (bitmap):
+    """Return a list of the bits set in bitmap, lowest first."""
+    positions = []
+    while bitmap:
+        low = bitmap & -bitmap
+        positions.append(low.bit_length()-1)
+        bitmap ^= low
+    return positions
+
+def fields_match (strings, fields, matcher, bitmaps=None):
     """Return an array of True or False values representing
-    whether matcher is a match for each of fields in string."""
-    #retarray = array.array('H',[1]*len(fields))
+    whether matcher is a match for each of fields in string.
+
+    bitmaps, if we have them, are a bitmap for each string of
+    characters matcher can't match (see char_bitmap): we don't bother
+    trying matcher on fields with any of those.
+    """
     ret = []
-    for f in fields:
-        strs = [s[f[0]:f[1]] for s in strings]
-        matches = [matcher.match(s) and True or False for s in strs]
-        if True in matches: ret.append(1)
-        else: ret.append(0)
+    for start,end in fields:
+        mask = (1 << (end-start)) - 1
+        for n,s in enumerate(strings):
+            if bitmaps and (bitmaps[n] >> start) & mask:
+                continue
+            if matcher.match(s[start:end]):
+                ret.append(1)
+                break
+        else:
+            ret.append(0)
     return ret
-    #return array.array('H',[True in [matcher.match(s[f[0]:f[1]]) and 1 or 0 for s in strings] for f in fields])
-
-    # cycle through each string broken into our fields
-    #for ff in [[s[f[0]:f[1]] for f in fields] for s in strings]:
-    #    for i,fld in enumerate(ff):
-    #        if fld and retarray[i] and not matcher.match(fld):
-    #            retarray[i]=False
-    #            if not True in retarray: return retarray
-    #testtimer.end()
-    #return retarray
 
 
 def field_match (strings, tup, matcher):
@@ -509,9 +572,9 @@ def field_width (tuple):
         return None
 
 
-def find_fields (strings, char=" "):
+def find_fields (strings, char=" ", bitmaps=None):
     testtimer = TimeAction('mealmaster_importer.find_fields',10)
-    cols = find_columns(strings, char)
+    cols = find_columns(strings, char, bitmaps)
     if not cols: return []
     cols.reverse()
     fields = []
@@ -532,43 +595,83 @@ def find_fields (strings, char=" "):
     return fields
 
 
-def find_columns (strings, char=" "):
+def find_columns (strings, char=" ", bitmaps=None):
+    """Return a list of character indices that match char for each string in strings.
+
+    bitmaps, if we have them, are a bitmap for each string of the
+    characters that aren't char (see char_bitmap).
+    """
     testtimer = TimeAction('mealmaster_importer.find_columns',10)
-    """Return a list of character indices that match char for each string in strings."""
     debug("start find_columns",10)
-    # we start with the columns in the first string
     if not strings:
         return None
-    strings=list(strings)
-    strings.sort(key=len, reverse=True)
-    columns = [match.start() for match in re.finditer(re.escape(char),strings[0])]
-    if len(strings)==1:
-        return columns
-    # we eliminate all columns that aren't blank for every string
-    for s in strings:
-        for c in columns[0:]: # we'll be modifying columns
-            if c < len(s) and s[c]!=char:
-                columns.remove(c)
-    columns.sort()
+    if bitmaps is None:
+        not_char = CharClass(lambda ch: ch != char)
+        bitmaps = [char_bitmap(s,not_char) for s in strings]
+    # A column is blank if no string has anything but char in it
+    # (strings too short to reach it don't count).
+    used = 0
+    for b in bitmaps:
+        used |= b
+    width = max(map(len,strings))
+    columns = bit_positions(~used & ((1 << width) - 1))
     testtimer.end()
     return columns
 
 
 
-if __name__ == '__main__':
-    import gourmet.recipeManager as recipeManager
-    import tempfile, sys, profile, os.path
-    print('Testing MealMaster import')
-    tmpfile = tempfile.mktemp()
-    import backends.db
-    rd = backends.db.RecipeManager(tmpfile)
-    if not args: args = ['/home/tom/Projects/recipe/Data/200_Recipes.mmf']
-    for a in args:
-        profi = os.path.join(tempfile.tempdir,'MMI_PROFILE')
-        profile.run("mmf_importer(rd,a,prog=lambda *args: sys.stdout.write('|'),threaded=False)",
-                    profi)
-        import pstats
-        p = pstats.Stats(profi)
-        p.strip_dirs().sort_stats('cumulative').print_stats()
+def benchmark (n=100000, source_files=None):
+    """Time importing a MealMaster file of n recipes, which we make by
+    repeating the recipes in source_files (by default, our test
+    files).
 
+    We time reading the file a line at a time (stream_lines) and
+    reading it all in first, and parse recipes without writing them
+    to the database, so we're timing the importer and not the
+    database.
+    """
+    import itertools, resource, tempfile, time
+    if not source_files:
+        test_dir = os.path.join(os.path.dirname(convert.__file__),'tests','recipe_files')
+        source_files = [os.path.join(test_dir,f)
+                        for f in ['mealmaster.mmf','mealmaster_2_col.mmf']]
+    recipes = []
+    for fn in source_files:
+        recipe = []
+        for l in check_encodings.get_file(fn):
+            recipe.append(l)
+            if re.match(r"^[M-][M-][M-][M-][M-]\s*$",l):
+                recipes.append('\n'.join(recipe) + '\n\n')
+                recipe = []
+    with tempfile.NamedTemporaryFile('w',suffix='.mmf',delete=False) as corpus:
+        for recipe in itertools.islice(itertools.cycle(recipes),n):
+            corpus.write(recipe)
+    print('Importing %s recipes (%s bytes)'%(n,os.path.getsize(corpus.name)))
+
+    class Discard (list):
+        # Collect nothing, so we don't time (or fill memory with)
+        # the recipes we parse.
+        def append (self, rec):
+            self.n = getattr(self,'n',0) + 1
+
+    try:
+        # Streaming first, since we can only see our peak memory use
+        # go up.
+        for stream_lines in True,False:
+            imp = mmf_importer(filename=corpus.name)
+            imp.stream_lines = stream_lines
+            imp.collected_recs = Discard()
+            start = time.time()
+            imp.pre_run()
+            imp.do_run()
+            print('stream_lines=%s: %s recipes in %.1f seconds; peak memory %s MB'%(
+                stream_lines,imp.collected_recs.n,time.time()-start,
+                resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+                ))
+    finally:
+        os.unlink(corpus.name)
 
+
+if __name__ == '__main__':
+    import sys
+    benchmark(*[int(a) for a in sys.argv[1:2]])
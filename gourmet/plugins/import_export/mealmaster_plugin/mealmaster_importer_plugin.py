@@ -30,6 +30,12 @@ class MealmasterImporterPlugin (ImporterPlugin):
     def get_importer (self, filename):
         return mealmaster_importer.mmf_importer(filename=filename)
 
+    def test_stream (self, name, head):
+        return Tester(mealmaster_importer.mm_start_pattern).test_head(head)
+
+    def get_stream_importer (self, stream, name):
+        return mealmaster_importer.mmf_importer(filename=stream)
+
     def get_import_tests (self):
         return [
             (os.path.join(test_dir,
@@ -40,15 +40,32 @@ class MCBPlugin (ImporterPlugin):
                 xmlfilename = os.path.join(tempdir, filename)
 
                 #fix the xml file
-                parser = etree.XMLParser(recover=True)
-                tree = etree.parse(xmlfilename, parser)
                 fixedxmlfilename = xmlfilename+'fixed'
-                with open(fixedxmlfilename, 'wb') as fout:
-                    tree.write(fout, xml_declaration=True,
-                               encoding='utf-8', pretty_print=True)
+                fix_xml(xmlfilename, fixedxmlfilename)
 
         zf.close()
 
         return mycookbook_importer.Converter(fixedxmlfilename)
 
 
+
+def fix_xml (xmlfilename, fixedxmlfilename):
+    """Copy the recipes in xmlfilename to fixedxmlfilename as well
+    formed XML, recovering from whatever errors we can.
+
+    We copy one recipe at a time, so big cookbooks don't have to fit
+    in memory.
+    """
+    recipe_tag = mycookbook_importer.RecHandler.RECIPE_TAG
+    events = etree.iterparse(xmlfilename, events=('start','end'), recover=True)
+    event, root = next(events)
+    with etree.xmlfile(fixedxmlfilename, encoding='utf-8') as xf:
+        xf.write_declaration()
+        with xf.element(root.tag):
+            for event, elem in events:
+                if event == 'end' and elem.tag == recipe_tag:
+                    xf.write(elem)
+                    # Throw away the recipes we've written.
+                    elem.clear()
+                    while elem.getprevious() is not None:
+                        del elem.getparent()[0]
@@ -37,6 +37,7 @@ class PlainTextImporterPlugin (ImporterPlugin):
     name = _('Plain Text file')
     patterns = ['*.txt','[^.]*','*']
     mimetypes = ['text/plain']
+    parse_in_worker = False
 
     antipatterns = ['*.html','*.htm','*.xml','*.doc','*.rtf']
 
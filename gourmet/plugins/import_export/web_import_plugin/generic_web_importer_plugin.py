@@ -12,6 +12,8 @@ class GenericWebImporter (ImporterPlugin, Pluggable):
     patterns = ['*.htm','*.html','*.xhtml']
     mimetypes = ['text/html','text/xhtml','application/xhtml+xml','application/xhtml','application/html']
     targets = ['webimport_plugin']
+    # Our WebParsers are interactive importers, which need the GUI.
+    parse_in_worker = False
 
     def __init__ (self, *args, **kwargs):
         Pluggable.__init__(self, [PluginPlugin])
@@ -1,5 +1,5 @@
 from . import data_plugin, main_plugin, reccard_plugin, export_plugin, shopping_plugin
-from . import nutPrefsPlugin
+from . import nutPrefsPlugin, linker_plugin
 plugins = [
     data_plugin.NutritionDataPlugin,
     main_plugin.NutritionMainPlugin,
@@ -7,4 +7,5 @@ plugins = [
     export_plugin.NutritionBaseExporterPlugin,
     shopping_plugin.ShoppingNutritionalInfoPlugin,
     nutPrefsPlugin.NutritionPrefs,
+    linker_plugin.NutritionLinkerPlugin,
     ]
@@ -1,10 +1,14 @@
 import sys
 import urllib.request, urllib.parse, urllib.error, zipfile, tempfile, os.path, re
+import gzip, shutil, sqlite3
 from gettext import gettext as _
 from .parser_data import ABBREVS, ABBREVS_STRT, FOOD_GROUPS, NUTRITION_FIELDS, WEIGHT_FIELDS
-from gourmet.gdebug import TimeAction
 expander_regexp = None
 
+# The columns of the USDA tables we fill in.
+NUTRITION_COLUMNS = [name for lname,name,typ in NUTRITION_FIELDS] + ['foodgroup']
+WEIGHT_COLUMNS = [name for lname,name,typ in WEIGHT_FIELDS if name != 'stdev']
+
 def compile_expander_regexp ():
     regexp = r"(?<!\w)("
     regexp += "|".join(list(ABBREVS.keys()))
@@ -18,19 +22,46 @@ def expand_abbrevs ( line ):
         line = line.replace(k,v)
     if not expander_regexp:
         expander_regexp=compile_expander_regexp()
-    ematch = expander_regexp.search(line)
-    while ematch:
-        matchstr=ematch.groups()[0]
-        replace=ABBREVS[str(matchstr)]
-        line = line[0:ematch.start()] + replace + line[ematch.end():]
-        ematch = expander_regexp.search(line)
-    return line
+    # None of our expansions contain abbreviations themselves, so a
+    # single pass over the line expands everything.
+    return expander_regexp.sub(lambda m: ABBREVS[m.group(1)],line)
+
+def build_prebuilt (directory, filename):
+    """Parse the USDA files in directory into a gzipped SQLite
+    database at filename, for DatabaseGrabber.load_prebuilt."""
+    grabber = DatabaseGrabber(None)
+    grabber.get_groups(os.path.join(directory,grabber.DESC_FILE_NAME))
+    tmp = tempfile.NamedTemporaryFile(suffix='.db',delete=False)
+    tmp.close()
+    try:
+        conn = sqlite3.connect(tmp.name)
+        for table,columns,fn,get_rows in [
+            ('nutrition',NUTRITION_COLUMNS,grabber.ABBREV_FILE_NAME,grabber.abbrev_rows),
+            ('usda_weights',WEIGHT_COLUMNS,grabber.WEIGHT_FILE_NAME,grabber.weight_rows),
+            ]:
+            conn.execute('CREATE TABLE %s (%s)'%(table,', '.join(columns)))
+            with open(os.path.join(directory,fn),'rb') as ifi:
+                conn.executemany(
+                    'INSERT INTO %s VALUES (%s)'%(table,', '.join(['?']*len(columns))),
+                    ([d.get(c) for c in columns] for d in get_rows(ifi))
+                    )
+        conn.commit()
+        conn.close()
+        with open(tmp.name,'rb') as ifi, gzip.open(filename,'wb') as ofi:
+            shutil.copyfileobj(ifi,ofi)
+    finally:
+        os.remove(tmp.name)
 
 class DatabaseGrabber:
     USDA_ZIP_URL = "http://www.nal.usda.gov/fnic/foodcomp/Data/SR17/dnload/sr17abbr.zip"
     ABBREV_FILE_NAME = "ABBREV.txt"
     DESC_FILE_NAME = "FOOD_DES.txt"
     WEIGHT_FILE_NAME = "WEIGHT.txt"
+    # A gzipped SQLite database of the tables we'd get from the files
+    # above (see build_prebuilt).
+    PREBUILT_FILE_NAME = "nutrition.db.gz"
+    # The number of rows we hand our database at a time.
+    batch_size = 2000
 
     def __init__ (self,
                   db,
@@ -58,7 +89,7 @@ class DatabaseGrabber:
 
     def get_abbrev (self, filename=None):
         if filename:
-            afi = open(filename,'r')
+            afi = open(filename,'rb')
         else:
             afi = self.get_file_from_url(self.ABBREV_FILE_NAME)
         self.parse_abbrevfile(afi)
@@ -68,35 +99,112 @@ class DatabaseGrabber:
     def get_groups (self, filename=None):
         self.group_dict = {}
         if filename:
-            afi = open(filename,'r')
+            afi = open(filename,'rb')
         else:
             afi = self.get_file_from_url(self.DESC_FILE_NAME)
         self.foodgroups_by_ndbno = {}
-        for l in afi.readlines():
-            flds = l.split('^')
-            ndbno = int(flds[0].strip('~'))
-            grpno = int(flds[1].strip('~'))
+        for l in afi:
+            flds = l.split(b'^')
+            ndbno = int(flds[0].strip(b'~'))
+            grpno = int(flds[1].strip(b'~'))
             self.foodgroups_by_ndbno[ndbno] = grpno
+        afi.close()
 
     def get_weight (self, filename=None):
         if filename:
-            wfi = open(filename,'r')
+            wfi = open(filename,'rb')
         else:
             wfi = self.get_file_from_url(self.WEIGHT_FILE_NAME)
         self.parse_weightfile(wfi)
         wfi.close()
 
     def grab_data (self, directory=None):
+        """Load the USDA database from directory, or download it if
+        we're not handed a directory.
+
+        If directory has a prebuilt database, we copy our tables out
+        of it; otherwise we parse the USDA's text files. Either way,
+        we load everything in a single transaction.
+        """
         self.db.changed = True
-        self.get_groups((isinstance(directory,str)
-                         and
-                         os.path.join(directory,self.DESC_FILE_NAME)))
-        self.get_abbrev((isinstance(directory,str)
-                         and
-                         os.path.join(directory,self.ABBREV_FILE_NAME)))
-        self.get_weight((isinstance(directory,str)
-                         and
-                         os.path.join(directory,self.WEIGHT_FILE_NAME)))
+        if isinstance(directory,str):
+            prebuilt = os.path.join(directory,self.PREBUILT_FILE_NAME)
+            if os.path.exists(prebuilt) and self.db.url.startswith('sqlite'):
+                self.load_prebuilt(prebuilt)
+                return
+        self.db.begin_fast_adds()
+        try:
+            self.get_groups((isinstance(directory,str)
+                             and
+                             os.path.join(directory,self.DESC_FILE_NAME)))
+            self.get_abbrev((isinstance(directory,str)
+                             and
+                             os.path.join(directory,self.ABBREV_FILE_NAME)))
+            self.get_weight((isinstance(directory,str)
+                             and
+                             os.path.join(directory,self.WEIGHT_FILE_NAME)))
+        except:
+            self.db.get_fast_connection().rollback()
+            raise
+        self.db.commit_fast_adds()
+
+    def load_prebuilt (self, filename):
+        """Copy our tables out of filename, a gzipped SQLite database
+        made by build_prebuilt."""
+        if self.show_progress:
+            self.show_progress(float(0.03),_('Loading nutritional data...'))
+        tmp = tempfile.NamedTemporaryFile(suffix='.db',delete=False)
+        try:
+            with tmp, gzip.open(filename,'rb') as gfi:
+                shutil.copyfileobj(gfi,tmp)
+            conn = self.db.get_fast_connection()
+            # SQLite won't attach a database inside a transaction.
+            self.db.commit_fast_adds()
+            conn.execute('ATTACH DATABASE ? AS prebuilt',(tmp.name,))
+            try:
+                self.db.begin_fast_adds()
+                for table,verb,columns in [
+                    (self.db.nutrition_table,'INSERT OR REPLACE',NUTRITION_COLUMNS),
+                    (self.db.usda_weights_table,'INSERT',WEIGHT_COLUMNS),
+                    ]:
+                    columns = ', '.join(columns)
+                    conn.execute('%s INTO %s (%s) SELECT %s FROM prebuilt.%s'%(
+                        verb,table.name,columns,columns,table.name
+                        ))
+                    self.db._forget_cached(table)
+            except:
+                conn.rollback()
+                raise
+            else:
+                self.db.commit_fast_adds()
+            finally:
+                conn.execute('DETACH DATABASE prebuilt')
+        finally:
+            os.remove(tmp.name)
+
+    def read_lines (self, ifi, message):
+        """Iterate over the lines of ifi, one of the USDA's files,
+        showing our progress as we go.
+
+        message gets the number of lines we've read so far.
+        """
+        tot = os.fstat(ifi.fileno()).st_size
+        done = 0
+        for n,l in enumerate(ifi):
+            done += len(l)
+            if self.show_progress and n % 50 == 0:
+                self.show_progress(float(done)/tot,message%n)
+            yield l.decode('latin_1')
+
+    def add_rows (self, table, rows, replace=False):
+        """Add rows to table in batches of batch_size."""
+        batch = []
+        for d in rows:
+            batch.append(d)
+            if len(batch) >= self.batch_size:
+                self.db.do_add_many_fast(table,batch,replace=replace)
+                batch = []
+        self.db.do_add_many_fast(table,batch,replace=replace)
 
     def parse_line (self, line, field_defs, split_on='^'):
         """Handed a line and field definitions, return a dictionary of
@@ -140,82 +248,37 @@ class DatabaseGrabber:
                     if sname in d: del d[sname]
         return d
 
-    def parse_abbrevfile (self, abbrevfile):
-        if self.show_progress:
-            self.show_progress(float(0.03),_('Parsing nutritional data...'))
-        self.datafile = tempfile.TemporaryFile()
-        ll=abbrevfile.readlines()
-        tot=len(ll)
-        n = 0
-        for n,l in enumerate(ll):
-            l = str(l.decode('latin_1'))
-            tline=TimeAction('1 line iteration',2)
-            t=TimeAction('split fields',2)
+    def abbrev_rows (self, abbrevfile):
+        """Iterate over the rows of our nutrition table in abbrevfile."""
+        for l in self.read_lines(abbrevfile,_('Reading nutritional data: imported %s entries.')):
             d = self.parse_line(l,NUTRITION_FIELDS)
-            fields = l.split("^")
             d['desc']=expand_abbrevs(d['desc'])
             d['foodgroup']=FOOD_GROUPS[
                 self.foodgroups_by_ndbno[d['ndbno']]
                 ]
-            t.end()
-            if self.show_progress and n % 50 == 0:
-                self.show_progress(float(n)/tot,_('Reading nutritional data: imported %s of %s entries.')%(n,tot))
-            t = TimeAction('append to db',3)
-            try:
-                self.db.do_add_fast(self.db.nutrition_table,d)
-            except:
-                try:
-                    SQL = 'UPDATE ' + self.db.nutrition_table.name + ' SET '
-                    args = d.copy(); del args['ndbno']
-                    SQL += ', '.join('%s = ?'%k for k in args)
-                    SQL += ' WHERE ndbno = %s'%d['ndbno']
-                    #if d['ndbno']==1123:
-                    #    print SQL,args.values()
-                    self.db.extra_connection.execute(SQL,list(args.values()))
-                except:
-                    print('Error appending to nutrition_table',d)
-                    print('Tried modifying table -- that failed too!')
-                    raise
-            t.end()
-            tline.end()
-        self.db.commit_fast_adds()
+            yield d
 
-    def parse_weightfile (self, weightfile):
+    def parse_abbrevfile (self, abbrevfile):
         if self.show_progress:
-            self.show_progress(float(0.03),_('Parsing weight data...'))
-        ll=weightfile.readlines()
-        tot=len(ll)
-        n=0
-        for n,l in enumerate(ll):
-            l = str(l.decode('latin_1'))
-            if self.show_progress and n % 50 == 0:
-                self.show_progress(
-                    float(n)/tot,
-                    _('Reading weight data for nutritional items: imported %s of %s entries')%(n,tot)
-                    )
+            self.show_progress(float(0.03),_('Parsing nutritional data...'))
+        # Reloading the database updates the rows we already have.
+        self.add_rows(self.db.nutrition_table,self.abbrev_rows(abbrevfile),replace=True)
+
+    def weight_rows (self, weightfile):
+        """Iterate over the rows of our weights table in weightfile."""
+        for l in self.read_lines(weightfile,_('Reading weight data for nutritional items: imported %s entries')):
             d = self.parse_line(l,WEIGHT_FIELDS)
             if 'stdev' in d: del d['stdev']
-            try:
-                self.db.do_add_fast(self.db.usda_weights_table,d)
-            except:
-                print("Error appending ",d,"to usda_weights_table")
-                raise
-        self.db.commit_fast_adds()
+            yield d
 
+    def parse_weightfile (self, weightfile):
+        if self.show_progress:
+            self.show_progress(float(0.03),_('Parsing weight data...'))
+        self.add_rows(self.db.usda_weights_table,self.weight_rows(weightfile))
 
 
-if __name__ == '__main__':
-    tot_prog = 0
-    def show_prog (perc, msg):
-        perc = perc * 100
-        if perc - tot_prog: print("|" * int(perc - tot_prog))
-    print('getting our recipe database')
-    import gourmet.recipeManager
-    db = gourmet.recipeManager.RecipeManager(**gourmet.recipeManager.dbargs)
-    print('getting our grabber ready')
-    grabber = DatabaseGrabber(db,show_prog)
-    print('grabbing recipes!')
-    grabber.grab_data('/home/tom/Projects/grm/data/')
-    #grabber.parse_weightfile(open('/home/tom/Projects/grm/data/WEIGHT.txt','r'))
-    #grabber.get_weight('/home/tom/Projects/nutritional_data/WEIGHT.txt')
 
+if __name__ == '__main__':
+    # Rebuild the prebuilt database we ship from the USDA files we ship.
+    data_dir = os.path.join(os.path.dirname(__file__),'..','..','data')
+    build_prebuilt(data_dir,os.path.join(data_dir,DatabaseGrabber.PREBUILT_FILE_NAME))
@@ -0,0 +1,53 @@
+from gi.repository import Gtk
+import gourmet.plugin
+import gourmet.GourmetRecipeManager
+from gourmet.threadManager import get_thread_manager, get_thread_manager_gui
+from gettext import gettext as _
+from . import nutritionLinker
+
+class NutritionLinkerPlugin (gourmet.plugin.ToolPlugin):
+
+    # The NutritionLinker we've started, if any.
+    linker = None
+
+    menu_items = '''
+        <placeholder name="DataTool">
+        <menuitem action="LinkNutrition"/>
+        </placeholder>
+    '''
+
+    def setup_action_groups (self):
+        self.action_group = Gtk.ActionGroup(name='NutritionLinkerActionGroup')
+        self.action_group.add_actions([
+            ('LinkNutrition',None,_('Link Ingredients to _Nutritional Information'),
+             None,_('Look up nutritional information for all of your ingredients at once'),
+             self.link_cb)
+            ])
+        self.action_groups.append(self.action_group)
+
+    def link_cb (self, *args):
+        tmg = get_thread_manager_gui()
+        if self.linker and not self.linker.done:
+            # Two linkers would link the same keys twice; show the
+            # user the one we're running instead.
+            tmg.show()
+            return
+        app = gourmet.GourmetRecipeManager.get_application()
+        linker = self.linker = nutritionLinker.NutritionLinker(app.nd)
+        tm = get_thread_manager()
+        tm.add_thread(linker)
+        tmg.register_thread_with_dialog(_('Link ingredients to nutritional information'),linker)
+        linker.connect('completed',tmg.notification_thread_done,
+                       _('Ingredients linked to nutritional information'))
+        linker.connect('completed',self.review_cb,app)
+        tmg.show()
+
+    def review_cb (self, linker, app):
+        """Let the user review the ingredients we weren't sure of."""
+        if not linker.review_queue:
+            return
+        from . import nutritionDruid
+        druid = nutritionDruid.NutritionInfoDruid(app.nd,app.prefs,
+                                                  in_string=_('ingredients to review'))
+        druid.review_links(linker.review_queue)
+        druid.show()
@@ -1,7 +1,16 @@
 import re, string
 import sys
+import math
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+from gourmet.defaults import lang as defaults
 from .parser_data import SUMMABLE_FIELDS
 
+# Where each of SUMMABLE_FIELDS is in a nutrient vector (see
+# NutritionInfo._get_vector).
+SUMMABLE_INDEX = dict((f,n) for n,f in enumerate(SUMMABLE_FIELDS))
+
 # Our basic module for interaction with our nutritional information DB
 
 class NutritionData:
@@ -10,6 +19,13 @@ class NutritionData:
 
     We provide methods to set up equivalences between our
     ingredient-keys and our nutritional data.
+
+    Looking up the nutritional information for an ingredient goes
+    through the same few rows again and again, so we keep what we look
+    up for the session: the alias row for each ingredient key, the
+    nutrition row and gram weights for each ndbno, and so on. Our set_*
+    methods keep these up to date; if anything else changes our
+    tables, call clear_cache.
     """
 
     def __init__ (self, db, conv):
@@ -18,10 +34,22 @@ class NutritionData:
         self.conv.density_table
         self.gramwght_regexp = re.compile("([0-9.]+)?( ?([^,]+))?(, (.*))?")
         self.wght_breaker = re.compile(r'([^ ,]+)([, ]+\(?(.*)\)?)?$')
+        self.clear_cache()
+
+    def clear_cache (self):
+        """Forget everything we've looked up in our tables."""
+        self._alias_cache = {} # ingkey -> nutritionaliases row (or None)
+        self._desc_cache = {} # ingkey -> NutritionInfo matching it by description (or None)
+        self._row_cache = {} # ndbno -> nutrition row
+        self._gramweight_cache = {} # ndbno -> get_gramweights dictionary
+        self._conversions_cache = {} # ndbno -> (densities, units)
+        self._custom_conversions_cache = {} # ingkey -> nutritionconversions rows
+        self._index = None # NutritionIndex of our descriptions
 
     def set_key (self, key, row):
         """Create an automatic equivalence for ingredient key 'key' and nutritional DB row ROW
         """
+        self._alias_cache.pop(key,None)
         if not row: row = self._get_key(key)
         #density=self.get_density(key,row)
         if row: self.row.ndbno=row.ndbno
@@ -31,6 +59,7 @@ class NutritionData:
                             'ingkey':key})
 
     def set_density_for_key (self, key, density_equivalent):
+        self._alias_cache.pop(key,None)
         self.db.update_by_criteria(
             self.db.nutritionaliases_table,
             {'ingkey':key},
@@ -42,6 +71,7 @@ class NutritionData:
         ndbno is our nutritional database number."""
         if not isinstance(ndbno, int):
             ndbno = int(ndbno)
+        self._alias_cache.pop(key,None)
         prev_association = self.db.fetch_one(self.db.nutritionaliases_table,ingkey=key)
         if prev_association:
             self.db.do_modify(self.db.nutritionaliases_table,
@@ -60,6 +90,7 @@ class NutritionData:
         """
         if unit in self.conv.unit_dict:
             unit = self.conv.unit_dict[unit]
+        self._custom_conversions_cache.pop(key,None)
         prev_entry = self.db.fetch_one(self.db.nutritionconversions_table,
                                        **{'ingkey':key,'unit':unit})
         if prev_entry:
@@ -69,6 +100,13 @@ class NutritionData:
         else:
             self.db.do_add(self.db.nutritionconversions_table,{'ingkey':key,'unit':unit,'factor':factor})
 
+    def get_index (self):
+        """Get the NutritionIndex of our nutrition table's
+        descriptions, building it the first time we're asked."""
+        if self._index is None:
+            self._index = NutritionIndex(self.db.fetch_all(self.db.nutrition_table))
+        return self._index
+
     def get_matches (self, key, max=50):
         """Handed a string, get a list of likely USDA database matches.
 
@@ -78,23 +116,84 @@ class NutritionData:
         If max is not none, we cut our list off at max items (and hope our
         sorting algorithm succeeded in picking out the good matches!).
         """
-        words=re.split(r"\W",key)
-        words = [w for w in words if w and not w in ['in','or','and','with']]
-        #words += ['raw']
-        result =  self.db.search_nutrition(words)
-        while not result and len(words)>1:
-            words = words[:-1]
-            result = self.db.search_nutrition(words)
-        if result:
-            return [(r.desc,r.ndbno) for r in result]
-        else:
-            return []
+        index = self.get_index()
+        return [(index.descs[ndbno],ndbno) for ndbno in index.search(key,max)]
+
+    def get_matches_for_keys (self, keys=None, max=50):
+        """Get likely USDA database matches for each of keys, as
+        with get_matches.
+
+        If keys is None, we match every ingredient key that doesn't
+        have a nutritional equivalent yet.
+
+        We return a dictionary: {key : [[description, ndbno],...],...}
+        """
+        if keys is None:
+            keys = self.get_unlinked_keys()
+        return dict((k,self.get_matches(k,max)) for k in keys)
+
+    def get_unlinked_keys (self):
+        """Get the ingredient keys that don't have a nutritional
+        equivalent yet, most used first."""
+        linked = set(a.ingkey for a in self.db.fetch_all(self.db.nutritionaliases_table))
+        counts = sorted(self.db.get_ingkeys_with_count(),key=lambda r: -r[0])
+        return [k for count,k in counts if k and k not in linked]
+
+    def set_keys_from_ndbnos (self, links):
+        """Link many ingredient keys to our nutritional database at
+        once.
+
+        links is a list of (key, ndbno) for keys that didn't have an
+        equivalent when we looked. We add all of them in a single
+        transaction, on a connection of the thread we're called from
+        (see RecData.get_fast_connection), so a NutritionLinker can
+        call us from its own thread. Keys that have been linked since
+        (by the user, say) keep the links they have.
+        """
+        for key,ndbno in links:
+            self._alias_cache.pop(key,None)
+        try:
+            if self.db.begin_fast_adds():
+                # Our transaction holds the write lock, so nobody can
+                # link keys between our looking and our adding.
+                linked = set(r[0] for r in self.db.get_fast_connection().execute(
+                    'SELECT ingkey FROM %s'%self.db.nutritionaliases_table.name))
+            else:
+                linked = set(a.ingkey for a in self.db.fetch_all(self.db.nutritionaliases_table))
+            new_links = []
+            for key,ndbno in links:
+                if key not in linked:
+                    linked.add(key)
+                    new_links.append({'ingkey':key,'ndbno':int(ndbno)})
+            self.db.do_add_many_fast(self.db.nutritionaliases_table,new_links)
+        except:
+            self.db.get_fast_connection().rollback()
+            raise
+        self.db.commit_fast_adds()
 
     def _get_key (self, key):
         """Handed an ingredient key, get our nutritional Database equivalent
         if one exists."""
-        row=self.db.fetch_one(self.db.nutritionaliases_table,**{'ingkey':str(key)})
-        return row
+        key = str(key)
+        if key not in self._alias_cache:
+            self._alias_cache[key] = self.db.fetch_one(self.db.nutritionaliases_table,
+                                                       **{'ingkey':key})
+        return self._alias_cache[key]
+
+    def _get_row (self, ndbno):
+        """Get the row of our nutritional database numbered ndbno."""
+        if ndbno not in self._row_cache:
+            self._row_cache[ndbno] = self.db.fetch_one(self.db.nutrition_table,
+                                                       **{'ndbno':ndbno})
+        return self._row_cache[ndbno]
+
+    def _get_custom_conversions (self, key):
+        """Get the rows of our custom conversion table for ingredient key."""
+        if key not in self._custom_conversions_cache:
+            self._custom_conversions_cache[key] = self.db.fetch_all(
+                self.db.nutritionconversions_table,ingkey=key
+                )
+        return self._custom_conversions_cache[key]
 
     def get_nutinfo_for_ing (self, ing, rd, multiplier=None):
         """A convenience function that grabs the requisite items from
@@ -157,11 +256,13 @@ class NutritionData:
         """
         aliasrow = self._get_key(key)
         if aliasrow:
-            nvrow=self.db.fetch_one(self.db.nutrition_table,**{'ndbno':aliasrow.ndbno})
+            nvrow=self._get_row(aliasrow.ndbno)
             if nvrow: return NutritionInfo(nvrow)
         else:
             # See if the key happens to match an existing description...
-            ni = self.get_nutinfo_from_desc(key)
+            if key not in self._desc_cache:
+                self._desc_cache[key] = self.get_nutinfo_from_desc(key)
+            ni = self._desc_cache[key]
             # if we don't have a nutritional db row, return a
             # NutritionVapor instance which remembers our query and allows
             # us to redo it.  The idea here is that our callers will get
@@ -230,13 +331,14 @@ class NutritionData:
                 unit = self.conv.unit_dict[unit]
             elif not unit:
                 unit = ''
-            lookup = self.db.fetch_one(self.db.nutritionconversions_table,ingkey=key,unit=unit)
+            custom_conversions = self._get_custom_conversions(key)
+            lookup = [conv for conv in custom_conversions if conv.unit == unit]
             if lookup:
-                cnv = lookup.factor
+                cnv = lookup[0].factor
             else:
                 # otherwise, cycle through any units we have and see
                 # if we can get a conversion via those units...
-                for conv in self.db.fetch_all(self.db.nutritionconversions_table,ingkey=key):
+                for conv in custom_conversions:
                     factor = self.conv.converter(unit,conv.unit)
                     if factor:
                         cnv = conv.factor*factor
@@ -254,6 +356,8 @@ class NutritionData:
           )"""
         if not row: row=self.get_nutinfo(key)
         if not row: return {},{}
+        if row.ndbno in self._conversions_cache:
+            return self._conversions_cache[row.ndbno]
         units = {}
         densities = {}
         for gd,gw in list(self.get_gramweights(row).items()):
@@ -272,6 +376,7 @@ class NutritionData:
             else:
                 gw = float(gw)
             if u: units[u]=gw
+        self._conversions_cache[row.ndbno] = densities,units
         return densities,units
 
     def get_densities (self,key=None,row=None):
@@ -281,22 +386,15 @@ class NutritionData:
         if key in self.conv.density_table:
             return {'':self.conv.density_table[key]}
         else:
-            densities = {}
-            for gd,gw in list(self.get_gramweights(row).items()):
-                a,u,e = gd
-                if not a:
-                    continue
-                convfactor=self.conv.converter(u,'ml')
-                if convfactor: # if we are a volume
-                    # divide mass by volume converted to milileters
-                    # (gramwts are in grams)
-                    density = float(gw) / (a * convfactor)
-                    densities[e]=density
-            return densities
+            # Our densities are the same as get_conversions'; we
+            # return a copy, which our caller may change.
+            return dict(self.get_conversions(key,row)[0])
 
     def get_gramweights (self,row):
         """Return a dictionary with gram weights.
         """
+        if row.ndbno in self._gramweight_cache:
+            return self._gramweight_cache[row.ndbno]
         ret = {}
         nutweights = self.db.fetch_all(self.db.usda_weights_table,**{'ndbno':row.ndbno})
         for nw in nutweights:
@@ -308,6 +406,7 @@ class NutritionData:
                 unit = mtch.groups()[0]
                 extra = mtch.groups()[2]
             ret[(nw.amount,unit,extra)]=nw.gramwt
+        self._gramweight_cache[row.ndbno] = ret
         return ret
 
     def get_density (self,key=None,row=None, fudge=True):
@@ -341,7 +440,142 @@ class NutritionData:
         """Add custom nutritional information."""
         #new_ndbno = self.db.increment_field(self.db.nutrition_table,'ndbno')
         #if new_ndbno: nutrition_dictionary['ndbno']=new_ndbno
-        return self.db.do_add_nutrition(nutrition_dictionary).ndbno
+        # Our new row may match descriptions that didn't match before.
+        self._desc_cache = {}
+        ndbno = self.db.do_add_nutrition(nutrition_dictionary).ndbno
+        if self._index is not None:
+            self._index.add(ndbno,nutrition_dictionary.get('desc',''))
+        return ndbno
+
+
+class NutritionIndex:
+    """An index of the words in the descriptions of our nutrition
+    table, for finding the rows that best match an ingredient.
+
+    We look up each word of a search along with its singular forms,
+    and if none of those are in any description, any word that
+    starts with it (so "chick" finds "chicken"). Rows matching
+    more of our words come first, then rows matching rarer words.
+    USDA descriptions start with the food ("TEA,BLACK,BREWED"), so
+    a word counts double when it matches the first word of a
+    description.
+    """
+
+    IGNORE = ['in','or','and','with','of','for']
+    # How much less a word counts for when it only matches the start
+    # of the words in a description.
+    prefix_weight = 0.5
+
+    def __init__ (self, rows):
+        self.descs = {} # ndbno -> description
+        self.lengths = {} # ndbno -> number of words in description
+        self.postings = defaultdict(set) # word -> ndbnos
+        self.heads = defaultdict(set) # word -> ndbnos whose descriptions start with it
+        for row in rows:
+            self.add(row.ndbno,row.desc)
+
+    def add (self, ndbno, desc):
+        """Add the row numbered ndbno, with description desc."""
+        words = self.split(desc)
+        self.descs[ndbno] = desc
+        self.lengths[ndbno] = len(words)
+        for n,w in enumerate(words):
+            for form in self.get_forms(w):
+                self.postings[form].add(ndbno)
+                if n == 0: self.heads[form].add(ndbno)
+        # Our vocabulary and word frequencies have changed.
+        self.vocabulary = None
+        self._lookup_cache = {}
+
+    def split (self, txt):
+        """Split txt into the words we index."""
+        return [w for w in re.split(r'\W+',(txt or '').lower())
+                if w and w not in self.IGNORE]
+
+    def get_forms (self, word):
+        return [word] + [s for s in defaults.guess_singulars(word) if s != word]
+
+    def lookup (self, word):
+        """Return the ndbnos of the rows that match word, those
+        whose descriptions start with it, how much a match counts for
+        and whether we matched whole words (rather than prefixes)."""
+        if word in self._lookup_cache:
+            return self._lookup_cache[word]
+        forms = self.get_forms(word)
+        weight = 1
+        exact = any(f in self.postings for f in forms)
+        if not exact and len(word) > 2:
+            if self.vocabulary is None:
+                self.vocabulary = sorted(self.postings)
+            i = bisect_left(self.vocabulary,word)
+            forms = []
+            while i < len(self.vocabulary) and self.vocabulary[i].startswith(word):
+                forms.append(self.vocabulary[i])
+                i += 1
+            weight = self.prefix_weight
+        ndbnos = set(); heads = set()
+        for form in forms:
+            ndbnos.update(self.postings.get(form,()))
+            heads.update(self.heads.get(form,()))
+        if ndbnos:
+            # Rare words tell us more than common ones (IDF).
+            weight *= math.log(1 + float(len(self.descs))/len(ndbnos))
+        self._lookup_cache[word] = ndbnos,heads,weight,exact
+        return ndbnos,heads,weight,exact
+
+    def search (self, txt, limit=None):
+        """Return the ndbnos of the rows that best match txt, best
+        first.
+
+        We only return rows that match as many of the words of txt as
+        any row does. If limit is not None, we return at most limit
+        rows.
+        """
+        return [n for n,score in self.rank(txt)[:limit]]
+
+    def rank (self, txt):
+        """Return [(ndbno, score),...] for the rows search returns."""
+        scores = defaultdict(float)
+        counts = defaultdict(int)
+        for w in set(self.split(txt)):
+            ndbnos,heads,weight,exact = self.lookup(w)
+            for n in ndbnos:
+                scores[n] += weight
+                counts[n] += 1
+            for n in heads:
+                scores[n] += weight
+        if not counts:
+            return []
+        most = max(counts.values())
+        ndbnos = [n for n,c in counts.items() if c == most]
+        # Of rows that match as well, the shortest descriptions are
+        # usually the plainest foods ("CARROTS,RAW").
+        ndbnos.sort(key=lambda n: (-scores[n],self.lengths[n],self.descs[n]))
+        return [(n,scores[n]) for n in ndbnos]
+
+    def best_match (self, txt):
+        """Return the ndbno of the row that matches txt, if we're
+        confident enough to link txt to it without asking, or None.
+
+        We're confident when the best row matches every word of txt
+        as a whole word, one of them is the food it describes (its
+        first word), and it beats the next best row, if only by being
+        a shorter description.
+        """
+        ranked = self.rank(txt)
+        if not ranked:
+            return None
+        best,score = ranked[0]
+        lookups = [self.lookup(w) for w in set(self.split(txt))]
+        if not all(exact and best in ndbnos for ndbnos,heads,weight,exact in lookups):
+            return None
+        if not any(best in heads for ndbnos,heads,weight,exact in lookups):
+            return None
+        if len(ranked) > 1:
+            second,second_score = ranked[1]
+            if second_score == score and self.lengths[second] == self.lengths[best]:
+                return None
+        return best
 
 
 class NutritionInfo:
@@ -375,37 +609,49 @@ class NutritionInfo:
     Non numeric properties return a somewhat not-useful string:
 
     (Carrot + Eggplant).desc => 'CARROTS,RAW, EGGPLANT,RAW'
+
+    We read our row's numeric properties once, into a vector (an
+    array with a value for each of SUMMABLE_FIELDS), so multiplying
+    and adding never goes back to the database.
     """
-    def __init__ (self,rowref, mult=1, fudged=False, ingObject=None):
+    def __init__ (self,rowref, mult=1, fudged=False, ingObject=None,
+                  vector=None):
         self.__rowref__ = rowref
         self.__mult__ = mult
         self.__fudged__ = fudged
         self.__ingobject__ = ingObject
+        self.__vector__ = vector
 
     def __getattr__ (self, attr):
         if attr[0]!='_':
-            ret = getattr(self.__rowref__, attr)
-            try:
-                if attr in SUMMABLE_FIELDS:
-                    return (ret or 0) * self.__mult__
-                else:
-                    return ret
-            except:
-                raise
+            n = SUMMABLE_INDEX.get(attr)
+            if n is not None:
+                return self._get_vector()[n] * self.__mult__
+            else:
+                return getattr(self.__rowref__, attr)
         else:
             # somehow this magically gets us standard
             # attribute handling...
             raise AttributeError(attr)
 
+    def _get_vector (self):
+        """Return our row's values for SUMMABLE_FIELDS (not
+        multiplied by our multiplier)."""
+        if self.__vector__ is None:
+            self.__vector__ = array('d',[getattr(self.__rowref__,f) or 0
+                                         for f in SUMMABLE_FIELDS])
+        return self.__vector__
+
     def __add__ (self, obj):
-        if isinstance(obj,NutritionInfo):
-            return NutritionInfoList([self,obj])
-        elif isinstance(obj,NutritionInfoList):
+        if isinstance(obj,NutritionInfoList):
             return NutritionInfoList([self]+obj.__nutinfos__)
+        elif isinstance(obj,NutritionInfo):
+            return NutritionInfoList([self,obj])
 
     def __mul__ (self, n):
         return NutritionInfo(self.__rowref__, mult=self.__mult__ * n,
-                             fudged=self.__fudged__,ingObject=self.__ingobject__)
+                             fudged=self.__fudged__,ingObject=self.__ingobject__,
+                             vector=self.__vector__)
 
 KEY_VAPOR = 0 # when we don't have a key
 UNIT_VAPOR = 1 # when we can't interpret the unit
@@ -434,6 +680,7 @@ class NutritionVapor (NutritionInfo):
         self.__amt__ = amount
         self.__unit__ = unit
         self.__ingobject__ = ingObject
+        self.__vector__ = None
 
     def _reset (self):
         """Try to create matter from vapor and return it.
@@ -492,6 +739,12 @@ class NutritionInfoList (list, NutritionInfo):
     """A summable list of objects.
 
     When we ask for numeric attributes of our members, we get the sum.
+
+    We work out all of our sums at once, the first time we're asked
+    for one: each member's vector times its multiplier, added up
+    (vapor has no vector, and adds nothing). Lists within our list
+    keep their own sums, which we add to ours every time we're asked,
+    since they can change under us (see _reset).
     """
     def __init__ (self,nutinfos, mult=1,ingObject=None):
         self.__nutinfos__ = nutinfos
@@ -499,27 +752,53 @@ class NutritionInfoList (list, NutritionInfo):
         #self.__getitem__ = self.__nutinfos__.__getitem__
         self.__mult__ = 1
         self.__ingobject__ = ingObject
+        self.__vector__ = None
 
     def __getattr__ (self, attr):
         if attr[0]!='_':
-            alist = [getattr(ni,attr) for ni in self.__nutinfos__]
-            if attr in SUMMABLE_FIELDS:
-                if self.__mult__: alist = [n * self.__mult__ for n in alist]
-                return sum(alist)
+            n = SUMMABLE_INDEX.get(attr)
+            if n is not None:
+                return self._get_vector()[n] * self.__mult__
             else:
+                alist = [getattr(ni,attr) for ni in self.__nutinfos__]
                 return ", ".join(map(str,alist))
         else:
             # somehow this magically gets us standard
             # attribute handling...
             raise AttributeError(attr)
 
+    def _get_vector (self):
+        """Return the sums of our members' SUMMABLE_FIELDS."""
+        if self.__vector__ is None:
+            # We cache the sums of our other members, but not of the
+            # lists among them.
+            rows = [(ni.__mult__ or 0,ni._get_vector()) for ni in self.__nutinfos__
+                    if not isinstance(ni,(NutritionVapor,NutritionInfoList))]
+            self.__vector__ = array('d',[0]*len(SUMMABLE_FIELDS))
+            for mult,vector in rows:
+                if mult:
+                    for n,v in enumerate(vector):
+                        self.__vector__[n] += mult * v
+        lists = [ni for ni in self.__nutinfos__ if isinstance(ni,NutritionInfoList)]
+        if not lists:
+            return self.__vector__
+        sums = array('d',self.__vector__)
+        for ni in lists:
+            for n,v in enumerate(ni._get_vector()):
+                sums[n] += ni.__mult__ * v
+        return sums
+
     def _reset (self):
-        """See if we can turn any of our vapor into matter."""
+        """See if we can turn any of our vapor (or the vapor of lists
+        within our list) into matter."""
         for i in range(len(self.__nutinfos__)):
             obj = self.__nutinfos__[i]
             if isinstance(obj,NutritionVapor):
                 # try resetting
                 self.__nutinfos__[i]=obj._reset()
+                self.__vector__ = None
+            elif isinstance(obj,NutritionInfoList):
+                obj._reset()
 
     def _get_vapor (self):
         """Return a list of nutritionVapor if there is any
@@ -543,10 +822,10 @@ class NutritionInfoList (list, NutritionInfo):
         return ret
 
     def __add__ (self, obj):
-        if isinstance(obj,NutritionInfo):
-            return NutritionInfoList(self.__nutinfos__ + [obj])
-        elif isinstance(obj,NutritionInfoList):
+        if isinstance(obj,NutritionInfoList):
             return NutritionInfoList(self.__nutinfos__ + obj.__nutinfos__)
+        elif isinstance(obj,NutritionInfo):
+            return NutritionInfoList(self.__nutinfos__ + [obj])
 
     def __sub__ (self, obj):
         copy = self.__nutinfos__[0:]
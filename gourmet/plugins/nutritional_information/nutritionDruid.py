@@ -273,6 +273,7 @@ class NutritionInfoDruid (GObject.GObject):
         self.def_ingredient_amounts = {} # For default amounts for nutritional label...
         self.amounts = {} # List amounts by ingredient
         self.ing_to_index = {} # A way to keep track of the order of our ingredients...
+        self.suggestions = {} # Descriptions to search for, by ingredient key
         self._setup_widgets_()
         # keep track of pages/setups we've been on
         self.path = []
@@ -732,7 +733,7 @@ class NutritionInfoDruid (GObject.GObject):
         We're pretty smart about this: in other words, we won't do a
         search that doesn't have results.
         """
-        self.usdaIndex.set_search(self.ingkey)
+        self.usdaIndex.set_search(self.suggestions.get(self.ingkey,self.ingkey))
 
     def apply_nut_equivalent (self,*args):
         nut = self.usdaIndex.get_selected_usda_item()
@@ -882,6 +883,10 @@ class NutritionInfoDruid (GObject.GObject):
         amount can be a float or None
         unit can be a string or None
 
+        The list of amounts and units can also be None, in which case
+        we look up the amounts in our database once we get to the
+        ingredient.
+
         For each item in the list, we will ask the user to select a
         USDA equivalent.
 
@@ -905,6 +910,20 @@ class NutritionInfoDruid (GObject.GObject):
         self.ing_index = 0
         self.setup_next_ing()
 
+    def review_links (self, review_queue):
+        """Walk the user through linking the ingredients on
+        review_queue, as left by a NutritionLinker.
+
+        review_queue is a list of ingredient keys and their likely
+        USDA matches: [(ingkey, [(description, ndbno),...]),...]. We
+        start each search from the best match. Review queues can be
+        long, so we look up each ingredient's amounts only once the
+        user gets to it.
+        """
+        for ingkey,matches in review_queue:
+            self.suggestions[ingkey] = matches[0][0]
+        self.add_ingredients([(ingkey,None) for ingkey,matches in review_queue])
+
     def setup_next_ing (self):
         """Move to next ingredient."""
         if self.ing_index >= len(self.inglist):
@@ -915,6 +934,10 @@ class NutritionInfoDruid (GObject.GObject):
         if not ing:
             return
         ingkey,amounts = ing
+        if amounts is None:
+            amounts = self.get_amounts_and_units_for_ingkey(ingkey)
+            if amounts:
+                self.def_ingredient_amounts.setdefault(ingkey,amounts[0])
         self.ing_to_index[ingkey] = self.ing_index
         self.amounts[ingkey] = amounts
         self.amount_index = 0
@@ -0,0 +1,61 @@
+import time
+from gettext import gettext as _
+from gourmet.threadManager import SuspendableThread
+
+class NutritionLinker (SuspendableThread):
+
+    """Link ingredient keys to our nutritional database in the
+    background.
+
+    We match every ingredient key that has no nutritional equivalent
+    against the NutritionIndex of our nutritional database. Where
+    we're confident of the best match (see NutritionIndex.best_match),
+    we link the key to it ourselves, adding all of our links in a
+    single transaction at the end. Keys we're not sure of go on
+    review_queue, most used first, with their likely matches, for the
+    user to page through in the nutrition druid.
+
+    If we're stopped, we don't link anything.
+    """
+
+    # How many likely matches we keep for keys we're not sure of.
+    max_suggestions = 10
+
+    def __init__ (self, nd, keys=None, name=_('Link ingredients to nutritional information')):
+        """nd is our NutritionData. keys is a list of ingredient keys
+        to link; by default, we link every key that isn't linked yet.
+        """
+        self.nd = nd
+        self.keys = keys
+        self.links = [] # [(ingkey, ndbno),...]
+        self.review_queue = [] # [(ingkey, [(description, ndbno),...]),...]
+        SuspendableThread.__init__(self,name=name)
+
+    def do_run (self):
+        self.emit('progress',0,_('Finding ingredients to link...'))
+        keys = self.keys
+        if keys is None:
+            keys = self.nd.get_unlinked_keys()
+        index = self.nd.get_index()
+        tot = len(keys)
+        start = time.time()
+        for n,key in enumerate(keys):
+            self.check_for_sleep()
+            ndbno = index.best_match(key)
+            if ndbno is not None:
+                self.links.append((key,ndbno))
+            else:
+                matches = self.nd.get_matches(key,self.max_suggestions)
+                if matches:
+                    self.review_queue.append((key,matches))
+            if n % 100 == 0:
+                self.emit('progress',float(n)/tot,
+                          _('Matched %(n)s of %(total)s ingredients (%(rate)d per second).')%{
+                              'n':n,'total':tot,'rate':n/max(time.time()-start,0.001)
+                              })
+        self.check_for_sleep()
+        self.nd.set_keys_from_ndbnos(self.links)
+        self.emit('progress',1,
+                  _('Linked %(linked)s of %(total)s ingredients; %(review)s left to review.')%{
+                      'linked':len(self.links),'total':tot,'review':len(self.review_queue)
+                      })
@@ -3,6 +3,7 @@ from gi.repository import Gtk
 import gourmet.recipeManager, gourmet.GourmetRecipeManager
 from gourmet.prefs import Prefs
 from .nutritionLabel import NutritionLabel
+from .nutrition import NutritionInfoList
 import os.path
 from gettext import gettext as _
 
@@ -43,24 +44,17 @@ class ShoppingNutritionalInfoPlugin (ShoppingListPlugin):
         rg = gourmet.GourmetRecipeManager.get_application()
         if not hasattr(self,'nutrition_window'):
             self.create_nutrition_window()
-        nutinfo = None
+        # We gather everything into one list, rather than adding
+        # lists together one at a time.
+        nutinfos = []
         # Add recipes...
         for rec in rr:
-            ings = rd.get_ings(rec)
-            ni = rd.nd.get_nutinfo_for_inglist(rd.get_ings(rec),
-                                               rd)
-            if nutinfo:
-                nutinfo = nutinfo + ni
-            else:
-                nutinfo = ni
+            nutinfos.append(rd.nd.get_nutinfo_for_inglist(rd.get_ings(rec),
+                                                          rd))
         # Add extras...
         for amt,unit,item in sg.extras:
-            ni = rd.nd.get_nutinfo_for_item(item,amt,unit)
-            if nutinfo:
-                nutinfo = nutinfo + ni
-            else:
-                nutinfo = ni
-        self.nl.set_nutinfo(nutinfo)
+            nutinfos.append(rd.nd.get_nutinfo_for_item(item,amt,unit))
+        self.nl.set_nutinfo(NutritionInfoList(nutinfos))
         self.nutrition_window.present()
 
     def create_nutrition_window (self):
@@ -1,5 +1,5 @@
 from gettext import gettext as _
-from django.http import HttpResponse, HttpResponseRedirect
+from django.http import HttpResponse, HttpResponseRedirect, Http404
 from django import forms
 from django.shortcuts import render_to_response
 import sys
@@ -39,6 +39,8 @@ class SearchForm (forms.Form):
                                      )
 
 rd = gourmet.backends.db.get_database()
+# Our lists only need thumbnails; full images are served by img().
+list_columns = rd.get_recipe_columns(exclude=['image'])
 
 class MyShoppingList (gourmet.shopping.ShoppingList):
 
@@ -61,10 +63,11 @@ def list_recs (view, default_search_values={},
         )
 
 def index (request):
-    return list_recs(rd.fetch_all(rd.recipe_table,deleted=False))
+    return list_recs(rd.fetch_all(rd.recipe_table,deleted=False,columns=list_columns))
 
 def sort (request, field):
-    return list_recs(rd.fetch_all(rd.recipe_table,deleted=False,sort_by=[(field,1)]))
+    return list_recs(rd.fetch_all(rd.recipe_table,deleted=False,sort_by=[(field,1)],
+                                  columns=list_columns))
 
 def do_search_xhr (request):
     if request.method == 'POST':
@@ -96,7 +99,8 @@ def search (request, term, template='index.html'):
           'operator':'LIKE',
           'search':'%'+term.replace('%','%%'+'%')+'%',
           }
-         ]
+         ],
+        columns=list_columns
         )
     print('We got ',len(vw),'for "%s"'%term)
     return list_recs(vw, default_search_values={
@@ -223,11 +227,17 @@ def shop_to_list (request):
 
 
 def thumb (request, rec_id):
-    return HttpResponse(rd.get_rec(rec_id).thumb,
+    thumb = rd.get_image(int(rec_id),'thumb')
+    if not thumb: raise Http404
+    return HttpResponse(thumb,
                         content_type = 'image/jpeg'
                         )
 
 def img (request, rec_id):
-    return HttpResponse(rd.get_rec(rec_id).image,
+    # Full size images live in our image store, under the hash the
+    # recipe table keeps for them.
+    image = rd.load_image(rd.get_image_hash(int(rec_id)))
+    if not image: raise Http404
+    return HttpResponse(image,
                         content_type = 'image/jpeg'
                         )
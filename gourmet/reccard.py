@@ -496,7 +496,7 @@ class RecCardDisplay (plugin_loader.Pluggable):
                     widgLab.hide()
 
     def update_image (self):
-        imagestring = self.current_rec.image
+        imagestring = self.rg.rd.get_image(self.current_rec)
         if imagestring is None:
             self.orig_pixbuf = None
             self.imageDisplay.hide()
@@ -1466,9 +1466,10 @@ class ImageBox: # used in DescriptionEditor for recipe image.
         debug("get_image (self, rec=None):",5)
         if not rec:
             rec=self.rc.current_rec
-        if rec.image:
+        image = self.rg.rd.get_image(rec)
+        if image:
             try:
-                self.set_from_string(rec.image)
+                self.set_from_string(image)
             except:
                 print('Problem with image from recipe.')
                 print('Moving ahead anyway.')
@@ -1480,7 +1481,7 @@ class ImageBox: # used in DescriptionEditor for recipe image.
                 try:
                     dumpto = os.path.join(tempfile.tempdir,'bad_image.jpg')
                     with open(dumpto, 'wb') as ofi:
-                        ofi.write(rec.image)
+                        ofi.write(image)
                 except:
                     print('Nevermind -- I had a problem dumping the file.')
                     traceback.print_exc()
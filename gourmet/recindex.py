@@ -9,7 +9,7 @@ from .gdebug import debug
 from .gglobals import REC_ATTRS, INT_REC_ATTRS, DEFAULT_HIDDEN_COLUMNS
 from .gtk_extras import WidgetSaver, ratingWidget, cb_extras as cb, \
     mnemonic_manager, pageable_store, treeview_extras as te
-from .image_utils import bytes_to_pixbuf
+from .image_utils import LIST_THUMBSIZE
 from .prefs import Prefs
 from . import Undo
 
@@ -204,8 +204,10 @@ class RecIndex:
         self.searches = self.default_searches[0:]
         self.sort_by = []
         # List of entries in the `recipe` database table
-        self.rvw: List['RowProxy'] = self.rd.search_recipes(self.searches,
-                                                            sort_by=self.sort_by)
+        self.rvw: List['RowProxy'] = self.rd.search_recipes(
+            self.searches,
+            sort_by=self.sort_by,
+            columns=self.rd.get_recipe_columns())
 
     def make_rec_visible (self, *args):
         """Make sure recipe REC shows up in our index."""
@@ -475,15 +477,18 @@ class RecIndex:
             self.last_search = srch.copy()
             self.update_rmodel(self.rd.search_recipes(
                 self.searches + [srch],
-                sort_by=self.sort_by)
+                sort_by=self.sort_by,
+                columns=self.rd.get_recipe_columns())
                                )
         elif self.searches:
             self.update_rmodel(self.rd.search_recipes(
                 self.searches,
-                sort_by=self.sort_by)
+                sort_by=self.sort_by,
+                columns=self.rd.get_recipe_columns())
                                )
         else:
-            self.update_rmodel(self.rd.fetch_all(self.recipe_table,deleted=False,sort_by=self.sort_by))
+            self.update_rmodel(self.rd.fetch_all(self.recipe_table,deleted=False,sort_by=self.sort_by,
+                                                 columns=self.rd.get_recipe_columns()))
 
     def limit_search (self, *args):
         debug("limit_search (self, *args):",5)
@@ -668,6 +673,7 @@ class RecipeModel (pageable_store.PageableViewStore):
 
     def __init__ (self, vw, rd, per_page=None):
         self.rd = rd
+        self.prefetched_ids = []
         pageable_store.PageableViewStore.__init__(self,
                                                   vw,
                                                   columns=self.columns,
@@ -677,12 +683,25 @@ class RecipeModel (pageable_store.PageableViewStore):
 
     def _get_slice_ (self,bottom,top):
         try:
-            return [[self._get_value_(r,col) for col in self.columns] for r in self.view[bottom:top]]
+            rows = self.view[bottom:top]
+            # Load the categories for the whole page in one go rather
+            # than one query per row, and let go of the last page's.
+            self.rd.clear_prefetched(self.prefetched_ids)
+            self.prefetched_ids = self.rd.prefetch(rows,with_ings=False)
+            # Our rows come without images, so we grab thumbnails
+            # for just the rows we're showing that aren't cached yet.
+            thumbs = self.rd.fetch_images(
+                [r.id for r in rows
+                 if (r.id,r.image_hash,LIST_THUMBSIZE) not in self.rd.thumbnail_cache],
+                'thumb')
+            return [[self._get_value_(r,col,thumbs) for col in self.columns] for r in rows]
         except:
             print('_get_slice_ failed with',bottom,top)
             raise
 
-    def _get_value_ (self, row, attr):
+    def _get_value_ (self, row, attr, thumbs=None):
+        if thumbs is None:
+            thumbs = {}
         if attr=='category':
             cats = self.rd.get_cats(row)
             if cats: return ", ".join(cats)
@@ -690,9 +709,7 @@ class RecipeModel (pageable_store.PageableViewStore):
         elif attr=='rec':
             return row
         elif attr=='thumb':
-            if row.thumb:
-                return bytes_to_pixbuf(row.thumb)
-            else: return None
+            return self.rd.get_thumbnail(row,LIST_THUMBSIZE,thumbs.get(row.id))
         elif attr in INT_REC_ATTRS:
             return getattr(row,attr) or 0
         else:
@@ -710,8 +727,10 @@ class RecipeModel (pageable_store.PageableViewStore):
             if row[0].id==recipe:
                 indx = int(n + (self.page * self.per_page))
                 # update parent
-                self.parent_list[indx] = self.rd.fetch_one(self.rd.recipe_table,
-                                                           id=recipe)
+                self.parent_list[indx] = self.rd.fetch_all(
+                    self.rd.recipe_table,
+                    columns=self.rd.get_recipe_columns(),
+                    id=recipe)[0]
                 # update self
                 self.update_iter(row.iter)
                 debug('updated row -- breaking',3)
@@ -78,6 +78,21 @@ def hash_recipe (rec, rd, conv=None):
     inghash = get_ingredient_hash(rd.get_ings(rec),conv)
     return rechash,inghash
 
+def hash_recipe_dicts (recdic, ingdics, conv=None):
+    """Hash a recipe and its ingredients before they are added to
+    the database. Takes dictionaries of column values rather than
+    database rows."""
+    if not conv: conv = convert.get_converter()
+    rec = types.SimpleNamespace(**dict.fromkeys(REC_FIELDS))
+    rec.__dict__.update(recdic)
+    ings = []
+    for d in ingdics:
+        if d.get('deleted'): continue
+        i = types.SimpleNamespace(item=None,ingkey=None,unit=None,amount=None)
+        i.__dict__.update(d)
+        ings.append(i)
+    return get_recipe_hash(rec),get_ingredient_hash(ings,conv)
+
 # Diff stuff
 
 # Convenience methods
@@ -171,6 +186,8 @@ def diff_recipes (rd,recs):
     for attr in ALL_ATTRS:
         if attr == 'category':
             vals = [', '.join(rd.get_cats(r)) for r in recs]
+        elif attr in IMAGE_ATTRS:
+            vals = [rd.get_image(r,attr) for r in recs]
         else:
             vals = [getattr(r,attr) for r in recs]
         # If all our values are identical, there is no
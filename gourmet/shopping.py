@@ -24,7 +24,7 @@ class Shopper:
         self.init_pantry()
         self.mypantry = {}
         for a, u, k in inglist:
-            if self.pantry.has_key(k) and self.pantry[k]:
+            if k in self.pantry and self.pantry[k]:
                 # print "%s is in pantry" %k
                 dic=self.mypantry
             else:
@@ -54,66 +54,43 @@ class Shopper:
     def combine_ingredient (self, ing, amts):
         """We take an ingredient and a list of amounts. We return a
         list of amounts (ideally shortened, if combinifying is
-        possible)."""
+        possible).
+
+        We add up amounts in a single pass: each amount goes into the
+        first total whose unit it converts to (by volume, by mass,
+        by density or simply by having the same unit). We then pick a
+        readable unit once per total.
+        """
+        totals = [] # [unit, low, high, is_range, original amount, count]
         itms = []
         for a,u in amts:
-            if not itms:
-                ## if this is our first...
+            if isinstance(a, tuple):
+                low,high = a[0],a[-1]
+            else:
+                low = high = a
+            if not (low and high):
+                # We can't add up amounts we don't know.
                 itms.append([a,u])
+                continue
+            for total in totals:
+                conv = self.cnv.converter(u,total[0],ing)
+                if conv:
+                    total[1] += low * conv
+                    total[2] += high * conv
+                    total[3] = total[3] or isinstance(a, tuple)
+                    total[5] += 1
+                    break
             else:
-                flag = 0
-                ind = 0
-                while not flag and len(itms) > ind:
-                    amt,unit = itms[ind]
-                    if isinstance(amt, tuple) or isinstance(a, tuple):
-                        # we're adding ranges -- we'll force both
-                        # our amounts to look like ranges to simplify the addition
-                        if not isinstance(amt, tuple):
-                            amt=(amt,amt)
-                        if not isinstance(a, tuple):
-                            a=(a,a)
-                        # print 'amt:',amt,' unit:',unit,'a:',a,'u:',u
-                        add_low = self.cnv.add_reasonably(amt[0],unit,a[0],u,ing)
-                        add_high = self.cnv.add_reasonably(amt[1],unit,a[1],u,ing)
-                        if (not add_low) or (not add_high):
-                            add = False
-                        else:
-                            # Adjust units
-                            add_low = self.cnv.adjust_unit(
-                                *add_low,   # lowest+lowest
-                                **{'favor_current_unit':False}
-                                )
-                            add_high = self.cnv.adjust_unit(
-                                *add_high,  # highest+highest
-                                **{'favor_current_unit':False}
-                                )
-                            if add_low:
-                                add_low = self.cnv.adjust_unit(*add_low,**{'favor_current_unit':False})
-                            if add_high:
-                                add_high = self.cnv.adjust_unit(*add_high,**{'favor_current_unit':False})
-                            if add_low[1]==add_high[1]:  # same unit...
-                                add=((add_low[0],add_high[0]),add_low[1])
-                            else:
-                                # otherwise, let's use our unit for add_high...
-                                u1_to_u2=self.cnv.converter(add_low[1],add_high[1])
-                                add=( (add_low[0]*u1_to_u2,add_high[0]),  # amount tuple
-                                      add_high[1]  # unit from add_high
-                                      )
-                    else:
-                        add = self.cnv.add_reasonably(amt,unit,a,u,ing)
-                        if add:
-                            # adjust unit to make readable
-                            add=self.cnv.adjust_unit(*add,**{'favor_current_unit':False})
-                    # add_reasonably returns a nice a,u pair if successful
-                    # Otherwise, it return False/None
-                    if add:
-                        itms.pop(ind)     # out with the old...
-                        itms.append(add)  # in with the new
-                        flag = 1
-                    else:
-                        ind += 1
-                if not flag:
-                    itms.append([a,u])
+                totals.append([u,low,high,isinstance(a, tuple),a,1])
+        for unit,low,high,is_range,a,count in totals:
+            if count == 1:
+                # Nothing was added, so we leave the amount as it was.
+                itms.append([a,unit])
+                continue
+            amt,new_unit = self.cnv.adjust_unit(high,unit,favor_current_unit=False)
+            if is_range:
+                amt = (low * (amt / high),amt)
+            itms.append([amt,new_unit])
         return itms
 
     def ing_to_string (self, ing, amts):
@@ -154,7 +131,7 @@ class Shopper:
         if not dic:
             pass
         for i,a in list(dic.items()):
-            if self.orgdic.has_key(i) and self.orgdic[i]:
+            if i in self.orgdic and self.orgdic[i]:
                 c = self.orgdic[i]
             else:
                 c = _("Unknown")
@@ -183,7 +160,7 @@ class Shopper:
         if not cata and not catb: return 0
         elif not cata: return 1
         elif not catb: return -1
-        if self.catorder_dic.has_key(cata) and self.catorder_dic.has_key(catb):
+        if cata in self.catorder_dic and catb in self.catorder_dic:
             # if both categories have known positions, we use them to compare
             cata = self.catorder_dic[cata]
             catb = self.catorder_dic[catb]
@@ -434,5 +411,16 @@ class ShopperTestCase (unittest.TestCase):
                      )
         assert(sh.dic['milk'][0][0]==(2,3))
 
+    def testMixedUnitAddition (self):
+        sh = Shopper([(1,'c.','milk'),
+                      ((2,4),'Tbs.','milk'),
+                      (None,'c.','milk'),
+                      (2,'tsp.','milk')]
+                     )
+        assert(len(sh.dic['milk'])==2)
+        (low,high),unit = [a for a in sh.dic['milk'] if a[0]][0]
+        conv = sh.cnv.converter(unit,'tsp.')
+        assert(abs(low*conv - 56) < 0.01 and abs(high*conv - 62) < 0.01)
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,36 @@
+import codecs
+import io
+
+from gourmet import check_encodings
+from gourmet.check_encodings import get_file, GetFile
+
+
+def test_utf8():
+    lines = ['Crème brûlée', 'ascii ' * 30000, 'Jalapeño']
+    gf = GetFile(io.BytesIO('\n'.join(lines).encode('utf-8')))
+    assert gf.enc == 'utf-8'
+    assert gf.lines == lines
+
+
+def test_bom():
+    text = 'Crème brûlée\nJalapeño'
+    for encoding in ['utf-8-sig', 'utf-16', 'utf-32']:
+        assert get_file(io.BytesIO(text.encode(encoding))) == text.splitlines()
+
+
+def test_ascii_sample(tmp_path):
+    # Nothing but ASCII in our sample, but Latin-1 in the middle of
+    # the file, where we don't look.
+    text = 'a' * check_encodings.SAMPLE_SIZE + '\nCrème brûlée\n' + 'b' * check_encodings.SAMPLE_SIZE * 4
+    fn = tmp_path / 'latin1.txt'
+    fn.write_bytes(text.encode('latin-1'))
+    gf = GetFile(str(fn), encodings=['latin_1'])
+    assert gf.lines == text.splitlines()
+    assert check_encodings.encoding_cache[check_encodings.get_cache_key(str(fn))] == 'latin_1'
+
+
+def test_is_utf8():
+    text = ('é' * 1000).encode('utf-8')
+    # Chunks from the middle of a file can split characters.
+    assert check_encodings.is_utf8([text[:101], text[101:1001], text[1001:]])
+    assert not check_encodings.is_utf8([text[:100], codecs.encode('é', 'latin-1') + b'abc'])
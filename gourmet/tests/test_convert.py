@@ -13,6 +13,17 @@ class ConvertTest (unittest.TestCase):
          self.assertEqual(self.c.convert_w_density('ml','g',item='water'),1)
          self.assertEqual(self.c.convert_w_density('ml','g',density=0.5),0.5)
 
+    def testClosure (self):
+        # Every pair of units we can convert between has an entry.
+        tsp_per_gallon = self.c.convert_simple('gallon','tsp')
+        self.assertEqual(tsp_per_gallon,16*16*3)
+        self.assertAlmostEqual(self.c.convert_simple('tsp','gallon'),1.0/tsp_per_gallon)
+        self.assertIn('gallon',self.c.get_all_conversions('tsp'))
+        self.assertNotIn('g',self.c.get_all_conversions('tsp'))
+        self.assertIn('g',self.c.get_all_conversions('tsp',density=1))
+        self.assertAlmostEqual(self.c.converter('gallon','lb','water'),
+                               self.c.converter('gallon','pt')*self.c.converter('pt','lb','water'))
+
     def testReadability (self):
         self.assertTrue(self.c.readability_score(1,'cup') > self.c.readability_score(0.8,'cups') )
         self.assertTrue(self.c.readability_score(1/3.0,'tsp.') > self.c.readability_score(0.123,'tsp.'))
@@ -21,6 +32,36 @@ class ConvertTest (unittest.TestCase):
         amt,unit = self.c.adjust_unit(12,'Tbs.','water')
         self.assertEqual(amt,.75)
 
+    def testAdjustmentCache (self):
+        self.c.adjust_unit_cache.cache_clear()
+        self.assertEqual(self.c.adjust_unit(12,'Tbs.','water'),(.75,'c'))
+        self.assertEqual(self.c.adjust_unit(24,'Tbs.','water'),(1.5,'c'))
+        self.assertEqual(self.c.adjust_unit(12,'Tbs.','water'),(.75,'c'))
+        self.assertEqual(self.c.adjust_unit_cache.cache_info().hits,1)
+        # Amounts we can't read are handed back as is.
+        self.assertEqual(self.c.adjust_unit('a few','Tbs.'),('a few','Tbs.'))
+        self.assertEqual(self.c.adjust_unit(3,'handful'),(3,'handful'))
+
+    def testCachedAdjustments (self):
+        amounts = [(n / 8.0,u) for n in range(1,201)
+                   for u in ['tsp.','Tbs.','c.','g','oz','lb','ml','l','clove','']]
+        uncached = []
+        for a,u in amounts:
+            self.c.adjust_unit_cache.cache_clear()
+            uncached.append(self.c.adjust_unit(a,u,favor_current_unit=False))
+        # Once our cache is warm, we hand back the same results.
+        self.c.adjust_unit_cache.cache_clear()
+        for a,u in amounts:
+            self.c.adjust_unit(a,u,favor_current_unit=False)
+        self.assertEqual([self.c.adjust_unit(a,u,favor_current_unit=False) for a,u in amounts],
+                         uncached)
+        self.assertEqual(self.c.adjust_unit_cache.cache_info().hits,len(amounts))
+
+    def testTinyAdjustments (self):
+        # Amounts that round to 0 in our cache are handed back as is.
+        self.assertEqual(self.c.adjust_unit(1e-7,'tsp.'),(1e-07,'tsp.'))
+        self.assertEqual(self.c.adjust_unit(-1e-7,'c.'),(-1e-07,'c.'))
+
     def testIntegerRounding (self):
         self.assertTrue(convert.integerp(0.99))
 
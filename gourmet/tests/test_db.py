@@ -1,6 +1,10 @@
-import tempfile, unittest
+import os, re, tempfile, threading, unittest
+from unittest import mock
+
+import sqlalchemy
 
 from gourmet.backends import db
+from gourmet.keymanager import KeyManager
 from gourmet.plugin_loader import MasterLoader
 
 class DBTest (unittest.TestCase):
@@ -12,8 +16,19 @@ class DBTest (unittest.TestCase):
         ml.active_plugins = []
         ml.active_plugin_sets = []
         # Done knocking out plugins...
-        tmpfile = tempfile.mktemp()
-        self.db = db.get_database(file=tmpfile)
+        self.tmpfile = tempfile.mktemp()
+        self.db = db.get_database(file=self.tmpfile)
+
+    def count_queries (self, fun, *args):
+        queries = []
+        def count (*args):
+            queries.append(args)
+        sqlalchemy.event.listen(self.db.db, 'before_cursor_execute', count)
+        try:
+            fun(*args)
+        finally:
+            sqlalchemy.event.remove(self.db.db, 'before_cursor_execute', count)
+        return len(queries)
 
 class testRecBasics (DBTest):
     def runTest (self):
@@ -176,10 +191,144 @@ class testIDReservation (DBTest):
 
 img = b'\xff\xd8\xff\xe0\x00\x10JFIF\x00\x01\x01\x00\x00\x01\x00\x01\x00\x00\xff\xdb\x00C\x00\x08\x06\x06\x07\x06\x05\x08\x07\x07\x07\t\t\x08\n\x0c\x14\r\x0c\x0b\x0b\x0c\x19\x12\x13\x0f\x14\x1d\x1a\x1f\x1e\x1d\x1a\x1c\x1c $.\' ",#\x1c\x1c(7),01444\x1f\'9=82<.342\xff\xdb\x00C\x01\t\t\t\x0c\x0b\x0c\x18\r\r\x182!\x1c!22222222222222222222222222222222222222222222222222\xff\xc0\x00\x11\x08\x00(\x00#\x03\x01"\x00\x02\x11\x01\x03\x11\x01\xff\xc4\x00\x1f\x00\x00\x01\x05\x01\x01\x01\x01\x01\x01\x00\x00\x00\x00\x00\x00\x00\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\xff\xc4\x00\xb5\x10\x00\x02\x01\x03\x03\x02\x04\x03\x05\x05\x04\x04\x00\x00\x01}\x01\x02\x03\x00\x04\x11\x05\x12!1A\x06\x13Qa\x07"q\x142\x81\x91\xa1\x08#B\xb1\xc1\x15R\xd1\xf0$3br\x82\t\n\x16\x17\x18\x19\x1a%&\'()*456789:CDEFGHIJSTUVWXYZcdefghijstuvwxyz\x83\x84\x85\x86\x87\x88\x89\x8a\x92\x93\x94\x95\x96\x97\x98\x99\x9a\xa2\xa3\xa4\xa5\xa6\xa7\xa8\xa9\xaa\xb2\xb3\xb4\xb5\xb6\xb7\xb8\xb9\xba\xc2\xc3\xc4\xc5\xc6\xc7\xc8\xc9\xca\xd2\xd3\xd4\xd5\xd6\xd7\xd8\xd9\xda\xe1\xe2\xe3\xe4\xe5\xe6\xe7\xe8\xe9\xea\xf1\xf2\xf3\xf4\xf5\xf6\xf7\xf8\xf9\xfa\xff\xc4\x00\x1f\x01\x00\x03\x01\x01\x01\x01\x01\x01\x01\x01\x01\x00\x00\x00\x00\x00\x00\x01\x02\x03\x04\x05\x06\x07\x08\t\n\x0b\xff\xc4\x00\xb5\x11\x00\x02\x01\x02\x04\x04\x03\x04\x07\x05\x04\x04\x00\x01\x02w\x00\x01\x02\x03\x11\x04\x05!1\x06\x12AQ\x07aq\x13"2\x81\x08\x14B\x91\xa1\xb1\xc1\t#3R\xf0\x15br\xd1\n\x16$4\xe1%\xf1\x17\x18\x19\x1a&\'()*56789:CDEFGHIJSTUVWXYZcdefghijstuvwxyz\x82\x83\x84\x85\x86\x87\x88\x89\x8a\x92\x93\x94\x95\x96\x97\x98\x99\x9a\xa2\xa3\xa4\xa5\xa6\xa7\xa8\xa9\xaa\xb2\xb3\xb4\xb5\xb6\xb7\xb8\xb9\xba\xc2\xc3\xc4\xc5\xc6\xc7\xc8\xc9\xca\xd2\xd3\xd4\xd5\xd6\xd7\xd8\xd9\xda\xe2\xe3\xe4\xe5\xe6\xe7\xe8\xe9\xea\xf2\xf3\xf4\xf5\xf6\xf7\xf8\xf9\xfa\xff\xda\x00\x0c\x03\x01\x00\x02\x11\x03\x11\x00?\x00\xf5\x01#r\xc0\x1c\x01\x92q\xd0S\x9a\xea+x\x1a{\xa9\x92(\x82\x16R\xc7n\xefl\x9e+\x07\xc6z\xf0\xd3$\x16p\xa4A\xf2\xb2d\xb1S\x8eq\xfc\'=\xff\x00:\xcf\x9a\xf7Q\xf1O\x85\x9eDB\xa9\x14\xdbJ\xc7\xceO\xe4\x0f\x7f\xd6\xaeUU\xb4*4\x9bj\xfb\x1d5\x9e\xadk}m\xba\x19\xe3\x92U8a\x1b\x02\x05`k\xfe\'m1\x84\x0bl\x1d\x87F.F>\xb8\xebShKi\xa0\xe9-4\xf8I\xe7E\r\xba,\x98\xd8\x03\x81\x8c\xe4\xf5\xcf^A\x14\x96\x97:>\xb5rl\xae\x00\xbd\x91\x8b"\xbbB\xcaz\xfd\xe1\xe9\xeb\xc1\x1c}1I\xc9\xc9+n5\x15\x17\xaa\xba,\xe9\xda\xb5\xd6\xa3a\r\xdb\xa2\xabH2F\x07c\x8f\xe9Etp\xd9\xc1o\x04p\xc5\x10\x11\xc6\xa1T{\n+U-52v\xbe\x86\x0f\x8c\xbc2\xfa\xcc\x90\xdc@3 \xc4dd\x0f\xa7\xf3\xadm\x13H\x87C\xd2\xa2\xb2\x1f31\xdc\xe4\x0e\x0b\x1cg\xf9\x01Z\x8e\xe7#\x18\x1e\xe6\xa2\xbb\xbb\x8a\xd9Y\x9d\x86\xc03\x9a\xc9E\'r\xdc\xdb\x8f)\xc6\xfcF\xd3e\xb9\xb3\x82\xea0\xc7h*v\xfey\xff\x00>\x95\x93\xf0\xfbIxo\x1e\xfex\xdbj\x02\xa8I\xfe#\xd7\xf4\xcf\xe7]\xcc\x97\xd1\xdd\xda\xc8\x8a\x98S\xf2\xe5\xfe\\\xfd;\xf1\x8c\xfe\x1d\xba\xd3\x86AX\xc4,\x15F7\xed\x00\x13\xdf\x8c\xf1\xcei{?{\x98~\xd3\xdc\xe5,1%\x89\x07\x03\xd0QF(\xadL\xc9\xd9\xc6*\xa5\xec"x\n\xed\xdcr\x1b\x1e\xb84QR\x80\xa0\xc8\xb3C\xf6i"|0\xc6\x0eG\x1f^\xb9\xabS\\}\x968`p\xca\xa3\x01X\xe4\x8f\xc4\xff\x00\x8d\x14U\x89\n\xf7r+m\x8ebT\x01\x8c-\x14QH\x0f\xff\xd9'
 
+class testFastAdds (DBTest):
+
+    def testThreads (self):
+        # Each thread adding rows gets a connection of its own, since
+        # sqlite connections can't be shared between threads.
+        def add (title):
+            self.db.begin_fast_adds()
+            self.db.do_add_many_fast(self.db.recipe_table,[{'title':title}])
+            self.db.commit_fast_adds()
+        add('Main thread')
+        t = threading.Thread(target=add,args=('Worker thread',))
+        t.start(); t.join()
+        add('Main thread again')
+        self.assertEqual(
+            sorted(r.title for r in self.db.fetch_all(self.db.recipe_table,title=('LIKE','%thread%'))),
+            ['Main thread','Main thread again','Worker thread'])
+
 class TestMoreDataStuff (DBTest):
     def test_image_data (self):
         r = self.db.add_rec({'image': img})
-        self.assertEqual(r.image, img)
+        self.assertEqual(self.db.get_image(r), img)
+
+    def test_image_store (self):
+        r1 = self.db.add_rec({'title':'One','image': img})
+        r2 = self.db.add_rec({'title':'Two','image': img})
+        self.assertEqual(r1.image_hash,r2.image_hash)
+        path = self.db.get_image_path(r1.image_hash)
+        self.assertTrue(os.path.exists(path))
+        self.assertEqual(self.db.count_image_references(r1.image_hash),2)
+        # Dropping one reference keeps the image around...
+        self.db.modify_rec(r1,{'image':None,'thumb':None})
+        self.assertEqual(self.db.get_image(r1.id),None)
+        self.assertEqual(self.db.get_image(r2.id),img)
+        self.assertTrue(os.path.exists(path))
+        # ...dropping the last one removes it.
+        self.db.delete_rec(r2)
+        self.assertFalse(os.path.exists(path))
+
+    def test_thumbnail_cache (self):
+        r = self.db.add_rec({'title':'Thumbnail','image': img})
+        self.assertIsNotNone(self.db.get_thumbnail(r,126))
+        self.assertIn((r.id,r.image_hash,126),self.db.thumbnail_cache)
+        self.db.modify_rec(r,{'image':None,'thumb':None})
+        self.assertNotIn((r.id,r.image_hash,126),self.db.thumbnail_cache)
+        self.assertEqual(self.db.get_thumbnail(r.id,126),None)
+
+    def test_move_images_to_store (self):
+        r = self.db.add_rec({'title':'Old-style image'})
+        # Databases copied from our default database still have the
+        # old image column.
+        columns = [c['name'] for c in sqlalchemy.inspect(self.db.db).get_columns('recipe')]
+        if 'image' not in columns:
+            self.db.db.execute('ALTER TABLE recipe ADD image BLOB')
+        self.db.db.execute(sqlalchemy.text('UPDATE recipe SET image = :image WHERE id = :id'),
+                           image=img,id=r.id)
+        self.db.move_images_to_store()
+        self.assertEqual(self.db.get_image(r.id),img)
+        self.assertEqual(self.db.db.execute('SELECT count(*) FROM recipe WHERE image IS NOT NULL').scalar(),0)
+        # Moving again is harmless.
+        self.db.move_images_to_store()
+        self.assertEqual(self.db.get_image(r.id),img)
+
+    def test_move_images_backs_up (self):
+        backups = []
+        self.db.backup_db = lambda: backups.append(True)
+        r = self.db.add_rec({'title':'Old-style image'})
+        columns = [c['name'] for c in sqlalchemy.inspect(self.db.db).get_columns('recipe')]
+        if 'image' not in columns:
+            self.db.db.execute('ALTER TABLE recipe ADD image BLOB')
+        # Nothing to move, nothing to back up.
+        self.db.db.execute('UPDATE recipe SET image = NULL')
+        self.db.from_default_db = False
+        self.db.move_images_to_store()
+        self.assertEqual(backups,[])
+        self.db.db.execute(sqlalchemy.text('UPDATE recipe SET image = :image WHERE id = :id'),
+                           image=img,id=r.id)
+        self.db.move_images_to_store()
+        self.assertEqual(backups,[True])
+        self.assertEqual(self.db.get_image(r.id),img)
+
+    def test_backup_images (self):
+        r = self.db.add_rec({'title':'Backed up','image': img})
+        with mock.patch('gourmet.gtk_extras.dialog_extras.show_message'):
+            self.db.backup_db()
+        backups = [f for f in os.listdir(os.path.dirname(self.tmpfile))
+                   if f.startswith(os.path.basename(self.tmpfile) + '.backup-')
+                   and f.endswith('_images')]
+        self.assertEqual(len(backups),1)
+        path = os.path.join(os.path.dirname(self.tmpfile),backups[0],
+                            r.image_hash[:2],r.image_hash)
+        with open(path,'rb') as fi:
+            self.assertEqual(fi.read(),img)
+
+    def test_release_waits_for_commit (self):
+        # An importer has stored an image for a recipe it hasn't
+        # committed yet...
+        image_hash = self.db.store_image(img)
+        done = threading.Event()
+        def delete ():
+            # ...when the last committed recipe using it goes.
+            r = self.db.add_rec({'title':'Going','image': img})
+            self.db.delete_rec(r)
+            done.set()
+        t = threading.Thread(target=delete)
+        t.start(); t.join()
+        self.assertTrue(done.is_set())
+        path = self.db.get_image_path(image_hash)
+        self.assertTrue(os.path.exists(path))
+        # Once the importer commits its recipe, the image is in use.
+        self.db.add_rec({'title':'Imported','image_hash':image_hash})
+        self.db.commit_fast_adds()
+        self.assertTrue(os.path.exists(path))
+        # Without a recipe using it, committing lets it go.
+        self.db.store_image(img)
+        self.db.release_image(image_hash)
+        self.assertTrue(os.path.exists(path))
+        self.db.delete_by_criteria(self.db.recipe_table,{'image_hash':image_hash})
+        self.db.commit_fast_adds()
+        self.assertFalse(os.path.exists(path))
+
+    def test_lazy_images (self):
+        r = self.db.add_rec({'title':'Lazy Image','image': img})
+        plain = self.db.add_rec({'title':'Lazy Image'})
+        recs = self.db.search_recipes(
+            [{'column':'title','search':'Lazy Image','operator':'='}],
+            columns=self.db.get_recipe_columns())
+        self.assertEqual(sorted(x.id for x in recs),[r.id,plain.id])
+        lazy = [x for x in recs if x.id==r.id][0]
+        self.assertRaises(AttributeError,getattr,lazy,'image')
+        self.assertEqual(self.db.get_image(lazy),img)
+        self.assertEqual(self.db.get_image(r),img)
+        self.assertEqual(self.db.get_image(plain.id),None)
+        thumbs = self.db.fetch_images([r.id,plain.id],'thumb')
+        self.assertEqual(list(thumbs),[r.id])
+        self.assertEqual(thumbs[r.id],r.thumb)
+        titles = self.db.fetch_all(self.db.recipe_table,columns=['id','title'],
+                                   id=plain.id)
+        self.assertEqual([tuple(t) for t in titles],[(plain.id,'Lazy Image')])
 
     def test_update (self):
         r = self.db.add_rec({'title':'Foo','cuisine':'Bar','source':'Z'})
@@ -217,18 +366,315 @@ class TestMoreDataStuff (DBTest):
             # Change back our ingredient...
             r = self.db.modify_ing(i,{attr:orig_attrs[attr]})
 
+class testIndexes (DBTest):
+
+    def get_ings_query_plan (self):
+        stmt = self.db.ingredients_table.select(
+            *db.make_simple_select_arg({'recipe_id':1,'deleted':False},
+                                       self.db.ingredients_table))
+        sql = str(stmt.compile(self.db.db, compile_kwargs={'literal_binds':True}))
+        return ' '.join(str(row) for row in
+                        self.db.db.execute('EXPLAIN QUERY PLAN ' + sql))
+
+    def testIndexesCreated (self):
+        inspector = sqlalchemy.inspect(self.db.db)
+        for table, col in [('ingredients','recipe_id'),
+                           ('ingredients','ingkey'),
+                           ('ingredients','refid'),
+                           ('categories','recipe_id'),
+                           ('keylookup','word'),
+                           ('keylookup','item'),
+                           ('keylookup','ingkey'),
+                           ('recipe','recipe_hash'),
+                           ('recipe','ingredient_hash'),
+                           ('recipe','title')]:
+            indexed = [i['column_names'] for i in inspector.get_indexes(table)]
+            self.assertIn([col], indexed)
+
+    def testMissingIndexesAreRestored (self):
+        self.db.db.execute('DROP INDEX ix_ingredients_recipe_id')
+        self.assertNotIn('ix_ingredients_recipe_id', self.get_ings_query_plan())
+        self.db.create_missing_indexes()
+        self.assertIn('ix_ingredients_recipe_id', self.get_ings_query_plan())
+
+    def testLookupsUseIndexes (self):
+        for table, col, index in [('ingredients','ingkey','ix_ingredients_ingkey'),
+                                  ('ingredients','refid','ix_ingredients_refid'),
+                                  ('keylookup','word','ix_keylookup_word'),
+                                  ('recipe','recipe_hash','ix_recipe_recipe_hash')]:
+            plan = ' '.join(str(row) for row in self.db.db.execute(
+                "EXPLAIN QUERY PLAN SELECT * FROM %s WHERE %s = 'x'"%(table,col)))
+            self.assertIn(index, plan)
+
+class testSearchIndex (DBTest):
+
+    def search_ids (self, column, txt, use_index=True):
+        self.db.search_index = use_index
+        try:
+            return sorted(r.id for r in self.db.search_recipes(
+                [{'column':column,'search':'%'+txt+'%','operator':'LIKE'}]))
+        finally:
+            self.db.search_index = True
+
+    def assertSameAsLike (self, column, txt):
+        result = self.search_ids(column, txt)
+        self.assertEqual(result, self.search_ids(column, txt, use_index=False))
+        return result
+
+    def testIndexedSearches (self):
+        self.assertTrue(self.db.search_index)
+        self.db.delete_by_criteria(self.db.ingredients_table,{})
+        self.db.delete_by_criteria(self.db.recipe_table,{})
+        self.db.delete_by_criteria(self.db.categories_table,{})
+        r1 = self.db.add_rec({'title':'Apple Crumble','category':'Dessert, Baking'})
+        r2 = self.db.add_rec({'title':'Pork Chops','source':'Grandma',
+                              'instructions':'Serve with apple sauce.'})
+        self.db.add_ing({'recipe_id':r2.id,'item':'Brown Sugar','ingkey':'sugar, brown'})
+        for column,txt,expected in [('anywhere','apple',[r1.id,r2.id]),
+                                    ('anywhere','APPLE SAUCE',[r2.id]),
+                                    ('title','apple',[r1.id]),
+                                    ('category','dessert',[r1.id]),
+                                    ('ingredient','sugar, br',[r2.id]),
+                                    ('anywhere','grandma',[r2.id]),]:
+            self.assertEqual(self.assertSameAsLike(column,txt),expected)
+        # Our triggers keep the index up to date...
+        self.db.modify_rec(r1,{'title':'Pear Crumble','category':'Fruit'})
+        self.assertEqual(self.assertSameAsLike('title','apple'),[])
+        self.assertEqual(self.assertSameAsLike('category','dessert'),[])
+        self.assertEqual(self.assertSameAsLike('anywhere','fruit'),[r1.id])
+        ing = self.db.get_ings(r2)[0]
+        self.db.modify_ing(ing,{'item':'Maple Syrup','ingkey':'syrup, maple'})
+        self.assertEqual(self.assertSameAsLike('ingredient','sugar'),[])
+        self.assertEqual(self.assertSameAsLike('ingredient','maple'),[r2.id])
+        self.db.delete_rec(r2)
+        self.assertEqual(self.assertSameAsLike('anywhere','maple'),[])
+        # Searches our index can't handle fall back to LIKE...
+        self.assertEqual(self.search_ids('anywhere','pe'),
+                         self.search_ids('anywhere','pe',use_index=False))
+
+    def get_triggers (self):
+        return [r[0] for r in self.db.db.execute(
+            "SELECT name FROM sqlite_master WHERE type='trigger' AND name LIKE 'recipe_search_%'")]
+
+    def testStaleIndexIsRebuilt (self):
+        r = self.db.add_rec({'title':'Quince Jelly'})
+        # As left by an SQLite that couldn't use our index: no triggers,
+        # so the index misses later changes.
+        for name in self.get_triggers():
+            self.db.db.execute('DROP TRIGGER %s'%name)
+        self.db.modify_rec(r,{'title':'Quince Paste'})
+        self.db.search_index = False
+        self.db.setup_search_index()
+        self.assertTrue(self.db.search_index)
+        self.assertEqual(len(self.get_triggers()),len(db.SEARCH_INDEX_TRIGGERS))
+        self.assertEqual(self.search_ids('title','quince paste'),[r.id])
+
+    def testBrokenIndexIsDropped (self):
+        # An index our SQLite can't search (here, a plain table).
+        self.db.db.execute('DROP TABLE recipe_search')
+        self.db.db.execute('CREATE TABLE recipe_search (%s)'%', '.join(db.SEARCH_INDEX_COLUMNS))
+        self.db.search_index = False
+        self.db.setup_search_index()
+        self.assertFalse(self.db.search_index)
+        self.assertEqual(self.get_triggers(),[])
+        # We can still write, and search with LIKE.
+        r = self.db.add_rec({'title':'Medlar Cheese'})
+        self.assertEqual(self.search_ids('title','medlar',use_index=False),[r.id])
+
+class testRegexp (DBTest):
+
+    def testMatchesReSearch (self):
+        for expr in ['sugar','SUGAR','sug.r','^brown','sugar$','white|brown',
+                     'brown sugar','(light)?brown']:
+            for item in ['Brown Sugar','white sugar','sugar, light brown',
+                         'flour','']:
+                self.assertEqual(db.regexp(expr,item),
+                                 bool(item) and re.search(expr,item,re.IGNORECASE) is not None,
+                                 '%s REGEXP %s'%(item,expr))
+
+    def testPatternsCompiledOnce (self):
+        self.db.delete_by_criteria(self.db.ingredients_table,{})
+        items = ['Brown Sugar','white sugar','flour, all-purpose','butter',
+                 'eggs']
+        self.db.ingredients_table.insert().execute(
+            [{'recipe_id':n // 10,'item':items[n % len(items)],'deleted':False}
+             for n in range(100)])
+        for expr,expected in [('sugar',40),('^(white|brown) sugar$',40),
+                              ('flour',20)]:
+            db.compile_regexp.cache_clear()
+            result = self.db.fetch_all(self.db.ingredients_table,
+                                       item=('REGEXP',expr))
+            self.assertEqual(len(result),expected)
+            # One compile for the whole table, not one per row.
+            info = db.compile_regexp.cache_info()
+            self.assertEqual((info.misses,info.hits),(1,99))
+
+class testPrefetch (DBTest):
+
+    def runTest (self):
+        recs = [self.db.add_rec({'title':'Prefetch %s'%n,
+                                 'category':'Cat %s, Other'%n})
+                for n in range(5)]
+        for r in recs:
+            for n in range(3):
+                self.db.add_ing({'recipe_id':r.id,'item':'ing %s'%n,
+                                 'ingkey':'ing %s'%n,'position':n})
+        expected = [(self.db.get_ings(r),self.db.get_cats(r)) for r in recs]
+        self.db.prefetch(recs)
+        def read_all ():
+            self.assertEqual(
+                [(self.db.get_ings(r),self.db.get_cats(r)) for r in recs],
+                expected)
+        self.assertEqual(self.count_queries(read_all), 0)
+        # Changing an ingredient drops our prefetched ingredients...
+        self.db.modify_ing(expected[0][0][0],{'item':'changed'})
+        self.assertEqual(self.db.get_ings(recs[0])[0].item,'changed')
+        self.db.clear_prefetched()
+        self.assertEqual(self.count_queries(self.db.get_cats,recs[0]), 1)
+        # We can let go of just what one caller prefetched.
+        self.assertEqual(self.db.prefetch(recs[:3],with_ings=False),[r.id for r in recs[:3]])
+        ids = self.db.prefetch(recs[2:],with_ings=False)
+        self.assertEqual(ids,[r.id for r in recs[3:]])
+        self.db.clear_prefetched(ids)
+        self.assertEqual(self.count_queries(self.db.get_cats,recs[2]), 0)
+        self.assertEqual(self.count_queries(self.db.get_cats,recs[4]), 1)
+
+class testKeyManager (DBTest):
+
+    def setUp (self):
+        DBTest.setUp(self)
+        self.km = KeyManager(recipe_manager=self.db)
+
+    def testIndexStaysInSync (self):
+        self.db.add_ing_to_keydic('Granny Smith apples','apple, green')
+        self.db.add_ing_to_keydic('Granny Smith apples','apple, green')
+        self.db.add_ing_to_keydic('green apples','apple, green')
+        self.db.remove_ing_from_keydic('green apples','apple, green')
+        index = self.db.get_keylookup_index()
+        self.assertEqual(index['item']['Granny Smith apples'],{'apple, green':2})
+        self.assertNotIn('green',index['word'])
+        # Reloading from the table gives us the same index.
+        self.db._keylookup_index = None
+        self.assertEqual(index,self.db.get_keylookup_index())
+        self.assertEqual(self.km.get_key_fast('Granny Smith apples'),'apple, green')
+        self.assertEqual(self.km.get_key('granny smith apples'),'apple, green')
+        self.assertEqual(self.count_queries(self.km.look_for_key,'smith apples'),0)
+        # Writing to keylookup behind our back throws the index away.
+        self.db.delete_by_criteria(self.db.keylookup_table,{'ingkey':'apple, green'})
+        self.assertEqual(self.km.get_key_fast('Granny Smith apples'),
+                         'granny smith apples')
+
+    def testKeysAndUnitsFollowAdds (self):
+        rm = db.RecipeManager.instance_for(file=self.tmpfile)
+        rm.km = self.km
+        # Load our keys and units.
+        rm.parse_ingredient('1 knob butter')
+        self.db.get_ingkeys()
+        # Like an importer adding one recipe at a time: adding
+        # ingredients doesn't make us read all our keys and units again.
+        def add_and_parse (n):
+            self.db.add_ings([{'recipe_id':1,'item':'thing %s'%n,
+                               'ingkey':'thing %s'%n,'unit':'dollop%s'%n}])
+            return rm.parse_ingredient('2 dollop%s thing %s'%(n,n))
+        for n in range(3):
+            self.assertEqual(self.count_queries(add_and_parse,n),1)
+        self.assertEqual(add_and_parse(3)['unit'],'dollop3')
+        self.assertIn('thing 3',self.db.get_ingkeys())
+        # Other changes do.
+        self.db.delete_by_criteria(self.db.ingredients_table,{'ingkey':'thing 3'})
+        self.assertNotIn('thing 3',self.db.get_ingkeys())
+        self.assertNotIn('dollop3',self.db.get_units())
+
+    def testParseIngredients (self):
+        rm = db.RecipeManager.instance_for(file=self.tmpfile)
+        rm.km = self.km
+        self.db.add_ing({'recipe_id':1,'item':'butter','unit':'knob'})
+        lines = ['1 knob butter','3 ripe pears','* optional: 1 c. milk',
+                 'salt to taste']
+        parsed = rm.parse_ingredients(lines)
+        self.assertEqual(parsed[0],{'amount':1,'unit':'knob','item':'butter',
+                                    'ingkey':'butter'})
+        # "ripe" was never used as a unit, so it's part of the item.
+        self.assertEqual(parsed[1]['item'],'ripe pears')
+        self.assertNotIn('unit',parsed[1])
+        self.assertEqual(parsed[2]['unit'],'c.')
+        self.assertTrue(parsed[2]['optional'])
+        self.assertEqual(parsed[3]['item'],'salt to taste')
+        # Parsing again only needs what we already have in memory.
+        self.assertEqual(self.count_queries(rm.parse_ingredients,lines),0)
+        self.assertEqual(rm.parse_ingredients(lines),parsed)
+
+class testShopping (DBTest):
+
+    def testDbDic (self):
+        orgdic = db.dbDic('ingkey','shopcategory',self.db.shopcats_table,self.db)
+        posdic = db.dbDic('ingkey','position',self.db.shopcats_table,self.db)
+        orgdic['zucchini'] = 'Produce'
+        self.assertEqual(self.count_queries(lambda: orgdic['zucchini']),0)
+        self.assertIn('zucchini',orgdic)
+        self.assertNotIn('zucchini squash',orgdic)
+        self.assertRaises(KeyError,lambda: orgdic['zucchini squash'])
+        # Our other dictionary on the same table sees the new row...
+        self.assertIsNone(posdic['zucchini'])
+        # ...and changes made behind our backs show up.
+        self.db.update_by_criteria(self.db.shopcats_table,{'ingkey':'zucchini'},
+                                   {'shopcategory':'Vegetables','position':3})
+        self.assertEqual(orgdic['zucchini'],'Vegetables')
+        self.assertEqual(posdic['zucchini'],3)
+
+    def testShoppingQueriesDontGrow (self):
+        from gourmet.recipeManager import DatabaseShopper
+        from gourmet.defaults.defaults import lang
+        keys = [k for _,k,_ in lang.INGREDIENT_DATA][:300]
+        units = ['c.','Tbs.','tsp.','g','oz','lb','']
+        def make_list (recipes):
+            # recipes of 12 ingredients each.
+            lst = [([1,2,0.5,0.25,3][n % 5],units[n % len(units)],keys[(n * 7) % len(keys)])
+                   for n in range(recipes * 12)]
+            sh = DatabaseShopper(lst,self.db)
+            return sh.organize(sh.dic),sh.organize(sh.mypantry)
+        make_list(5)
+        # A weekly list of 40 recipes costs us no more queries than
+        # a handful of recipes do.
+        self.assertEqual(self.count_queries(make_list,40),
+                         self.count_queries(make_list,5))
+
 suite = unittest.TestSuite()
 suite.addTests([
         testRecBasics(),
         testSearch(),
         testUnicode(),
         testIDReservation(),
+        testFastAdds('testThreads'),
         TestMoreDataStuff('test_image_data'),
+        TestMoreDataStuff('test_image_store'),
+        TestMoreDataStuff('test_thumbnail_cache'),
+        TestMoreDataStuff('test_move_images_to_store'),
+        TestMoreDataStuff('test_move_images_backs_up'),
+        TestMoreDataStuff('test_backup_images'),
+        TestMoreDataStuff('test_release_waits_for_commit'),
         TestMoreDataStuff('test_update'),
+        TestMoreDataStuff('test_lazy_images'),
         TestMoreDataStuff('test_modify_rec'),
         TestMoreDataStuff('test_modify_ing'),
         ] + [
         testIngBasics(m) for m in ['testUnique','testAddIngs',]
+        ] + [
+        testSearchIndex('testIndexedSearches'),
+        testSearchIndex('testStaleIndexIsRebuilt'),
+        testSearchIndex('testBrokenIndexIsDropped'),
+        testRegexp('testMatchesReSearch'),
+        testRegexp('testPatternsCompiledOnce'),
+        testPrefetch(),
+        testKeyManager('testIndexStaysInSync'),
+        testKeyManager('testKeysAndUnitsFollowAdds'),
+        testKeyManager('testParseIngredients'),
+        testShopping('testDbDic'),
+        testShopping('testShoppingQueriesDontGrow'),
+        ] + [
+        testIndexes(m) for m in ['testIndexesCreated',
+                                 'testMissingIndexesAreRestored',
+                                 'testLookupsUseIndexes',]
         ]
                )
 
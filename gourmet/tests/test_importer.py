@@ -1,5 +1,18 @@
+import io
+import os
+import tarfile
+import tempfile
+import threading
 import unittest
-from gourmet.importers import importer
+import zipfile
+from gourmet import check_encodings, recipeIdentifier
+from gourmet.importers import importer, importManager
+from gourmet.plugin import ImporterPlugin
+from gourmet.plugins.import_export.archive_plugin.archive_importer import ArchiveImporter
+from gourmet.plugins.import_export.archive_plugin.zip_importer_plugin import ArchiveImporterPlugin
+from gourmet.threadManager import NotThreadSafe
+from gourmet.plugins.import_export.gxml_plugin import gxml2_importer
+from gourmet.plugins.import_export.mealmaster_plugin import mealmaster_importer, mealmaster_importer_plugin
 
 class TestImporter (unittest.TestCase):
 
@@ -35,5 +48,393 @@ class TestImporter (unittest.TestCase):
         self.assertEqual(ing.unit,'cups')
         self.assertEqual(ing.item,'water')
 
+    def testPostImport (self):
+        rd = self.i.rd
+        before = rd.get_keylookup_index()['item']['quince paste'].get('membrillo',0)
+        hooked = []
+        orig_hooks = self.i.rd_orig_ing_hooks
+        self.i.rd_orig_ing_hooks = orig_hooks + [hooked.append]
+        try:
+            self.i.start_rec()
+            self.i.rec['title']='Post Import Test'
+            self.i.start_ing()
+            self.i.add_amt(1)
+            self.i.add_item('quince paste')
+            self.i.add_key('membrillo')
+            self.i.commit_ing()
+            self.i.commit_rec()
+            self.i.do_run()
+        finally:
+            rd.add_ing_hooks = orig_hooks
+        # Read our recipe back, rather than trusting the row we got
+        # when it was added, before its ingredients.
+        rec = rd.get_rec(self.i.added_recs[-1].id)
+        self.assertEqual((rec.recipe_hash,rec.ingredient_hash),
+                         recipeIdentifier.hash_recipe(rec,rd))
+        self.assertEqual([i['item'] for i in hooked],['quince paste'])
+        index = rd.get_keylookup_index()
+        self.assertEqual(index['item']['quince paste']['membrillo'],before+1)
+        self.assertEqual(index['word']['quince']['membrillo'],before+1)
+
+class TestBulkImporter (TestImporter):
+
+    def setUp (self):
+        self.i = importer.Importer()
+        self.i.bulk_commit = True
+
+    def _get_last_rec_ (self):
+        self.i.finish_bulk_commit()
+        return self.i.added_recs[-1]
+
+    def _import_rec_ (self, rec, ings=[], refs=[]):
+        self.i.start_rec(dict=rec)
+        for amt,unit,item in ings:
+            self.i.start_ing()
+            self.i.add_amt(amt)
+            self.i.add_unit(unit)
+            self.i.add_item(item)
+            self.i.commit_ing()
+        for ref in refs:
+            self.i.start_ing()
+            self.i.add_ref(ref)
+            self.i.add_item(ref)
+            self.i.commit_ing()
+        self.i.commit_rec()
+
+    def testHashesAndCategories (self):
+        self._import_rec_({'title':'Bulk Soup','category':'Soup, Dinner',
+                           'instructions':'Boil.'},
+                          [(2,'cups','water'),(1,'tsp.','salt')])
+        rec = self._get_last_rec_()
+        self.assertEqual(
+            (rec.recipe_hash,rec.ingredient_hash),
+            recipeIdentifier.hash_recipe(rec,self.i.rd)
+            )
+        self.assertEqual(sorted(self.i.rd.get_cats(rec)),
+                         ['Dinner','Soup'])
+
+    def testBatchesAndReferences (self):
+        self.i.bulk_batch_size = 3
+        self._import_rec_({'title':'Main','id':'main'},refs=['sauce','missing'])
+        for n in range(5):
+            self._import_rec_({'title':'Filler %s'%n},[(n+1,'cups','flour')])
+        self._import_rec_({'title':'Sauce','id':'sauce'})
+        self.i.finish_bulk_commit()
+        recs = self.i.added_recs[-7:]
+        self.assertEqual([r.title for r in recs],
+                         ['Main']+['Filler %s'%n for n in range(5)]+['Sauce'])
+        refs = dict((i.item,i.refid) for i in self.i.rd.get_ings(recs[0]))
+        self.assertEqual(refs['sauce'],recs[-1].id)
+        placeholder = self.i.rd.get_rec(refs['missing'])
+        self.assertTrue(placeholder.deleted)
+        self.assertEqual(self.i.rd.get_ings(recs[3])[0].amount,3)
+
+    def testBatchesAreCommitted (self):
+        self.i.bulk_batch_size = 2
+        rd = self.i.rd
+        def import_recs ():
+            for n in range(3):
+                self._import_rec_({'title':'Committed %s'%n})
+        # Importers run in their own thread, with their own connection.
+        t = threading.Thread(target=import_recs)
+        t.start(); t.join()
+        # Our first batch is committed, and the rest of the
+        # application can add recipes while we import.
+        self.assertTrue(rd.fetch_one(rd.recipe_table,title='Committed 1'))
+        other = rd.add_rec({'title':'Added meanwhile'})
+        t = threading.Thread(target=self.i.finish_bulk_commit)
+        t.start(); t.join()
+        recs = self.i.added_recs[-3:]
+        self.assertEqual([r.title for r in recs],['Committed %s'%n for n in range(3)])
+        self.assertNotIn(other.id,[r.id for r in recs])
+        # The placeholder for the ID we didn't use is gone.
+        self.assertEqual(rd.get_rec(recs[-1].id+1),None)
+
+class TestXMLConverter (unittest.TestCase):
+
+    def setUp (self):
+        self.fn = os.path.join(os.path.dirname(__file__),
+                               'recipe_files','test_set.grmt')
+
+    def import_recs (self, conv):
+        conv.run()
+        return sorted((r.title,[i.item for i in conv.rd.get_ings(r)])
+                      for r in conv.added_recs)
+
+    def testStreamImport (self):
+        recs = self.import_recs(gxml2_importer.Converter(self.fn))
+        self.assertIn(('Amazing rice',['rice','Amazing Sauce','broth']),recs)
+        # We read streams a chunk at a time, without knowing how big
+        # they are.
+        rfd,wfd = os.pipe()
+        with open(self.fn,'rb') as ifi:
+            os.write(wfd,ifi.read())
+        os.close(wfd)
+        with open(rfd,'rb',buffering=0) as stream:
+            self.assertEqual(self.import_recs(gxml2_importer.Converter(stream)),recs)
+
+class TestMealmasterImporter (unittest.TestCase):
+
+    def setUp (self):
+        self.test_dir = os.path.join(os.path.dirname(__file__),'recipe_files')
+
+    def import_recs (self, fn, stream_lines=True):
+        imp = mealmaster_importer.mmf_importer(filename=fn)
+        imp.stream_lines = stream_lines
+        imp.pre_run()
+        imp.run()
+        return imp.added_recs
+
+    def testStreamImport (self):
+        for fn,test in [('mealmaster.mmf',mealmaster_importer_plugin.test_mmf),
+                        ('mealmaster_2_col.mmf',mealmaster_importer_plugin.test_2_col)]:
+            fn = os.path.join(self.test_dir,fn)
+            recs = self.import_recs(fn)
+            test(recs,fn)
+            self.assertEqual([r.title for r in recs],
+                             [r.title for r in self.import_recs(fn,stream_lines=False)])
+        # We can read a stream we can't seek in, too.
+        rfd,wfd = os.pipe()
+        with open(fn,'rb') as ifi:
+            os.write(wfd,ifi.read())
+        os.close(wfd)
+        with open(rfd,'rb',buffering=0) as stream:
+            test(self.import_recs(stream),fn)
+
+class LinesImporter (importer.Importer):
+
+    """Import one recipe per line, written as "title: item; item".
+    Items starting with @ refer to other recipes by title."""
+
+    def __init__ (self, filename):
+        self.fn = filename
+        importer.Importer.__init__(self)
+
+    def do_run (self):
+        if isinstance(self.fn,str):
+            ifi = open(self.fn)
+        else:
+            ifi = io.TextIOWrapper(self.fn)
+        with ifi:
+            for l in ifi:
+                title,items = l.split(':')
+                self.start_rec({'title':title,'id':title})
+                for item in items.split(';'):
+                    self.start_ing()
+                    item = item.strip()
+                    if item.startswith('@'):
+                        item = item[1:]
+                        self.add_ref(item)
+                    else:
+                        self.add_amt('1')
+                    self.add_item(item)
+                    self.commit_ing()
+                self.commit_rec()
+        importer.Importer.do_run(self)
+
+class LinesImporterPlugin (ImporterPlugin):
+
+    name = 'Lines'
+    patterns = ['*.txt']
+
+    def get_importer (self, filename):
+        return LinesImporter(filename)
+
+    def test_stream (self, name, head):
+        return b':' in head
+
+    def get_stream_importer (self, stream, name):
+        return LinesImporter(stream)
+
+class EncodedLinesImporter (LinesImporter):
+
+    """Import lines in whatever encoding check_encodings settles on."""
+
+    def pre_run (self):
+        self.fn = io.BytesIO('\n'.join(check_encodings.get_file(self.fn)).encode())
+
+class EncodedLinesImporterPlugin (LinesImporterPlugin):
+
+    name = 'Encoded Lines'
+
+    def get_importer (self, filename):
+        return EncodedLinesImporter(filename)
+
+class InteractiveLinesImporter (LinesImporter, NotThreadSafe):
+    pass
+
+class InteractiveLinesImporterPlugin (LinesImporterPlugin):
+
+    name = 'Interactive Lines'
+
+    def get_importer (self, filename):
+        return InteractiveLinesImporter(filename)
+
+class TestParallelImporter (unittest.TestCase):
+
+    def setUp (self):
+        self.plugin = LinesImporterPlugin()
+        self.tmpdir = tempfile.mkdtemp()
+
+    def write_files (self, nfiles, nrecs):
+        files = []
+        for n in range(nfiles):
+            fn = os.path.join(self.tmpdir,'%s.txt'%n)
+            with open(fn,'w') as ofi:
+                ofi.write('Sauce %s: butter; flour\n'%n)
+                for r in range(nrecs):
+                    ofi.write('Dish %s-%s: water; @Sauce %s; salt\n'%(n,r,n))
+            files.append((fn,self.plugin))
+        return files
+
+    def testParallelImport (self):
+        pi = importManager.ParallelImporter(self.write_files(4,3),processes=2)
+        pi.do_run()
+        recs = dict((r.title,r) for r in pi.added_recs)
+        self.assertEqual(len(recs),16)
+        for n in range(4):
+            ings = pi.rd.get_ings(recs['Dish %s-2'%n])
+            self.assertEqual([i.item for i in ings],['water','Sauce %s'%n,'salt'])
+            self.assertEqual(ings[0].amount,1)
+            self.assertEqual(ings[1].refid,recs['Sauce %s'%n].id)
+
+    def get_recs (self, importer):
+        """Return the recipes importer added, as a sorted list of
+        (title, [(amount, item, title of referenced recipe)])."""
+        recs = []
+        for r in importer.added_recs:
+            ings = [(i.amount,i.item,i.refid and importer.rd.get_rec(i.refid).title)
+                    for i in importer.rd.get_ings(r)]
+            recs.append((r.title,ings))
+        return sorted(recs)
+
+    def testParallelMatchesSerial (self):
+        files = self.write_files(3,4)
+        serial = []
+        for fn,plugin in files:
+            serial_importer = plugin.get_importer(fn)
+            serial_importer.bulk_commit = True
+            serial_importer.run()
+            serial.extend(self.get_recs(serial_importer))
+        pi = importManager.ParallelImporter(files,processes=2)
+        pi.do_run()
+        self.assertEqual(self.get_recs(pi),sorted(serial))
+
+    def testArchiveImport (self):
+        fn = os.path.join(self.tmpdir,'recipes.zip')
+        with zipfile.ZipFile(fn,'w') as zf:
+            zf.writestr('dinner/soup.txt','Soup: water; @Stock\nStock: bones\n')
+            zf.writestr('dinner/notes.txt','Nothing to see here.\n')
+        pi = importManager.ParallelImporter(
+            self.write_files(1,1) + [(fn,ArchiveImporterPlugin())],
+            processes=2)
+        pi.do_run()
+        recs = self.get_recs(pi)
+        self.assertEqual([title for title,ings in recs],
+                         ['Dish 0-0','Sauce 0','Soup','Stock'])
+        self.assertIn(('Soup',[(1,'water',None),(None,'Stock','Stock')]),recs)
+        self.assertEqual(pi.serial_files,[])
+
+    def testSerialFiles (self):
+        # Files whose importers aren't thread safe, or which we'd
+        # have to ask the user about, are left for post_run.
+        interactive = os.path.join(self.tmpdir,'interactive.txt')
+        with open(interactive,'w') as ofi:
+            ofi.write('Dish: water\n')
+        encoded = os.path.join(self.tmpdir,'encoded.txt')
+        with open(encoded,'wb') as ofi:
+            ofi.write(b'Cr\xe8me: milk\n')
+        files = [(interactive,InteractiveLinesImporterPlugin()),
+                 (encoded,EncodedLinesImporterPlugin())]
+        pi = importManager.ParallelImporter(files + self.write_files(1,1),processes=2)
+        pi.do_run()
+        self.assertEqual(sorted(pi.serial_files,key=lambda f: f[0]),sorted(files))
+        self.assertEqual([title for title,ings in self.get_recs(pi)],['Dish 0-0','Sauce 0'])
+
+class LinesImportManager:
+
+    importer_plugins = [LinesImporterPlugin()]
+    find_plugin = importManager.ImportManager.find_plugin
+
+class FileLinesImporterPlugin (LinesImporterPlugin):
+
+    """Import lines from files only, the way most of our plugins do,
+    keeping track of the files we're handed."""
+
+    get_stream_importer = ImporterPlugin.get_stream_importer
+
+    def __init__ (self):
+        self.filenames = []
+
+    def get_importer (self, filename):
+        self.filenames.append(filename)
+        return LinesImporter(filename)
+
+class TestArchiveImporter (unittest.TestCase):
+
+    def setUp (self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.files = {
+            'dinner/soup.txt':'Soup %s: water; @Stock %s\nStock %s: bones\n',
+            'dinner/notes.txt':'Nothing to see here.\n',
+            'README':'Soup %s: not a recipe file\n',
+            }
+
+    def check_import (self, ai, n):
+        ai.run()
+        recs = dict((r.title,r) for r in ai.added_recs)
+        self.assertEqual(sorted(recs),['Soup %s'%n,'Stock %s'%n])
+        ings = ai.rd.get_ings(recs['Soup %s'%n])
+        self.assertEqual(ings[1].refid,recs['Stock %s'%n].id)
+
+    def testTempfilesRemoved (self):
+        fn = os.path.join(self.tmpdir,'recipes.zip')
+        with zipfile.ZipFile(fn,'w') as zf:
+            for name,text in self.files.items():
+                zf.writestr(name,text.replace('%s','zip'))
+        plugin = FileLinesImporterPlugin()
+        serial_plugin = InteractiveLinesImporterPlugin()
+        serial_plugin.parse_in_worker = False
+        serial_plugin.patterns = ['README']
+        import_manager = LinesImportManager()
+        import_manager.importer_plugins = [plugin,serial_plugin]
+        ai = ArchiveImporter(fn,import_manager=import_manager)
+        self.check_import(ai,'zip')
+        # Our member importer's copy of soup.txt is gone...
+        self.assertEqual(len(plugin.filenames),1)
+        self.assertFalse(os.path.exists(plugin.filenames[0]))
+        # ...and the copy of README we left for post_run goes once
+        # it's been imported.
+        self.assertEqual(ai.serial_tempfiles,[sfn for sfn,p in ai.serial_files])
+        readme = ai.serial_tempfiles[0]
+        serial_importer = serial_plugin.get_importer(readme)
+        serial_importer.tempfiles.append(readme)
+        serial_importer.run()
+        self.assertEqual([r.title for r in serial_importer.added_recs],['Soup zip'])
+        self.assertFalse(os.path.exists(readme))
+
+    def testZipImport (self):
+        fn = os.path.join(self.tmpdir,'recipes.zip')
+        with zipfile.ZipFile(fn,'w') as zf:
+            for name,text in self.files.items():
+                zf.writestr(name,text.replace('%s','zip'))
+        self.check_import(ArchiveImporter(fn,import_manager=LinesImportManager()),'zip')
+
+    def testTarballImport (self):
+        fn = os.path.join(self.tmpdir,'recipes.tar.gz')
+        with tarfile.open(fn,'w:gz') as tf:
+            for name,text in self.files.items():
+                data = text.replace('%s','tar').encode()
+                info = tarfile.TarInfo(name)
+                info.size = len(data)
+                tf.addfile(info,io.BytesIO(data))
+        # Read the tarball from a pipe, so we can't seek in it.
+        rfd,wfd = os.pipe()
+        with open(fn,'rb') as ifi:
+            os.write(wfd,ifi.read())
+        os.close(wfd)
+        with open(rfd,'rb',buffering=0) as stream:
+            self.check_import(ArchiveImporter(stream,import_manager=LinesImportManager()),'tar')
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,259 @@
+import gzip
+import os
+import sqlite3
+import tempfile
+import unittest
+
+from gourmet import convert
+from gourmet.plugins.nutritional_information import databaseGrabber, nutritionLinker
+from gourmet.plugins.nutritional_information.nutrition import (
+    NutritionData, NutritionIndex, NutritionInfo, NutritionInfoList, NutritionVapor)
+
+
+class Row:
+    """A stand-in for a row of the nutrition table."""
+
+    def __init__ (self, desc, **values):
+        self.desc = desc
+        self.__dict__.update(values)
+
+    def __getattr__ (self, attr):
+        # Columns we have no value for are NULL.
+        return None
+
+
+class FakeDB:
+    """A stand-in for our database, with just the nutrition tables,
+    which counts our queries."""
+
+    nutrition_table = 'nutrition'
+    nutritionaliases_table = 'nutritionaliases'
+    nutritionconversions_table = 'nutritionconversions'
+    usda_weights_table = 'usda_weights'
+
+    def __init__ (self):
+        self.queries = 0
+        self.transactions = 0
+        self.ingkey_counts = []
+        self.tables = {
+            'nutrition':[Row('CARROTS,RAW',ndbno=1,kcal=41)],
+            'nutritionaliases':[Row('',ingkey='carrot',ndbno=1)],
+            'nutritionconversions':[],
+            'usda_weights':[Row('',ndbno=1,amount=1,unit='cup, chopped',gramwt=128)],
+            }
+
+    def fetch_all (self, table, **criteria):
+        self.queries += 1
+        return [r for r in self.tables[table]
+                if all(getattr(r,k) == v for k,v in criteria.items())]
+
+    def fetch_one (self, table, **criteria):
+        rows = self.fetch_all(table,**criteria)
+        return rows and rows[0] or None
+
+    def update_by_criteria (self, table, criteria, values):
+        for r in self.fetch_all(table,**criteria):
+            self.do_modify(table,r,values)
+
+    def do_modify (self, table, row, values, id_col='id'):
+        # Like database rows, ours don't change once we've fetched them.
+        rows = self.tables[table]
+        new_row = Row(row.desc)
+        new_row.__dict__.update(row.__dict__,**values)
+        rows[rows.index(row)] = new_row
+
+    def do_add (self, table, values):
+        self.tables[table].append(Row('',**values))
+
+    def begin_fast_adds (self):
+        self.transactions += 1
+
+    def do_add_many_fast (self, table, dics):
+        for d in dics: self.do_add(table,d)
+
+    def commit_fast_adds (self):
+        pass
+
+    def get_ingkeys_with_count (self):
+        return self.ingkey_counts
+
+class FakeNutritionData:
+
+    def __init__ (self, nutinfo):
+        self.nutinfo = nutinfo
+
+    def get_nutinfo_for_item (self, key, amt, unit, ingObject=None):
+        return self.nutinfo * amt
+
+
+class TestNutritionInfo (unittest.TestCase):
+
+    def setUp (self):
+        self.carrot = NutritionInfo(Row('CARROTS,RAW',kcal=41,protein=0.9))
+        self.eggplant = NutritionInfo(Row('EGGPLANT,RAW',kcal=24,sugar=3.5))
+
+    def testSums (self):
+        self.assertEqual(self.carrot.kcal,41)
+        self.assertEqual((self.carrot + self.eggplant).kcal,65)
+        self.assertEqual((self.carrot * 3 + self.eggplant).kcal,147)
+        self.assertEqual((self.carrot * 3 + self.eggplant).sugar,3.5)
+        self.assertEqual((self.carrot + self.eggplant).desc,
+                         'CARROTS,RAW, EGGPLANT,RAW')
+
+    def testNestedLists (self):
+        vapor = NutritionVapor(FakeNutritionData(self.carrot),'carrot',amount=2)
+        soup = NutritionInfoList([self.carrot * 2,vapor])
+        meal = NutritionInfoList([soup,self.eggplant])
+        self.assertEqual(meal.kcal,41*2 + 24)
+        self.assertEqual(meal._get_vapor(),[vapor])
+        self.assertEqual(meal.recursive_length(),3)
+        # Adding lists joins them, rather than nesting one in the other.
+        self.assertEqual(len(meal + soup),4)
+        self.assertEqual((meal + soup).kcal,(41*2 + 24) + 41*2)
+        soup._reset()
+        self.assertEqual(soup.kcal,41*4)
+        self.assertEqual(soup._get_vapor(),[])
+        # Resetting a list changes the sums of the lists it's in...
+        self.assertEqual(meal.kcal,41*4 + 24)
+        # ...and resetting those resets the lists within them.
+        vapor = NutritionVapor(FakeNutritionData(self.carrot),'carrot',amount=1)
+        meal = NutritionInfoList([NutritionInfoList([vapor]),self.eggplant])
+        self.assertEqual(meal.kcal,24)
+        meal._reset()
+        self.assertEqual(meal.kcal,41 + 24)
+        self.assertEqual(meal._get_vapor(),[])
+
+
+class TestNutritionData (unittest.TestCase):
+
+    def setUp (self):
+        self.db = FakeDB()
+        self.nd = NutritionData(self.db,convert.get_converter())
+
+    def testCache (self):
+        kcal = self.nd.get_nutinfo_for_item('carrot',2,'cup').kcal
+        # We get our density from the weight of a cup of chopped carrot.
+        self.assertAlmostEqual(kcal,41*2.56,delta=5)
+        queries = self.db.queries
+        self.assertAlmostEqual(self.nd.get_nutinfo_for_item('carrot',1,'cup').kcal,
+                               kcal/2)
+        self.assertEqual(self.db.queries,queries)
+
+    def testInvalidation (self):
+        self.assertFalse(self.nd.get_nutinfo_for_item('carrot',1,'stick'))
+        # A stick of carrot weighs 61 g.
+        self.nd.set_conversion('carrot','stick',1/61)
+        self.assertAlmostEqual(self.nd.get_nutinfo_for_item('carrot',1,'stick').kcal,
+                               41*0.61)
+        self.db.tables['nutrition'].append(Row('PARSNIPS,RAW',ndbno=2,kcal=75))
+        self.nd.set_key_from_ndbno('carrot',2)
+        self.assertEqual(self.nd.get_nutinfo('carrot').kcal,75)
+
+    def testMatches (self):
+        self.assertEqual(self.nd.get_matches('raw carrots'),[('CARROTS,RAW',1)])
+        self.assertEqual(self.nd.get_matches_for_keys(['carrot','parsnip']),
+                         {'carrot':[('CARROTS,RAW',1)],'parsnip':[]})
+
+
+class TestNutritionIndex (unittest.TestCase):
+
+    def setUp (self):
+        self.index = NutritionIndex([
+            Row('CAKE,CARROT,DRY MIX',ndbno=1),
+            Row('CARROTS,CND,REG PK,SOL&LIQUIDS',ndbno=2),
+            Row('CARROTS,RAW',ndbno=3),
+            Row('SOUP,CHICKEN NOODLE,CND',ndbno=4),
+            Row('CHICKEN,BROILERS OR FRYERS,MEAT ONLY,RAW',ndbno=5),
+            ])
+
+    def testSearch (self):
+        # Plain carrots come before canned ones, then carrot cake.
+        self.assertEqual(self.index.search('carrot'),[3,2,1])
+        self.assertEqual(self.index.search('carrots',limit=2),[3,2])
+        # We only get the rows that match the most words.
+        self.assertEqual(self.index.search('raw chicken meat'),[5])
+        self.assertEqual(self.index.search('chicken stock'),[5,4])
+        self.assertEqual(self.index.search('stock'),[])
+
+    def testPrefix (self):
+        self.assertEqual(self.index.search('chick'),[5,4])
+        self.assertEqual(self.index.search('noodle soups'),[4])
+
+    def testBestMatch (self):
+        # Plain carrots are the only short description.
+        self.assertEqual(self.index.best_match('carrots'),3)
+        self.assertEqual(self.index.best_match('raw chicken'),5)
+        # We don't link to matches of just some of our words...
+        self.assertEqual(self.index.best_match('chicken stock'),None)
+        # ...or to partial words...
+        self.assertEqual(self.index.best_match('chick'),None)
+        # ...or to things that aren't the food described.
+        self.assertEqual(self.index.best_match('noodles'),None)
+        self.index.add(6,'CARROTS,FROZEN')
+        self.assertEqual(self.index.best_match('carrot'),None)
+
+    def testAdd (self):
+        self.assertEqual(self.index.search('parsnip'),[])
+        self.index.add(6,'PARSNIPS,RAW')
+        self.assertEqual(self.index.search('parsnip'),[6])
+        self.assertEqual(self.index.search('raw'),[3,6,5])
+
+
+class TestDatabaseGrabber (unittest.TestCase):
+
+    def setUp (self):
+        self.tmpdir = tempfile.mkdtemp()
+        data_dir = os.path.join(os.path.dirname(__file__),'..','data')
+        # Copy butter's lines out of each of our USDA files.
+        for fn in ['ABBREV.txt','FOOD_DES.txt','WEIGHT.txt']:
+            with open(os.path.join(data_dir,fn),'rb') as ifi:
+                lines = [l for l in ifi if l.startswith(b'~01001~')]
+            with open(os.path.join(self.tmpdir,fn),'wb') as ofi:
+                ofi.writelines(lines)
+
+    def testExpandAbbrevs (self):
+        self.assertEqual(databaseGrabber.expand_abbrevs('SOUP,CHILI BF,CND,PREP W/ EQ VOLUME H2O'),
+                         'SOUP,CHILI Beef,Canned,Prepared with  Equal VOLUME H2O')
+
+    def testPrebuilt (self):
+        fn = os.path.join(self.tmpdir,'nutrition.db.gz')
+        databaseGrabber.build_prebuilt(self.tmpdir,fn)
+        dbfn = os.path.join(self.tmpdir,'nutrition.db')
+        with gzip.open(fn) as ifi, open(dbfn,'wb') as ofi:
+            ofi.write(ifi.read())
+        conn = sqlite3.connect(dbfn)
+        self.assertEqual(conn.execute('SELECT ndbno, desc, foodgroup, kcal FROM nutrition').fetchall(),
+                         [(1001,'BUTTER,WITH SALT','Dairy & Egg Products',717)])
+        self.assertEqual(conn.execute('SELECT unit, gramwt FROM usda_weights WHERE seq = 4').fetchall(),
+                         [('stick',113)])
+
+
+class TestNutritionLinker (unittest.TestCase):
+
+    def setUp (self):
+        self.db = FakeDB()
+        self.db.tables['nutritionaliases'] = []
+        self.db.tables['nutrition'] += [Row('WATER,BOTTLED,GENERIC',ndbno=2),
+                                        Row('WATER,BOTTLED,PERRIER',ndbno=3)]
+        self.db.ingkey_counts = [(2,'carrot'),(3,'water'),(1,'cumin')]
+        self.nd = NutritionData(self.db,convert.get_converter())
+
+    def testLink (self):
+        self.assertEqual(self.nd.get_unlinked_keys(),['water','carrot','cumin'])
+        linker = nutritionLinker.NutritionLinker(self.nd)
+        linker.do_run()
+        self.assertEqual(linker.links,[('carrot',1)])
+        self.assertEqual(self.db.transactions,1)
+        self.assertEqual(self.nd.get_nutinfo('carrot').kcal,41)
+        # We leave the rest to the user, most used first.
+        self.assertEqual(linker.review_queue,
+                         [('water',[('WATER,BOTTLED,GENERIC',2),('WATER,BOTTLED,PERRIER',3)])])
+        self.assertEqual(self.nd.get_unlinked_keys(),['water','cumin'])
+
+    def testLinkedMeanwhile (self):
+        # The user links carrot while we're working...
+        self.db.do_add('nutritionaliases',{'ingkey':'carrot','ndbno':2})
+        self.nd.set_keys_from_ndbnos([('carrot',1),('cumin',2),('cumin',3)])
+        # ...so we keep their link, and only link each key once.
+        self.assertEqual(sorted((a.ingkey,a.ndbno) for a in self.db.tables['nutritionaliases']),
+                         [('carrot',2),('cumin',2)])
@@ -104,6 +104,7 @@ package_data = [
     'data/WEIGHT.txt',
     'data/FOOD_DES.txt',
     'data/ABBREV.txt',
+    'data/nutrition.db.gz',
     'data/nutritional_data_sr_version',
     'data/images/no_star.png',
     'data/images/reccard_edit.png',